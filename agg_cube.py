@@ -0,0 +1,188 @@
+'''
+Additive aggregation cube at Census block group grain, for rolling the
+report measures up to any geography (community area, ZIP, ward or custom
+splits) without rerunning generate_report.
+
+The cube holds one row per block group and one column per additive
+measure (HCV listing counts, rent sums, L-stop counts, bad landlord
+counts, population components and eviction counts). A rollup by a
+crosswalk of GEOID to area is a sparse matrix multiply.
+
+Usage:
+    python3 agg_cube.py build [--cube <cube file>]
+    python3 agg_cube.py rollup <crosswalk csv> <output csv> [--cube <cube file>]
+                        [--area-col AREA] [--weight-col WEIGHT]
+
+Aya Liu, Bhargavi Ganesh, Vedika Ahuja
+'''
+
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import generate_report
+
+CUBE_FILE = "processed_data/agg_cube.npz"
+# additive measures of the cube: the measures of the report spec and the
+# remaining population components
+CUBE_MEASURES = generate_report.NEIGH_MEASURES + ['asian_pop']
+
+
+class AggCube:
+    '''
+    Block group by measure matrix of additive measures.
+
+    '''
+    def __init__(self, geoids, measures, values):
+        '''
+        Constructor to initialize an AggCube object.
+
+        Inputs:
+            geoids (array of str): block group GEOIDs, one per row
+            measures (list of str): measure names, one per column
+            values (2d array of floats): measure values
+        '''
+        self.geoids = np.asarray(geoids, dtype=str)
+        self.measures = list(measures)
+        self.values = np.asarray(values, dtype=float)
+        self.row_of = pd.Index(self.geoids)
+
+    def save(self, filename):
+        '''
+        Save the cube as a numpy .npz file.
+        '''
+        np.savez_compressed(filename, geoids=self.geoids,
+                            measures=np.array(self.measures),
+                            values=self.values)
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Load a cube saved by AggCube.save.
+        '''
+        with np.load(filename) as f:
+            return cls(f['geoids'], list(f['measures']), f['values'])
+
+    def crosswalk_matrix(self, geoids, areas, weights=None):
+        '''
+        Build the sparse area by block group matrix of a crosswalk.
+
+        Inputs:
+            geoids (array of str): block group GEOID of each crosswalk row
+            areas (array): area of each crosswalk row
+            weights (array of floats): share of the block group's measures
+                assigned to the area (default 1), for block groups split
+                between areas
+        Returns: (tuple) the csr matrix and the area labels of its rows
+        '''
+        cols = self.row_of.get_indexer(np.asarray(geoids, dtype=str))
+        area_codes, area_labels = pd.factorize(pd.Series(areas), sort=True)
+        if weights is None:
+            weights = np.ones(len(cols))
+        weights = np.asarray(weights, dtype=float)
+        # block groups missing from the cube have nothing to add
+        keep = (cols >= 0) & (area_codes >= 0)
+        matrix = scipy.sparse.csr_matrix(
+            (weights[keep], (area_codes[keep], cols[keep])),
+            shape=(len(area_labels), len(self.geoids)))
+        return matrix, area_labels
+
+    def rollup(self, geoids, areas, weights=None, derived=True):
+        '''
+        Sum the measures of the cube by area.
+
+        Inputs:
+            geoids (array of str): block group GEOID of each crosswalk row
+            areas (array): area of each crosswalk row
+            weights (array of floats): optional crosswalk weights
+            derived (bool): add the derived ratios and flags of the report
+                            spec (generate_report.NEIGH_DERIVED and
+                            NEIGH_FLAGS)
+        Returns: (DataFrame) measures by area
+        '''
+        matrix, area_labels = self.crosswalk_matrix(geoids, areas, weights)
+        agg = pd.DataFrame(matrix @ self.values, index=area_labels,
+                           columns=self.measures)
+        if derived:
+            agg = generate_report.add_derived(agg)
+        return agg
+
+
+def build_cube(agg_df_by_geoid, measures=CUBE_MEASURES):
+    '''
+    Build the cube from a table of measures by block group. Block groups
+    without listings or Census data count as zero, as in the report's
+    groupby sums.
+
+    Inputs:
+        agg_df_by_geoid (DataFrame): measures by block group, with a GEOID
+                                     column
+        measures (list of str): measure columns
+    Returns: (AggCube)
+    '''
+    by_geoid = agg_df_by_geoid.groupby('GEOID')[measures].sum()
+    return AggCube(by_geoid.index.values, measures, by_geoid.values)
+
+
+def build_cube_from_sources(locator_database_csv, block_groups_csv):
+    '''
+    Build the cube for all block groups of the eviction data from the
+    locator database, without any geometry.
+
+    Inputs:
+        locator_database_csv (str): locator database filename
+        block_groups_csv (str): Census block group eviction data filename
+    Returns: (AggCube)
+    '''
+    locator_database = generate_report.read_locator_db(locator_database_csv)
+    ld_by_geoid = generate_report.aggregate_cha_by_geoid(locator_database)
+    block_group_df = generate_report.read_block_group_data(block_groups_csv)
+    by_geoid = block_group_df.merge(ld_by_geoid, how="outer", on="GEOID")
+    return build_cube(by_geoid)
+
+
+def read_crosswalk(filename, area_col, weight_col=None):
+    '''
+    Read a crosswalk csv of block group GEOID to area.
+
+    Inputs:
+        filename (str): csv with a GEOID column and an area column
+        area_col (str): name of the area column
+        weight_col (str): name of an optional weight column
+    Returns: (tuple) GEOIDs, areas and weights (None without weight_col)
+    '''
+    crosswalk = pd.read_csv(filename, dtype={'GEOID': str, area_col: str})
+    weights = crosswalk[weight_col].values if weight_col else None
+    return crosswalk['GEOID'].values, crosswalk[area_col].values, weights
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Build the block group aggregation cube or roll it up")
+    cube_file = argparse.ArgumentParser(add_help=False)
+    cube_file.add_argument("--cube", default=CUBE_FILE, help="cube filename")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    commands.add_parser("build", parents=[cube_file], 
+                        help="build the cube from the locator database and "
+                        "the block group eviction data")
+    rollup = commands.add_parser("rollup", parents=[cube_file],
+                                 help="roll the cube up by a crosswalk of "
+                                 "GEOID to area")
+    rollup.add_argument("crosswalk", help="crosswalk csv with a GEOID column")
+    rollup.add_argument("output", help="output csv filename")
+    rollup.add_argument("--area-col", default="area")
+    rollup.add_argument("--weight-col", default=None)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        cube = build_cube_from_sources(generate_report.LOCATOR_DB_CSV,
+                                       generate_report.BLOCK_GROUPS_CSV)
+        cube.save(args.cube)
+        print("wrote {} block groups to {}".format(len(cube.geoids),
+                                                    args.cube))
+    else:
+        cube = AggCube.load(args.cube)
+        geoids, areas, weights = read_crosswalk(args.crosswalk, args.area_col,
+                                                args.weight_col)
+        cube.rollup(geoids, areas, weights).to_csv(args.output)
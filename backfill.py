@@ -0,0 +1,162 @@
+'''
+Historical backfill: build the locator database of every archived CHA
+scrape snapshot.
+
+The data sources other than the listings (block group and Zillow geometry
+with their spatial indexes, eviction and rent index data, L-stops and
+problem landlords) are read and processed once. Snapshots are then built
+in parallel by a pool of processes that share the processed sources, each
+writing one database, the same as build_database would write for that
+snapshot. Snapshots whose database exists are skipped, so an interrupted
+backfill resumes where it stopped.
+
+Usage:
+    python3 backfill.py <output dir> <snapshot> [<snapshot> ...]
+                        [--workers N] [--force]
+
+Each database is written to <output dir>/<name>/locator_database.csv, where
+name is the snapshot's path below the snapshots' common directory (e.g.
+archive/2019-05/CHA_rental_data.obj is 2019-05_CHA_rental_data).
+
+Aya Liu, Bhargavi Ganesh, and Vedika Ahuja
+
+'''
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import build_database as bdb
+from process_cha_data import load_and_clean_cha
+
+DB_FILE = "locator_database.csv"
+# processed data sources and fuzzy match threshold of a worker process
+SOURCES = {}
+
+
+def backfill(snapshots, output_dir, workers=None, threshold=bdb.DEF_TS,
+             force=False, sources_files=None):
+    '''
+    Build the database of each snapshot.
+
+    Inputs:
+        snapshots (list of str): CHA rental data files (pickled listing
+                                 dictionaries or JSON lines files)
+        output_dir (str): output directory
+        workers (int): number of processes (default: number of CPUs)
+        threshold (float): landlord location fuzzy match threshold
+        force (bool): rebuild databases that exist
+        sources_files (dict): filenames of the other data sources, keyword
+                              arguments of build_database.read_sources
+                              (default: the build_database data sources)
+    Returns: (dict) snapshot to number of rows written, for the snapshots
+             built
+    '''
+    outputs = output_paths(snapshots, output_dir)
+    jobs = [(snapshot, outputs[snapshot]) for snapshot in snapshots
+            if force or not os.path.exists(outputs[snapshot])]
+    print("Backfilling {} of {} snapshots...".format(len(jobs),
+                                                     len(snapshots)))
+    if not jobs:
+        return {}
+
+    print("Reading data sources...")
+    os.makedirs(output_dir, exist_ok=True)
+    if sources_files is None:
+        sources_files = {
+            "evictions_data": bdb.EVICTIONS_DATA,
+            "zillow_data": bdb.ZILLOW_DATA,
+            "lstops_data": bdb.L_STOPS_DATA,
+            "bad_landlords_data": bdb.BAD_LL_DATA,
+            "blocks_geofile": bdb.BLOCKS_GEOFILE,
+            "zillow_geofile": bdb.ZILLOW_GEOFILE}
+    sources_files = dict(sources_files, zillow_with_inc_output=os.path.join(
+        output_dir, "zillow_rindex_with_increase.csv"))
+    sources = bdb.read_sources(**sources_files)
+    # build the spatial indexes once, before the workers fork
+    sources["blocks"].sindex
+    sources["zillow_neighborhoods"].sindex
+
+    # forked workers share the sources with the parent; other start
+    # methods pickle them once per worker
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "fork" if "fork" in methods else None)
+    rows = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, mp_context=context,
+                             initializer=init_worker,
+                             initargs=(sources, threshold)) as builders:
+        for (snapshot, output), n in zip(
+                jobs, builders.map(build_snapshot, *zip(*jobs))):
+            rows[snapshot] = n
+            print("{}: {} rows in {}".format(snapshot, n, output))
+    print("Built {} snapshots in {:.1f} s".format(
+        len(jobs), time.perf_counter() - start))
+    return rows
+
+
+def output_paths(snapshots, output_dir):
+    '''
+    Database filename of each snapshot: <output dir>/<name>/DB_FILE, where
+    name is the snapshot's path below the snapshots' common directory,
+    without extension and with "_" for path separators.
+
+    Returns: (dict) snapshot to database filename
+    '''
+    paths = [os.path.abspath(snapshot) for snapshot in snapshots]
+    common = os.path.commonpath([os.path.dirname(path) for path in paths])
+    outputs = {}
+    for snapshot, path in zip(snapshots, paths):
+        name = os.path.splitext(os.path.relpath(path, common))[0]
+        name = name.replace(os.sep, "_")
+        outputs[snapshot] = os.path.join(output_dir, name, DB_FILE)
+    if len(set(outputs.values())) < len(outputs):
+        raise ValueError("Snapshots with the same output name")
+    return outputs
+
+
+def init_worker(sources, threshold):
+    '''
+    Initializes a backfill process with the processed data sources.
+    '''
+    SOURCES["sources"] = sources
+    SOURCES["threshold"] = threshold
+
+
+def build_snapshot(snapshot, database_output):
+    '''
+    Build the database of one snapshot from the worker's data sources, as
+    build_database does, and write it atomically.
+
+    Inputs:
+        snapshot (str): CHA rental data file
+        database_output (str): output csv filename
+    Returns: (int) number of rows written
+    '''
+    merged = bdb.assemble_units(load_and_clean_cha(snapshot),
+                                SOURCES["sources"], SOURCES["threshold"])
+    bdb.add_percentiles(merged)
+    bdb.format_db(merged)
+    os.makedirs(os.path.dirname(database_output), exist_ok=True)
+    tmp = database_output + ".tmp"
+    merged.to_csv(tmp)
+    os.replace(tmp, database_output)
+    return len(merged)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Build the locator database of archived CHA scrapes")
+    parser.add_argument("output_dir")
+    parser.add_argument("snapshots", nargs="+",
+                        help="CHA rental data files (.obj or .jsonl)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes (default: CPUs)")
+    parser.add_argument("--threshold", type=float, default=bdb.DEF_TS,
+                        help="landlord location fuzzy match threshold")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild databases that exist")
+    args = parser.parse_args()
+    backfill(args.snapshots, args.output_dir, args.workers, args.threshold,
+             args.force)
@@ -0,0 +1,86 @@
+'''
+Benchmark the html parsing backends of the CHA scraper over saved result
+pages, and check that every backend produces the same records.
+
+Usage:
+    python3 bench_parsers.py <saved pages directory> [--repeat N]
+
+Saved pages are html files such as those served by fixture_server.py.
+
+Aya Liu
+'''
+
+import argparse
+import glob
+import os
+import time
+import cha_scraper
+
+
+def load_pages(directory):
+    '''
+    Read the saved pages of a directory.
+
+    Input: directory (str)
+    Returns: (list of str) page contents
+    '''
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            pages.append(f.read())
+    return pages
+
+
+def parse_all(pages, backend):
+    '''
+    Parse all pages with one backend.
+
+    Inputs:
+        pages (list of str): page contents
+        backend (str): one of cha_scraper.BACKENDS
+    Returns: hd (dict): rental listing dictionary of all pages
+    '''
+    hd = {}
+    for html in pages:
+        page_hd, _ = cha_scraper.parse_page(html, backend=backend)
+        hd.update(page_hd)
+    return hd
+
+
+def benchmark(pages, repeat=3):
+    '''
+    Time each backend over the pages.
+
+    Inputs:
+        pages (list of str): page contents
+        repeat (int): number of timed runs per backend, the best is kept
+    Returns: (list of dicts) backend, pages per second and whether its
+             records are identical to those of the default backend
+    '''
+    reference = parse_all(pages, cha_scraper.DEF_BACKEND)
+    results = []
+    for backend in cha_scraper.BACKENDS:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            hd = parse_all(pages, backend)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append({"backend": backend,
+                        "pages_per_sec": len(pages) / best,
+                        "identical": hd == reference})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scraper's html parsing backends")
+    parser.add_argument("pages", help="directory of saved result pages")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    saved_pages = load_pages(args.pages)
+    print("{} pages".format(len(saved_pages)))
+    for r in benchmark(saved_pages, args.repeat):
+        print("{:<10} {:>10.1f} pages/s   identical records: {}".format(
+            r["backend"], r["pages_per_sec"], r["identical"]))
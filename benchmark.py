@@ -0,0 +1,245 @@
+'''
+Benchmark suite for the whole pipeline on synthetic cities
+(synthetic_city.py) of several sizes. Each stage is timed, and its peak
+Python memory is measured with tracemalloc in a second run. Results are
+saved as JSON with the git commit, for comparison between commits.
+
+Stages:
+    process_cha_data, compute_num_stations, flag_potential_bad_landlord,
+    build_database, search, report_tables
+
+Usage:
+    python3 benchmark.py [--scales 5000 50000] [--output <results json>]
+                         [--compare <previous results json>]
+
+Aya Liu, Bhargavi Ganesh, Vedika Ahuja
+'''
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import build_database as bdb
+import generate_report
+import transit_and_landlord as trl
+import user
+from process_cha_data import process_cha_data
+from synthetic_city import generate_city, DEF_SEED
+
+DEF_SCALES = [5000, 50000]
+DEF_SEARCHES = 100
+BENCHMARK_DIR = "benchmarks"
+
+
+def run_benchmark(scales=DEF_SCALES, seed=DEF_SEED, n_searches=DEF_SEARCHES,
+                  memory=True):
+    '''
+    Run every stage on a synthetic city of each scale.
+
+    Inputs:
+        scales (list of ints): numbers of listings
+        seed (int): synthetic city seed
+        n_searches (int): number of random searches in the search stage
+        memory (bool): also measure the peak memory of each stage
+    Returns: (list of dicts) one result per scale and stage
+    '''
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as work_dir:
+            city = generate_city(os.path.join(work_dir, "data"), scale, seed)
+            for stage, items, run in stages(city, work_dir, n_searches):
+                result = {"scale": scale, "stage": stage, "items": items}
+                result.update(measure(run, memory))
+                result["items_per_sec"] = items / result["seconds"]
+                results.append(result)
+                print("{:>8} {:<28} {:>9.3f} s {:>12.0f} /s {}".format(
+                    scale, stage, result["seconds"],
+                    result["items_per_sec"],
+                    "{:>9.1f} MB".format(result["peak_mb"])
+                    if memory else ""))
+    return results
+
+
+def stages(city, work_dir, n_searches):
+    '''
+    List the benchmark stages of a synthetic city.
+
+    Inputs:
+        city (dict): data source filenames from generate_city
+        work_dir (str): directory for stage outputs
+        n_searches (int): number of random searches
+    Returns: (list of tuples) stage name, number of items processed and a
+             function running the stage
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        cha = process_cha_data(city["cha"], city["blocks"],
+                               city["zillow_geo"])
+    database_output = os.path.join(work_dir, "locator_database.csv")
+    criteria = random_criteria(n_searches, np.random.default_rng(DEF_SEED))
+
+    def build():
+        bdb.build_database(city["cha"], city["evictions"], city["zillow"],
+                           city["lstops"], city["landlords"], city["blocks"],
+                           city["zillow_geo"],
+                           os.path.join(work_dir, "zillow_with_inc.csv"),
+                           database_output)
+
+    def search():
+        user.DB = pd.read_csv(database_output)
+        for c in criteria:
+            user.search(c, os.path.join(work_dir, "search.csv"))
+
+    def report():
+        generate_report.build_agg_tables(
+            database_output, city["evictions"], None, None,
+            *[os.path.join(work_dir, "table{}.csv".format(i))
+              for i in range(1, 4)],
+            None, tables_only=True, block_group_lookup=city["lookup"])
+
+    return [
+        ("process_cha_data", len(cha), lambda: process_cha_data(
+            city["cha"], city["blocks"], city["zillow_geo"])),
+        ("compute_num_stations", len(cha), lambda: trl.compute_num_stations(
+            cha, city["lstops"])),
+        ("flag_potential_bad_landlord", len(cha),
+         lambda: trl.flag_potential_bad_landlord(cha, city["landlords"],
+                                                 bdb.DEF_TS)),
+        ("build_database", len(cha), build),
+        ("search", n_searches, search),
+        ("report_tables", len(cha), report)]
+
+
+def random_criteria(n, rng):
+    '''
+    Draw random search criteria.
+
+    Inputs:
+        n (int): number of criteria
+        rng (Generator): numpy random generator
+    Returns: (list of Criteria)
+    '''
+    criteria = []
+    for _ in range(n):
+        c = user.Criteria()
+        lb_rent = int(rng.integers(500, 1500))
+        lb_bed = int(rng.integers(0, 4))
+        c.set_criteria({
+            "Monthly Rent": (lb_rent, lb_rent + int(rng.integers(100, 800))),
+            "Bed": (lb_bed, lb_bed + int(rng.integers(0, 3))),
+            "Property Type": [str(p) for p in
+                              rng.choice(user.PTYPES, 2, replace=False)]})
+        if rng.random() < .5:
+            c.set_criteria({"Has L-Stop within _ Mile": 0.5})
+        criteria.append(c)
+    return criteria
+
+
+def measure(run, memory=True):
+    '''
+    Time a stage, then measure its peak memory in a second run (tracemalloc
+    slows down the run it traces). Stage output is discarded.
+
+    Inputs:
+        run (function): stage
+        memory (bool): measure peak memory
+    Returns: (dict) seconds and, with memory, peak_mb
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        run()
+        result = {"seconds": time.perf_counter() - start}
+        if memory:
+            tracemalloc.start()
+            try:
+                run()
+                result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+            finally:
+                tracemalloc.stop()
+    return result
+
+
+def git_commit():
+    '''
+    Get the current git commit, or None outside a git checkout.
+    '''
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, filename=None):
+    '''
+    Save benchmark results with the git commit and environment.
+
+    Inputs:
+        results (list of dicts): from run_benchmark
+        filename (str): output JSON (default: benchmarks/<commit>.json)
+    Returns: (str) output filename
+    '''
+    commit = git_commit()
+    if filename is None:
+        filename = os.path.join(BENCHMARK_DIR,
+                                "{}.json".format(commit or "results"))
+    if os.path.dirname(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump({"commit": commit,
+                   "date": datetime.datetime.now().isoformat(),
+                   "python": platform.python_version(),
+                   "pandas": pd.__version__,
+                   "results": results}, f, indent=2)
+    return filename
+
+
+def compare(results, previous_file):
+    '''
+    Compare results with those saved by an earlier run.
+
+    Inputs:
+        results (list of dicts): from run_benchmark
+        previous_file (str): JSON saved by save_results
+    Returns: (DataFrame) seconds before and after, and speedup, by scale
+             and stage
+    '''
+    with open(previous_file) as f:
+        previous = json.load(f)["results"]
+    cols = ["scale", "stage", "seconds"]
+    table = pd.DataFrame(previous)[cols].merge(
+        pd.DataFrame(results)[cols], on=["scale", "stage"],
+        suffixes=("_before", "_after"))
+    table["speedup"] = table["seconds_before"] / table["seconds_after"]
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline on synthetic cities")
+    parser.add_argument("--scales", nargs="+", type=int, default=DEF_SCALES,
+                        help="numbers of listings")
+    parser.add_argument("--seed", type=int, default=DEF_SEED)
+    parser.add_argument("--searches", type=int, default=DEF_SEARCHES)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the peak memory runs")
+    parser.add_argument("--output", default=None,
+                        help="results JSON (default: benchmarks/<commit>.json)")
+    parser.add_argument("--compare", default=None,
+                        help="results JSON of an earlier run")
+    args = parser.parse_args()
+
+    bench_results = run_benchmark(args.scales, args.seed, args.searches,
+                                  not args.no_memory)
+    print("saved " + save_results(bench_results, args.output))
+    if args.compare:
+        print(compare(bench_results, args.compare).to_string(index=False))
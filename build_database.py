@@ -10,9 +10,16 @@ Create an affordable rental unit database from the following data sources:
 Aya Liu, Bhargavi Ganesh, and Vedika Ahuja
 
 '''
-import sys
+import argparse
+import functools
+import os
+import numpy as np
 import pandas as pd
-from process_cha_data import process_cha_data
+import locator_sqlite
+import shards
+import snapshot_store
+from process_cha_data import process_cha_data, process_cha_frame, \
+    load_and_clean_cha, read_blocks, read_zillow_neighborhoods
 import rent_and_eviction as rev
 import transit_and_landlord as trl
 pd.options.display.max_columns = 999
@@ -28,11 +35,27 @@ ZILLOW_GEOFILE = "data/ZillowNeighborhoods-IL.shp"
 
 # default threshold for landlord location fuzzy match
 DEF_TS = 0.015
+# thresholds of the landlord match calibration table
+CALIBRATION_TS = [0.005, 0.01, 0.015, 0.02, 0.03, 0.05, 0.1]
+# listings per partition of a chunked build
+DEF_CHUNK_SIZE = 20000
+
+# columns of each source added to the rental units
+EVICT_COLS = ['parent-location', 'population', 'renter-occupied-households',
+              'median-gross-rent', 'median-household-income',
+              'median-property-value', 'pct-white', 'pct-af-am',
+              'pct-hispanic', 'pct-am-ind', 'pct-asian', 'eviction-filings',
+              'evictions', 'eviction-rate', 'eviction-filing-rate']
+RINDEX_COLS = ["2011-2015", "2015-2019"]
+LANDLORD_COLS = ["potential_bad_landlord", "Address_ll"]
+TRANSIT_COLS = ["wi_quart_mi", "wi_half_mi", "wi_3_quart", "wi_1_mi"]
 
 
 def build_database(cha_data, evictions_data, zillow_data, lstops_data,
                    bad_landlords_data, blocks_geofile, zillow_geofile,
-                   zillow_with_inc_output, database_output, threshold=DEF_TS):
+                   zillow_with_inc_output, database_output, threshold=DEF_TS,
+                   calibration_output=None, sqlite_output=None,
+                   shard_dir=None, counties=rev.DEF_COUNTIES):
     '''
     Merge all data sources and write the merged dataset to a csv file
 
@@ -50,6 +73,16 @@ def build_database(cha_data, evictions_data, zillow_data, lstops_data,
             - zillow_with_inc_output: output filename for zillow data with
                                         computed rent increase rate
             - database_output: output filename for database created
+            - calibration_output: (optional) output filename for the table 
+                                  of landlord matches vs threshold
+            - sqlite_output: (optional) output filename for the SQLite
+                             store of the database
+            - shard_dir: (optional) directory of the city-sharded
+                         database, where this build's cities are added
+                         or replaced
+
+        counties: Eviction Lab parent locations (counties) of the housing
+                  authority's block groups
 
     Returns: (GeoDataFrame) merged dataset mapping rental units to
         - 2016 eviction rate and eviction filing rate (block-group level)
@@ -61,14 +94,18 @@ def build_database(cha_data, evictions_data, zillow_data, lstops_data,
     print("Processing housing data sources...")
     # process data of housing units, eviction rates, and rent index
     cha = process_cha_data(cha_data, blocks_geofile, zillow_geofile)
-    evict = rev.read_and_process_evictions(evictions_data)
+    evict = rev.read_and_process_evictions(evictions_data, counties)
     rindex = rev.read_and_process_rindex(zillow_data,
                                          zillow_with_inc_output)
 
     print("Flagging problem landlords...")
-    # flag units with potential bad landlords
-    cha_to_landlords = trl.flag_potential_bad_landlord(
-        cha, bad_landlords_data, threshold)
+    # flag units with potential bad landlords from the distance to the
+    # nearest one, computed once per unit for the flags and the calibration
+    landlords_df = trl.read_clean_landlords(bad_landlords_data)
+    units = cha[~cha.index.duplicated()]
+    nearest = trl.nearest_landlord(units, landlords_df)
+    cha_to_landlords = trl.flag_bad_landlords(units, landlords_df, threshold,
+                                              nearest)
 
     print("Computing transit access...")
     # compute transit access for each unit
@@ -76,73 +113,239 @@ def build_database(cha_data, evictions_data, zillow_data, lstops_data,
 
     print("Building the database...")
     # merge all processed data sources above
-    merged = merge_with_evict(cha, evict)
-    merged = merge_with_rindex(merged, rindex)
-    merged = merge_on_index(merged, cha_to_landlords)
-    merged = merge_on_index(merged, cha_to_transit)
+    merged = assemble_db(cha, evict, rindex, cha_to_landlords,
+                         cha_to_transit)
+    if calibration_output:
+        calibration = trl.landlord_calibration(units, landlords_df,
+                                               CALIBRATION_TS, nearest)
+        calibration.to_csv(calibration_output, index=False)
 
     # compute eviction rate percentiles
-    merged["er_percentile"] = merged["eviction-rate"].rank(pct=True)
-    merged["efr_percentile"] = merged["eviction-filing-rate"].rank(pct=True)
+    add_percentiles(merged)
 
     print("Saving the database...")
     # format and write to csv
     format_db(merged)
     merged.to_csv(database_output)
+    if sqlite_output or shard_dir:
+        # index the rows as user.search reads them from the csv
+        db = pd.read_csv(database_output)
+        if sqlite_output:
+            locator_sqlite.write_sqlite(db, sqlite_output)
+        if shard_dir:
+            shards.write_shards(db, shard_dir)
 
     print("Finished building database.")
     return merged
 
 
-def merge_with_evict(cha, evict):
+def build_database_chunked(cha_data, evictions_data, zillow_data,
+                           lstops_data, bad_landlords_data, blocks_geofile,
+                           zillow_geofile, zillow_with_inc_output,
+                           database_output, chunk_size=DEF_CHUNK_SIZE,
+                           threshold=DEF_TS, calibration_output=None,
+                           sqlite_output=None, shard_dir=None,
+                           counties=rev.DEF_COUNTIES):
     '''
-    Merge CHA rental unit data with eviction data.
+    Build the same database as build_database in partitions of chunk_size
+    listings, so peak memory is bounded by the chunk size rather than the
+    number of listings. The static sources (geography, eviction and rent
+    data, L-stops, problem landlords) are read once. Each partition goes
+    through the geography joins, transit counts, landlord flags and
+    eviction/Zillow merges, and is appended to a partial output file. The
+    eviction rate percentiles, which rank all units, are computed in a
+    final pass from the two rate columns kept per unit, while the partial
+    file is streamed to the output.
 
     Inputs:
-        cha: (DataFrame) CHA rental unit dataframe
-        evict: (DataFrame) Eviction Lab dataframe
+        as build_database, and
+        chunk_size (int): number of listings per partition
+
+    Returns: (int) number of rows written
+    '''
+    print("Reading data sources...")
+    cha = load_and_clean_cha(cha_data)
+    sources = read_sources(evictions_data, zillow_data, lstops_data,
+                           bad_landlords_data, blocks_geofile, zillow_geofile,
+                           zillow_with_inc_output, counties)
+
+    partial_output = database_output + ".partial"
+    rates = []
+    located = []
+    for start in range(0, len(cha), chunk_size):
+        print("Building listings {} to {} of {}...".format(
+            start, min(start + chunk_size, len(cha)), len(cha)))
+        merged = assemble_units(cha.iloc[start:start + chunk_size].copy(),
+                                sources, threshold)
+        rates.append(merged[["eviction-rate", "eviction-filing-rate"]])
+        located.append(merged[["Lat", "Long"]])
+        format_db(merged)
+        merged.to_csv(partial_output, mode="a" if start else "w",
+                      header=not start)
+        del merged
+
+    print("Computing eviction rate percentiles...")
+    rates = pd.concat(rates, ignore_index=True)
+    percentiles = {
+        "er_percentile": rates["eviction-rate"].rank(pct=True).values,
+        "efr_percentile": rates["eviction-filing-rate"].rank(
+            pct=True).values}
+    del rates
+    # the partial rows pass through as text, so they are written exactly
+    # as build_database writes them
+    rows = 0
+    for part in pd.read_csv(partial_output, dtype=str, keep_default_na=False,
+                            chunksize=chunk_size):
+        for col, values in percentiles.items():
+            part[col] = values[rows:rows + len(part)]
+        part.to_csv(database_output, mode="a" if rows else "w",
+                    header=not rows, index=False)
+        rows += len(part)
+    os.remove(partial_output)
+
+    if calibration_output:
+        calibration = trl.landlord_calibration(
+            pd.concat(located), sources["landlords"], CALIBRATION_TS)
+        calibration.to_csv(calibration_output, index=False)
+    if sqlite_output:
+        locator_sqlite.write_sqlite(
+            pd.read_csv(database_output, chunksize=chunk_size), sqlite_output)
+    if shard_dir:
+        shards.write_shards(
+            pd.read_csv(database_output, chunksize=chunk_size), shard_dir)
+
+    print("Finished building database.")
+    return rows
+
+
+def read_sources(evictions_data, zillow_data, lstops_data,
+                 bad_landlords_data, blocks_geofile, zillow_geofile,
+                 zillow_with_inc_output, counties=rev.DEF_COUNTIES):
+    '''
+    Read and process the data sources other than the CHA rental units, to
+    build databases of several sets of units from them.
+
+    Inputs:
+        as build_database
+
+    Returns: (dict) "blocks" and "zillow_neighborhoods" geometry,
+             processed "evict" and "rindex" data, cleaned "l_stations" and
+             problem "landlords"
+    '''
+    return {
+        "blocks": read_blocks(blocks_geofile),
+        "zillow_neighborhoods": read_zillow_neighborhoods(zillow_geofile),
+        "evict": rev.read_and_process_evictions(evictions_data, counties),
+        "rindex": rev.read_and_process_rindex(zillow_data,
+                                              zillow_with_inc_output),
+        "l_stations": trl.clean_L_stations(lstops_data),
+        "landlords": trl.read_clean_landlords(bad_landlords_data)}
+
 
+def assemble_units(cha, sources, threshold=DEF_TS):
     '''
-    evict_to_merge = evict[evict.year == '2016']
-    evict_to_merge = evict_to_merge[[
-        'GEOID', 'parent-location', 'population',
-        'renter-occupied-households', 'median-gross-rent',
-        'median-household-income', 'median-property-value', 'pct-white',
-        'pct-af-am', 'pct-hispanic', 'pct-am-ind', 'pct-asian',
-        'eviction-filings', 'evictions', 'eviction-rate',
-        'eviction-filing-rate']]
-    merged_with_ev = pd.merge(cha.reset_index(), evict_to_merge, on="GEOID",
-                              how="left")
-    return merged_with_ev
+    Process clean CHA rental units and assemble them with the data sources:
+    geography joins, problem landlord flags, transit access and the
+    eviction and Zillow data.
+
+    Inputs:
+        cha: (DataFrame) clean CHA rental units, from load_and_clean_cha
+        sources: (dict) from read_sources
+        threshold (float): landlord location fuzzy match threshold
+
+    Returns: (DataFrame) from assemble_db
+    '''
+    cha = process_cha_frame(cha, sources["blocks"],
+                            sources["zillow_neighborhoods"])
+    return assemble_db(
+        cha, sources["evict"], sources["rindex"],
+        trl.flag_bad_landlords(cha, sources["landlords"], threshold),
+        trl.count_stations(cha, sources["l_stations"]))
+
+
+def add_percentiles(merged):
+    '''
+    Add the eviction rate and eviction filing rate percentiles of each unit
+    among all units.
+    '''
+    merged["er_percentile"] = merged["eviction-rate"].rank(pct=True)
+    merged["efr_percentile"] = merged["eviction-filing-rate"].rank(pct=True)
 
 
-def merge_with_rindex(cha, rindex):
+def assemble_db(cha, evict, rindex, cha_to_landlords, cha_to_transit):
     '''
-    Merge CHA rental unit data with Zillow rent index data.
+    Assemble the CHA rental units with the eviction, rent index, problem
+    landlord and transit data, one row per unit.
+
+    Instead of a chain of merges, each copying the growing frame, the row
+    of each source matching each unit is looked up once (by GEOID, RegionID
+    and listing index) and only the needed columns are gathered by
+    position. Units without a match get missing values, as in a left merge,
+    and units matched to several block groups or problem landlords keep
+    the first match.
 
     Inputs:
-        cha: (DataFrame) CHA rental unit dataframe
+        cha: (DataFrame) processed CHA rental unit dataframe
+        evict: (DataFrame) Eviction Lab dataframe
         rindex: (DataFrame) Zillow rent index dataframe
+        cha_to_landlords: (DataFrame) from flag_potential_bad_landlord
+        cha_to_transit: (DataFrame) from compute_num_stations
 
+    Returns: (DataFrame) units with the listing index in the "index"
+             column, ready for format_db
     '''
-    rindex_to_merge = rindex[["RegionID", "2011-2015", "2015-2019"]]
-    merged_with_rindex = pd.merge(cha, rindex_to_merge, on="RegionID",
-                                  how="left")
-    return merged_with_rindex
+    evict = evict[evict.year == '2016']
+    # units on the boundary of two block groups are joined to both; keep
+    # the first
+    units = np.flatnonzero(~cha.index.duplicated())
+    if len(units) == len(cha):
+        units = None
+    listing_keys = unit_values(cha.index.astype(str), units)
+    sources = [
+        (evict, EVICT_COLS,
+         lookup_rows(unit_values(cha["GEOID"], units), evict["GEOID"])),
+        (rindex, RINDEX_COLS,
+         lookup_rows(unit_values(cha["RegionID"], units),
+                     rindex["RegionID"])),
+        (cha_to_landlords, LANDLORD_COLS,
+         lookup_rows(listing_keys, cha_to_landlords["ind_apt"].astype(str))),
+        (cha_to_transit, TRANSIT_COLS,
+         lookup_rows(listing_keys, cha_to_transit["ind_apt"].astype(str)))]
+
+    columns = {"index": unit_values(cha.index, units)}
+    for col in cha.columns:
+        columns[col] = unit_values(cha[col], units)
+    for source, source_cols, rows in sources:
+        for col in source_cols:
+            columns[col] = pd.api.extensions.take(
+                source[col].array, rows, allow_fill=True)
+    return pd.DataFrame(columns, copy=False)
+
+
+def unit_values(values, units):
+    '''
+    Values of a column of the CHA rental units at the kept rows (all rows,
+    without a copy, if units is None).
+    '''
+    if units is None:
+        return values.array
+    return values.array.take(units)
 
 
-def merge_on_index(df, df_to_merge):
+def lookup_rows(keys, source_keys):
     '''
-    Merge CHA rental unit data with another dataframe on listing index.
+    Find the position in a source of the first row with each key.
 
     Inputs:
-        df: (DataFrame) CHA rental unit dataframe
-        df_to_merge: (DataFrame) another dataframe
+        keys: (array-like) keys to look up, e.g. the GEOID of each unit
+        source_keys: (array-like) key of each row of the source
 
+    Returns: (numpy array) row positions, -1 for keys not in the source
     '''
-    df_to_merge.rename(columns={"ind_apt": "index"}, inplace=True)
-    merged = pd.merge(df, df_to_merge, on="index", how="left")
-    return merged
+    source_keys = pd.Index(source_keys)
+    first = ~source_keys.duplicated()
+    rows = source_keys[first].get_indexer(keys)
+    return np.where(rows >= 0, np.flatnonzero(first)[rows], -1)
 
 
 def format_db(df):
@@ -174,21 +377,69 @@ def main():
     Build, format, and stores database as csv.
     Returns nothing.
     '''
-    output_dir = sys.argv[1]
+    parser = argparse.ArgumentParser(
+        description="Build the rental unit locator database")
+    parser.add_argument("output_dir")
+    parser.add_argument("--sqlite", action="store_true",
+                        help="also write the database to an indexed SQLite "
+                        "store, locator_database.sqlite")
+    parser.add_argument("--shards", default=None, metavar="SHARD_DIR",
+                        help="also add the database's cities to a "
+                        "city-sharded database directory")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="build in partitions of this many listings, "
+                        "with memory bounded by the partition size")
+    parser.add_argument("--store", default=None, metavar="STORE_DIR",
+                        help="publish the database, calibration table and "
+                        "SQLite store as a new snapshot of a versioned store "
+                        "(snapshot_store.py) instead of writing them to "
+                        "output_dir")
+    parser.add_argument("--keep", type=int, default=snapshot_store.DEF_KEEP,
+                        help="number of most recent snapshots kept")
+    parser.add_argument("--counties", nargs="+", default=rev.DEF_COUNTIES,
+                        help="Eviction Lab counties of the housing "
+                        "authority, e.g. 'Cook County, Illinois'")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir
     zillow_with_inc_output = output_dir +"/zillow_rindex_with_increase.csv"
+    if args.store:
+        # readers see the snapshot only once it is published
+        output_dir = snapshot_store.stage(args.store)
     database_output = output_dir +"/locator_database.csv"
-
-    build_database(
-        CHA_DATA,
-        EVICTIONS_DATA,
-        ZILLOW_DATA,
-        L_STOPS_DATA,
-        BAD_LL_DATA,
-        BLOCKS_GEOFILE,
-        ZILLOW_GEOFILE,
-        zillow_with_inc_output,
-        database_output
-        )
+    calibration_output = output_dir +"/landlord_calibration.csv"
+    sqlite_output = output_dir + "/locator_database.sqlite" \
+        if args.sqlite else None
+
+    if args.chunk_size:
+        build = functools.partial(build_database_chunked,
+                                  chunk_size=args.chunk_size)
+    else:
+        build = build_database
+    try:
+        build(
+            CHA_DATA,
+            EVICTIONS_DATA,
+            ZILLOW_DATA,
+            L_STOPS_DATA,
+            BAD_LL_DATA,
+            BLOCKS_GEOFILE,
+            ZILLOW_GEOFILE,
+            zillow_with_inc_output,
+            database_output,
+            calibration_output=calibration_output,
+            sqlite_output=sqlite_output,
+            shard_dir=args.shards,
+            counties=args.counties
+            )
+        if args.store:
+            version = snapshot_store.publish(output_dir, args.store,
+                                             args.keep)
+            print("Published snapshot {} of {}".format(version, args.store))
+    finally:
+        if args.store:
+            # a failed build leaves no staging directory behind
+            snapshot_store.discard(output_dir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,237 @@
+'''
+Enriches scraped CHA listings with details that only live on each
+listing's detail page (utilities, deposit, accessibility).
+
+Detail pages are fetched with bounded concurrency and a per-host rate
+limit. Failed pages go to a retry queue. Fetched details are cached by
+listing id and a hash of the listing's content, so re-runs only fetch new
+or changed listings.
+
+Aya Liu
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import lxml.etree
+import lxml.html
+import http_client
+from process_cha_data import read_cha_jsonl
+
+# default enrichment settings: detail pages downloaded at once, minimum
+# seconds between two requests to the same host, and number of retry rounds
+# for failed pages
+DEF_CONCURRENCY = 8
+DEF_DELAY = 0.1
+DEF_RETRY_ROUNDS = 2
+# seconds to wait before a retry round, doubled for each further round
+DEF_RETRY_WAIT = 5
+# save the cache every this many fetched pages
+SAVE_EVERY = 100
+
+# labels on the detail page mapped to listing attributes
+DETAIL_LABELS = {"utilities": "Utilities",
+                 "utilities included": "Utilities",
+                 "deposit": "Deposit",
+                 "security deposit": "Deposit",
+                 "accessibility": "Accessibility",
+                 "accessibility features": "Accessibility"}
+LABEL_VALUE = re.compile(r"^\s*([A-Za-z ]+?)\s*:\s*(.+?)\s*$", re.S)
+
+
+def enrich_listings(hd, cache_file, fingerprints=None,
+                    concurrency=DEF_CONCURRENCY, delay=DEF_DELAY,
+                    retry_rounds=DEF_RETRY_ROUNDS, retry_wait=DEF_RETRY_WAIT,
+                    client=None):
+    '''
+    Add detail page attributes to each listing of a rental listing
+    dictionary, in place.
+
+    Inputs:
+        hd (dict): rental listing dictionary, mapping listing id to
+                   attributes including the detail page "URL"
+        cache_file (str): detail cache filename
+        fingerprints (dict): listing id to fingerprint from
+                             cha_scraper.scrape_delta(); by default the
+                             hash of the listing attributes is used
+        concurrency (int): maximum number of pages downloaded at once
+        delay (float): minimum seconds between two requests to a host
+        retry_rounds (int): number of retry rounds for failed pages
+        retry_wait (float): seconds to wait before the first retry round
+        client (HttpClient): http client (default: a client with
+                             concurrency pooled connections and delay)
+    Returns: (list) ids of listings whose detail page could not be fetched
+    '''
+    if client is None:
+        client = http_client.HttpClient(pool_size=concurrency, delay=delay)
+    cache = load_cache(cache_file)
+
+    to_fetch = {}
+    for l_id, listing in hd.items():
+        if not listing.get("URL"):
+            continue
+        content_hash = (fingerprints or {}).get(l_id) or hash_listing(listing)
+        cached = cache.get(l_id)
+        if cached and cached["hash"] == content_hash:
+            listing.update(cached["details"])
+        else:
+            to_fetch[l_id] = content_hash
+
+    print("{} detail pages cached, {} to fetch".format(
+        len(hd) - len(to_fetch), len(to_fetch)))
+    for attempt in range(retry_rounds + 1):
+        if not to_fetch:
+            break
+        if attempt:
+            time.sleep(retry_wait * 2 ** (attempt - 1))
+            print("Retrying {} detail pages".format(len(to_fetch)))
+        to_fetch = fetch_round(hd, to_fetch, cache, cache_file, client,
+                               concurrency)
+
+    save_cache(cache_file, cache)
+    return sorted(to_fetch)
+
+
+def fetch_round(hd, to_fetch, cache, cache_file, client, concurrency):
+    '''
+    Fetch one round of detail pages and cache their details.
+
+    Inputs:
+        hd (dict): rental listing dictionary
+        to_fetch (dict): listing id to content hash of listings to fetch
+        cache (dict): detail cache, updated in place
+        cache_file (str): detail cache filename
+        client (HttpClient): shared http client
+        concurrency (int): maximum number of pages downloaded at once
+    Returns: (dict) listing id to content hash of listings whose page could
+             not be fetched or parsed, i.e. the retry queue
+    '''
+    retry = {}
+    with ThreadPoolExecutor(concurrency) as fetchers:
+        futures = {fetchers.submit(client.get, hd[l_id]["URL"]): l_id
+                   for l_id in to_fetch}
+        for i, fut in enumerate(as_completed(futures)):
+            l_id = futures[fut]
+            try:
+                details = parse_details(fut.result())
+            except http_client.FetchError as e:
+                print("Error - " + str(e))
+                retry[l_id] = to_fetch[l_id]
+                continue
+            except (lxml.etree.LxmlError, ValueError) as e:
+                # an empty or malformed page, e.g. cut off by the server
+                print("Error - cannot parse {}: {}".format(hd[l_id]["URL"],
+                                                          e))
+                retry[l_id] = to_fetch[l_id]
+                continue
+            hd[l_id].update(details)
+            cache[l_id] = {"hash": to_fetch[l_id], "details": details}
+            if (i + 1) % SAVE_EVERY == 0:
+                save_cache(cache_file, cache)
+    return retry
+
+
+def parse_details(html):
+    '''
+    Parse the details of a listing from its detail page. Details are
+    labelled values, either "Label: value" in one element or a label
+    element followed by its value (e.g. <dt>/<dd> pairs).
+
+    Input: html (str): detail page content
+    Returns: (dict) attribute to value for the labels in DETAIL_LABELS
+             found on the page
+    '''
+    details = {}
+    tree = lxml.html.fromstring(html)
+    for el in tree.iter():
+        if not isinstance(el.tag, str) or el.tag in ("script", "style"):
+            continue
+        own_text = (el.text or "").strip()
+        label = own_text.rstrip(":").strip().lower()
+        if label in DETAIL_LABELS:
+            value = (el.tail or "").strip()
+            if not value and el.getnext() is not None:
+                value = el.getnext().text_content().strip()
+        else:
+            match = LABEL_VALUE.match(own_text)
+            if not match or match.group(1).lower() not in DETAIL_LABELS:
+                continue
+            label, value = match.group(1).lower(), match.group(2)
+        field = DETAIL_LABELS[label]
+        if value and field not in details:
+            details[field] = " ".join(value.split())
+    return details
+
+
+def hash_listing(listing):
+    '''
+    Hash the scraped attributes of a listing, standing in for its
+    fingerprint.
+    '''
+    scraped = {k: v for k, v in listing.items()
+               if k not in DETAIL_LABELS.values()}
+    return hashlib.sha1(json.dumps(scraped, sort_keys=True,
+                                   default=str).encode()).hexdigest()
+
+
+def load_cache(cache_file):
+    '''
+    Load the detail cache: listing id to {"hash": content hash,
+    "details": detail attributes}.
+    '''
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file) as f:
+        return json.load(f)
+
+
+def save_cache(cache_file, cache):
+    '''
+    Atomically replace the detail cache.
+    '''
+    http_client.atomic_write(cache_file, json.dumps(cache).encode())
+
+
+def load_listings(filename):
+    '''
+    Load a rental listing dictionary written by cha_scraper, either a
+    pickle or a JSON lines file (read as process_cha_data does, so a last
+    line torn by an interrupted scrape is skipped).
+    '''
+    if not filename.endswith(".jsonl"):
+        with open(filename, "rb") as f:
+            return pickle.load(f)
+    return read_cha_jsonl(filename)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Add detail page attributes to scraped CHA listings")
+    parser.add_argument("listings", help="scraped listings (pickle or jsonl)")
+    parser.add_argument("output", help="output pickle filename")
+    parser.add_argument("--cache", default="data/CHA_details_cache.json",
+                        help="detail cache filename")
+    parser.add_argument("--fingerprints", default=None,
+                        help="listing fingerprints file of the scrape")
+    parser.add_argument("--concurrency", type=int, default=DEF_CONCURRENCY)
+    parser.add_argument("--delay", type=float, default=DEF_DELAY,
+                        help="minimum seconds between two requests to a host")
+    parser.add_argument("--retry-rounds", type=int, default=DEF_RETRY_ROUNDS)
+    args = parser.parse_args()
+
+    listings = load_listings(args.listings)
+    fps = None
+    if args.fingerprints:
+        with open(args.fingerprints) as f:
+            fps = json.load(f)
+    failed = enrich_listings(listings, args.cache, fps, args.concurrency,
+                             args.delay, args.retry_rounds)
+    if failed:
+        print("{} detail pages could not be fetched".format(len(failed)))
+    with open(args.output, 'wb') as f:
+        pickle.dump(listings, f)
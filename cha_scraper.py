@@ -4,22 +4,65 @@ CHA's Find HCV Housing Listing Scraper
 Aya Liu
 '''
 
-import sys
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
 import re
 import pickle
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                wait, FIRST_COMPLETED)
 import bs4
+import lxml.html
+import http_client
 import util
 
 START_URL = "http://chicagoha.gosection8.com/Tenant/tn_Results.aspx"
 ROOT_URL = "http://chicagoha.gosection8.com"
 
+# default crawl settings: pages downloaded at once, and minimum seconds
+# between the start of two requests to the CHA site
+DEF_CONCURRENCY = 4
+DEF_DELAY = 0.5
 
-def scrape(url):
+# default number of fully unchanged pages in a row after which a delta
+# scrape stops paging
+DEF_STOP_AFTER = 3
+
+# html parsing backends: BeautifulSoup with html5lib (full page), with lxml
+# (restricted to the tags read by the scraper), or a direct lxml/XPath
+# extractor
+BACKENDS = ["html5lib", "lxml", "xpath"]
+DEF_BACKEND = "html5lib"
+
+LISTING_CLASS = re.compile("(listing)+[0-9]+")
+BED_ID = re.compile("Main.*Bed_+[0-9]*")
+
+# listing fingerprints of the previous scrape and parsing backend, set in
+# each parsing process
+PREV_FINGERPRINTS = {}
+BACKEND = DEF_BACKEND
+
+
+def scrape(url, root_url=ROOT_URL, concurrency=DEF_CONCURRENCY,
+           delay=DEF_DELAY, parse_workers=None, backend=DEF_BACKEND,
+           client=None):
     '''
     Scrape all rental listings starting from url all the way to the last page
     of the HCV housing locator.
 
-    Input: url (str): the starting url
+    Input:
+        url (str): the starting url
+        root_url (str): root url used to resolve relative links
+        concurrency (int): maximum number of pages downloaded at once
+        delay (float): minimum seconds between the start of two requests
+        parse_workers (int): number of parsing processes (default: one
+                             per cpu)
+        backend (str): html parsing backend, one of BACKENDS
+        client (HttpClient): http client to download pages with (default:
+            a client with concurrency pooled connections and the given
+            delay between requests)
     Returns: hd (dict): rental listing dictionary, mapping listing id to the
                     following attributes:
                 - address
@@ -31,50 +74,508 @@ def scrape(url):
                 - contact inf
                 - URL for the listing
     '''
+    hd = {}
+    for _, page_hd, _, _ in crawl(url, root_url, concurrency, delay,
+                                  parse_workers, backend=backend,
+                                  client=client):
+        hd.update(page_hd)
+    return hd
+
+
+def scrape_delta(url, prev_fingerprints, stop_after=DEF_STOP_AFTER,
+                 root_url=ROOT_URL, concurrency=DEF_CONCURRENCY,
+                 delay=DEF_DELAY, parse_workers=None, backend=DEF_BACKEND,
+                 client=None):
+    '''
+    Scrape only the listings that changed since the previous scrape.
+    Listings are compared by the fingerprint of their html block, and
+    unchanged listings are not parsed or geocoded. Paging stops early once
+    stop_after consecutive pages (in pager order) are fully unchanged.
+    Fingerprints are only comparable between scrapes using the same
+    backend.
+
+    Inputs:
+        url (str): the starting url
+        prev_fingerprints (dict): listing id to fingerprint from the
+                                  previous scrape ({} for a first scrape)
+        stop_after (int): number of fully unchanged pages in a row after
+                          which to stop paging, None to crawl all pages
+        root_url, concurrency, delay, parse_workers, backend, client:
+            see scrape()
+    Returns: delta (dict) with:
+        - added: (dict) rental listing dictionary of new listings
+        - changed: (dict) rental listing dictionary of changed listings
+        - removed: (list) ids of listings no longer listed. Only known when
+                   the crawl reached every page, empty otherwise.
+        - complete: (bool) whether the crawl reached every page, without
+                    stopping early or failing to fetch any page
+        - fingerprints: (dict) listing id to fingerprint, to be passed to
+                        the next scrape. Listings on pages skipped by an
+                        early stop keep their previous fingerprint.
+    '''
+    delta = {"added": {}, "changed": {}, "removed": [], "complete": True}
+    fingerprints = {}
+    failed = []
+    # pages finish in any order; the unchanged run is counted in the order
+    # the crawl found the pages (the start page, then each page's pager
+    # links in turn), over the pages crawled (or failed) without a gap
+    # from the start page
+    found = []
+    rank = {}
+    unchanged = {}
+    next_page, unchanged_run = 0, 0
+    for page_url, page_hd, _, page_fps in crawl(
+            url, root_url, concurrency, delay, parse_workers, (),
+            prev_fingerprints, backend, client, failed, found):
+        fingerprints.update(page_fps)
+        for l_id, listing in page_hd.items():
+            if l_id in prev_fingerprints:
+                delta["changed"][l_id] = listing
+            else:
+                delta["added"][l_id] = listing
+
+        for found_url in found[len(rank):]:
+            rank[found_url] = len(rank)
+        unchanged[rank[page_url]] = not page_hd
+        for failed_url in failed:
+            unchanged[rank[failed_url]] = False
+        while next_page in unchanged:
+            unchanged_run = unchanged_run + 1 if unchanged[next_page] else 0
+            next_page += 1
+            if stop_after and unchanged_run >= stop_after:
+                break
+        if stop_after and unchanged_run >= stop_after:
+            delta["complete"] = False
+            break
+
+    if failed:
+        # listings of pages that failed are not known to be removed
+        print("{} pages could not be fetched: {}".format(len(failed),
+                                                         failed))
+        delta["complete"] = False
+    if delta["complete"]:
+        delta["removed"] = sorted(set(prev_fingerprints) - set(fingerprints))
+    else:
+        fingerprints = dict(prev_fingerprints, **fingerprints)
+    delta["fingerprints"] = fingerprints
+    return delta
+
+
+def apply_delta(hd, delta):
+    '''
+    Update a rental listing dictionary from a previous scrape with the
+    delta of a later scrape.
+
+    Inputs:
+        hd (dict): rental listing dictionary of the previous scrape
+        delta (dict): delta returned by scrape_delta()
+    Returns: (dict) rental listing dictionary of the later scrape
+    '''
+    new_hd = dict(hd)
+    for l_id in delta["removed"]:
+        new_hd.pop(l_id, None)
+    new_hd.update(delta["added"])
+    new_hd.update(delta["changed"])
+    return new_hd
+
+
+def scrape_to_file(url, output, checkpoint, root_url=ROOT_URL,
+                   concurrency=DEF_CONCURRENCY, delay=DEF_DELAY,
+                   parse_workers=None, backend=DEF_BACKEND, client=None):
+    '''
+    Scrape all rental listings, appending each parsed page's listings to a
+    JSON lines file as the crawl goes, one listing per line with its id
+    under "id". After each page is written, a checkpoint of the completed
+    pages and the pages still to crawl is saved, and a crawl restarted
+    with the same output and checkpoint resumes from it, after truncating
+    the output to its size at the checkpoint. A crash between writing a
+    page and saving the checkpoint therefore re-scrapes that page on
+    resume, and a line torn by a crash is dropped. Pages that
+    cannot be downloaded stay pending, and the crawl raises FetchError
+    once all other pages are done; they are retried on resume.
+
+    Inputs:
+        url (str): the starting url
+        output (str): output JSON lines filename
+        checkpoint (str): checkpoint filename
+        root_url, concurrency, delay, parse_workers, backend, client:
+            see scrape()
+    Returns: (int) number of pages scraped by this run
+    '''
+    state = load_checkpoint(checkpoint)
+    if state is None:
+        state = {"last_page": None, "done": [], "pending": [url],
+                 "offset": 0}
+        open(output, "w").close()
+    if not state["pending"]:
+        print("Crawl already complete: " + checkpoint)
+        return 0
+    # drop what was written after the checkpoint, including a line torn by
+    # a crash, so new lines start on a line of their own
+    truncate_output(output, state.get("offset"))
+
+    done = set(state["done"])
+    frontier = set(state["pending"])
+    num_pages = 0
+    with open(output, "a") as f:
+        for page_url, page_hd, links, _ in crawl(
+                state["pending"], root_url, concurrency, delay,
+                parse_workers, done, backend=backend, client=client):
+            for l_id, listing in page_hd.items():
+                f.write(json.dumps(dict(listing, id=l_id)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+            done.add(page_url)
+            frontier.update(links)
+            frontier -= done
+            save_checkpoint(checkpoint, {"last_page": page_url,
+                                         "done": sorted(done),
+                                         "pending": sorted(frontier),
+                                         "offset": f.tell()})
+            num_pages += 1
+
+    return num_pages
+
+
+def truncate_output(output, offset=None):
+    '''
+    Truncate a JSON lines output to the byte offset saved in its checkpoint
+    or, for checkpoints without one, to the end of its last complete line.
+
+    Inputs:
+        output (str): output JSON lines filename
+        offset (int): size of the output when the checkpoint was saved
+    '''
+    if not os.path.exists(output):
+        open(output, "w").close()
+        return
+    with open(output, "rb+") as f:
+        if offset is None:
+            data = f.read()
+            offset = data.rfind(b"\n") + 1
+        f.truncate(offset)
+
+
+def load_checkpoint(checkpoint):
+    '''
+    Load a crawl checkpoint.
+
+    Input: checkpoint (str): checkpoint filename
+    Returns: (dict) checkpoint with the last completed page url, the urls
+             of completed pages and of pages still to crawl, or None if
+             there is no checkpoint yet
+    '''
+    if not os.path.exists(checkpoint):
+        return None
+    with open(checkpoint) as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint, state):
+    '''
+    Atomically replace the crawl checkpoint.
+
+    Inputs:
+        checkpoint (str): checkpoint filename
+        state (dict): checkpoint, see load_checkpoint()
+    '''
+    tmp = checkpoint + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, checkpoint)
+
+
+def crawl(urls, root_url=ROOT_URL, concurrency=DEF_CONCURRENCY,
+          delay=DEF_DELAY, parse_workers=None, done=(),
+          prev_fingerprints=None, backend=DEF_BACKEND, client=None,
+          failed=None, found=None):
+    '''
+    Crawl the result pages iteratively, starting from urls. Pages are
+    downloaded on a thread pool sharing one http client, and parsed on a
+    process pool while other pages download. Links to further result pages
+    are picked out of each page as soon as it is downloaded, so the crawl
+    is not held up by parsing. Pages that cannot be downloaded after
+    retries do not stop the crawl, but FetchError is raised at the end
+    instead of returning a silently truncated crawl.
+
+    Inputs:
+        urls (str or list): the starting url(s)
+        done (iterable): urls of pages already crawled, to be skipped
+        prev_fingerprints (dict): listing id to fingerprint of listings
+                                  that need not be parsed if unchanged
+        root_url, concurrency, delay, parse_workers, backend, client:
+            see scrape()
+        failed (list): if given, urls of pages that cannot be downloaded
+                       are appended to it as they fail, instead of
+                       raising FetchError at the end
+        found (list): if given, urls of the pages to crawl are appended to
+                      it as they are found: the starting urls, then the
+                      new pager links of each page as it is downloaded.
+                      A page is found before it is yielded or failed.
+    Yields: (page url, rental listing dictionary of the page, urls of the
+            result pages linked from the page, listing id to fingerprint
+            of all listings on the page) tuples, in the order pages finish
+            parsing. The crawl stops when the generator is closed.
+    '''
+    if isinstance(urls, str):
+        urls = [urls]
+    if client is None:
+        client = http_client.HttpClient(pool_size=concurrency, delay=delay)
+    seen = set(done) | set(urls)
+    if found is not None:
+        found.extend(url for url in urls if url not in done)
+    raise_failed = failed is None
+    if raise_failed:
+        failed = []
+    # parsing processes start while the fetch threads run, so they are not
+    # forked from this process (a fork copies locks held by other threads)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn")
+
+    with ThreadPoolExecutor(concurrency) as fetchers, \
+         ProcessPoolExecutor(parse_workers, mp_context=context,
+                             initializer=init_parser,
+                             initargs=(prev_fingerprints or {}, backend)) \
+         as parsers:
+        pending = {fetchers.submit(fetch_page, url, root_url, client):
+                   ("fetch", url, None) for url in urls}
+        try:
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    stage, page_url, links = pending.pop(fut)
+                    if stage == "parse":
+                        page_hd, page_fps = fut.result()
+                        yield page_url, page_hd, links, page_fps
+                        continue
+
+                    fetched = fut.result()
+                    if not fetched:
+                        failed.append(page_url)
+                        continue
+                    html, links = fetched
+                    print(page_url)
+                    for link in links:
+                        if link not in seen:
+                            seen.add(link)
+                            if found is not None:
+                                found.append(link)
+                            fut_next = fetchers.submit(
+                                fetch_page, link, root_url, client)
+                            pending[fut_next] = ("fetch", link, None)
+                    fut_parse = parsers.submit(parse_page, html, root_url)
+                    pending[fut_parse] = ("parse", page_url, links)
+        finally:
+            # stop early: drop the downloads and parses not started yet
+            for fut in pending:
+                fut.cancel()
+
+    if failed and raise_failed:
+        raise http_client.FetchError("{} pages could not be fetched: {}"
+                                     .format(len(failed), failed))
+
+
+def fetch_page(url, root_url, client):
+    '''
+    Download one result page and find the links to other result pages.
+
+    Inputs:
+        url (str): page url
+        root_url (str): root url used to resolve relative links
+        client (HttpClient): shared http client
+    Returns: (html, list of page urls) or None if the page cannot be read
+    '''
+    try:
+        html = client.get(url)
+    except http_client.FetchError as e:
+        print("Error - " + str(e))
+        return None
+
+    return html, find_page_links(html, root_url)
+
+
+def init_parser(prev_fingerprints, backend=DEF_BACKEND):
+    '''
+    Set the fingerprints of the previous scrape and the parsing backend in
+    a parsing process.
+
+    Input:
+        prev_fingerprints (dict): listing id to fingerprint
+        backend (str): html parsing backend, one of BACKENDS
+    '''
+    global PREV_FINGERPRINTS, BACKEND
+    PREV_FINGERPRINTS = prev_fingerprints
+    BACKEND = backend
+
+
+def parse_page(html, root_url=ROOT_URL, backend=None):
+    '''
+    Parse listing info and geocodes from the html of one page, skipping
+    listings whose fingerprint is unchanged since the previous scrape.
+
+    Inputs:
+        html (str): page content
+        root_url (str): root url used to resolve relative links
+        backend (str): html parsing backend, one of BACKENDS (default: the
+                       backend set by init_parser)
+    Returns:
+        hd (dict): rental listing dictionary of the new and changed
+                   listings of the page
+        fingerprints (dict): listing id to fingerprint of all listings of
+                             the page
+    '''
+    backend = backend or BACKEND
+    if backend == "xpath":
+        return parse_page_xpath(html, root_url)
 
     hd = {}
-    soup = url_to_soup(url)
-    print(url)
-    parse_listings(soup, hd)
+    soup = html_to_soup(html, backend)
+    fingerprints = fingerprint_listings(soup)
+    unchanged = {l_id for l_id, fp in fingerprints.items()
+                 if PREV_FINGERPRINTS.get(l_id) == fp}
+    parse_listings(soup, hd, root_url=root_url, skip=unchanged)
     add_geocode(soup, hd)
+    return hd, fingerprints
 
-    next_url = find_next_page(soup)
-    if not next_url:
-        return hd
 
-    hd_next = scrape(next_url)
-    hd.update(hd_next)
+def fingerprint_listings(soup):
+    '''
+    Fingerprint each listing on a page by hashing its html block.
 
-    return hd
+    Input:
+        soup (BeautifulSoup): a BeautifulSoup object from one page
+    Returns: (dict) listing id to fingerprint
+    '''
+    listings = soup.find_all("div", class_=LISTING_CLASS)
+    return {l["class"][0][7:]: hashlib.sha1(str(l).encode()).hexdigest()
+            for l in listings}
 
 
-def find_next_page(soup):
+def parse_page_xpath(html, root_url=ROOT_URL):
     '''
-    Find the url of next page.
+    Direct lxml/XPath extractor producing the same records as parse_page
+    with a BeautifulSoup backend, without building a soup.
 
     Inputs:
-        soup (BeautifulSoup): a BeautifulSoup object from one page
+        html (str): page content
+        root_url (str): root url used to resolve relative links
+    Returns: see parse_page()
+    '''
+    hd = {}
+    fingerprints = {}
+    tree = lxml.html.fromstring(html)
+    for l in tree.xpath("//div[@class]"):
+        classes = l.get("class").split()
+        if not any(LISTING_CLASS.search(c) for c in classes):
+            continue
+        l_id = classes[0][7:]
+        fingerprints[l_id] = hashlib.sha1(
+            lxml.html.tostring(l, encoding="unicode", with_tail=False).encode()
+            ).hexdigest()
+        if PREV_FINGERPRINTS.get(l_id) == fingerprints[l_id]:
+            continue
+
+        # get rent
+        rent_tag = l.xpath(".//b[{}]".format(xpath_has_class("rent")))[0]
+        rent = int(''.join(filter(str.isdigit, rent_tag.text_content())))
+
+        # get property info
+        bed_tag = [t for t in l.xpath(".//span[@id]")
+                   if BED_ID.search(t.get("id"))][0]
+        if bed_tag.text_content() == "Efficiency":
+            num_bed = 0
+        else:
+            num_bed = float(bed_tag.text_content())
+        num_bath = float(bed_tag.tail.split()[1])
+        ptype_tag = bed_tag.getnext()
+        ptype = ptype_tag.text_content()
+
+        # get voucher requirement
+        hcv_tag = ptype_tag.getparent().getnext()
+        if "novouchernecessary" in hcv_tag.get("class", "").split():
+            hcv_req = "No"
+        else:
+            hcv_req = "Yes"
+
+        # get availability and contact
+        avail = l.xpath(".//*[{}]".format(
+            xpath_has_class("availability")))[0].text_content()
+        if avail == "Available Now":
+            contact = l.xpath(".//*[@class='subbold contact-phone']")[0] \
+                .text_content()
+        else:
+            contact = None
+
+        # get address and details_url
+        address_tag = l.xpath(".//a[{}]".format(xpath_has_class("address")))[0]
+        address = address_tag.text_content()
+        details_url = util.convert_if_relative_url(root_url,
+                                                   address_tag.get("href"))
+
+        hd[l_id] = {
+            "Address": address,
+            "Monthly Rent": rent,
+            "Bed": num_bed,
+            "Bath": num_bath,
+            "Property Type": ptype,
+            "Voucher Necessary": hcv_req,
+            "Availability": avail,
+            "Contact": contact,
+            "URL": details_url}
+
+    script = tree.xpath("//script[contains(text(), 'googleMapsAPI')]")[0]
+    add_geocode_from_text(script.text, hd)
+    return hd, fingerprints
+
 
+def xpath_has_class(name):
     '''
-    tag = soup.find("a", class_="PagingPrevNextButton", text="Next »")
-    if tag:
-        url = tag["href"]
-        full_url = util.convert_if_relative_url(ROOT_URL, url)
-        return full_url
-    return None
+    XPath predicate matching elements having name among their classes.
+    '''
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')" \
+        .format(name)
+
 
-def parse_listings(soup, hd, debug=False):
+def find_page_links(html, root_url=ROOT_URL):
+    '''
+    Find the urls of the result pages linked from the pager of a page,
+    using a parse restricted to the pager links.
+
+    Inputs:
+        html (str): page content
+        root_url (str): root url used to resolve relative links
+    Returns: (list) absolute page urls
+    '''
+    strainer = bs4.SoupStrainer("a", class_=re.compile("^Paging"))
+    soup = bs4.BeautifulSoup(html, "html.parser", parse_only=strainer)
+    links = []
+    for tag in soup.find_all("a", href=True):
+        if tag["href"].startswith("javascript:"):
+            continue
+        full_url = util.convert_if_relative_url(root_url, tag["href"])
+        if full_url:
+            links.append(full_url)
+    return links
+
+
+def parse_listings(soup, hd, debug=False, root_url=ROOT_URL, skip=()):
     '''
     Parse listing info from one page.
 
     Inputs:
         soup (BeautifulSoup): a BeautifulSoup object from one page
         hd (dict): rental listing dictionary
+        root_url (str): root url used to resolve relative links
+        skip (set): ids of listings not to parse
     '''
-    listings = soup.find_all("div", class_=re.compile("(listing)+[0-9]+"))
+    listings = soup.find_all("div", class_=LISTING_CLASS)
 
     for l in listings:
         l_id = l["class"][0][7:]
+        if l_id in skip:
+            continue
         if debug:
             print(l_id)
         # get rent
@@ -82,7 +583,7 @@ def parse_listings(soup, hd, debug=False):
         rent = int(''.join(filter(str.isdigit, rent_tag.text)))
 
         # get property info
-        bed_tag = l.find_all("span", id=re.compile("Main.*Bed_+[0-9]*"))[0]
+        bed_tag = l.find_all("span", id=BED_ID)[0]
         if bed_tag.text == "Efficiency":
             num_bed = 0
         else:
@@ -94,7 +595,7 @@ def parse_listings(soup, hd, debug=False):
 
         # get voucher requirement
         hcv_tag = ptype_tag.parent.next_sibling.next_sibling
-        if hcv_tag["class"] == "novouchernecessary":
+        if "novouchernecessary" in hcv_tag["class"]:
             hcv_req = "No"
         else:
             hcv_req = "Yes"
@@ -109,7 +610,7 @@ def parse_listings(soup, hd, debug=False):
         # get address and details_url
         address_tag = l.find("a", class_="address")
         address = address_tag.text
-        details_url = util.convert_if_relative_url(ROOT_URL,
+        details_url = util.convert_if_relative_url(root_url,
                                                    address_tag["href"])
 
         # update dict
@@ -128,44 +629,153 @@ def parse_listings(soup, hd, debug=False):
 def add_geocode(soup, hd):
     '''
     Add lat, long attributes to rental unit dictionary based on the
-    googleMapsAPIKey tag from the html.
+    googleMapsAPIKey tag from the html. Listings not in the dictionary
+    are skipped.
 
     Inputs:
         soup (BeautifulSoup): a BeautifulSoup object from one page
         hd (dict): rental listing dictionary mapping listing id to attributes
     '''
-    s = soup.find('script', text=re.compile(r'.*googleMapsAPI.*')).text
+    # .string, as newer bs4 versions leave script contents out of .text
+    s = soup.find('script', text=re.compile(r'.*googleMapsAPI.*')).string
+    add_geocode_from_text(s, hd)
+
+
+def add_geocode_from_text(s, hd):
+    '''
+    Add lat, long attributes to rental unit dictionary from the text of
+    the googleMapsAPIKey script. Listings not in the dictionary are
+    skipped.
+
+    Inputs:
+        s (str): script text
+        hd (dict): rental listing dictionary mapping listing id to attributes
+    '''
     sl = s.split()
     start = sl.index("[") + 3 # first listing id
     end = sl.index("];") - 4 + 1 # last listing id
     for i in range(start, end, 6):
         l_id = sl[i][1:-2]
+        if l_id not in hd:
+            continue
         hd[l_id]["Lat"] = float(sl[i-2][1:-1])
         hd[l_id]["Long"] = float(sl[i-1][1:-1])
 
 
-def url_to_soup(url):
+def url_to_soup(url, backend=DEF_BACKEND, client=None):
     '''
-    Read a url into a BeautifulSoup object.
+    Read a url into a BeautifulSoup object. Raises FetchError if the page
+    cannot be fetched.
 
-    Input: url (str)
+    Input:
+        url (str)
+        backend (str): BeautifulSoup backend, "html5lib" or "lxml"
+        client (HttpClient): http client (default: a new client)
     Returns:
         soup (BeautifulSoup): a BeautifulSoup object
-        req_url (str): the request url
     '''
-    request = util.get_request(url)
-    if not request:
-        print("Error - Cannot get request")
-        return None
-    html = util.read_request(request)
-    if not html:
-        print("Error - Cannot read request")
-        return None
+    client = client or http_client.HttpClient()
+    return html_to_soup(client.get(url), backend)
+
 
+def html_to_soup(html, backend=DEF_BACKEND):
+    '''
+    Parse html into a BeautifulSoup object.
+
+    Input:
+        html (str): page content
+        backend (str): "html5lib" parses the full page. "lxml" is much
+            faster and only keeps the listing divs, scripts and pager
+            links, which is all the scraper reads.
+    Returns: soup (BeautifulSoup): a BeautifulSoup object
+    '''
+    if backend == "lxml":
+        strainer = bs4.SoupStrainer(is_scraped_tag)
+        return bs4.BeautifulSoup(html, features="lxml", parse_only=strainer)
     return bs4.BeautifulSoup(html, features="html5lib")
 
 
+def is_scraped_tag(name, attrs):
+    '''
+    SoupStrainer filter keeping the tags read by the scraper: listing
+    divs, scripts (for geocodes) and pager links.
+    '''
+    if name == "script":
+        return True
+    classes = attrs.get("class", "")
+    if not isinstance(classes, str):
+        classes = " ".join(classes)
+    if name == "div":
+        return any(LISTING_CLASS.search(c) for c in classes.split())
+    if name == "a":
+        return classes.startswith("Paging")
+    return False
+
+
 if __name__ == '__main__':
-    hd = scrape(START_URL)
-    f = open(sys.argv[1], 'wb')
-    pickle.dump(hd, f)
+    parser = argparse.ArgumentParser(
+        description="Scrape CHA's HCV Housing Finder listings")
+    parser.add_argument("output", help="output filename; a .jsonl output "
+                        "is written page by page and can be resumed")
+    parser.add_argument("--checkpoint", default=None,
+                        help="checkpoint filename for a .jsonl output "
+                        "(default: <output>.checkpoint.json)")
+    parser.add_argument("--start-url", default=START_URL)
+    parser.add_argument("--root-url", default=ROOT_URL)
+    parser.add_argument("--concurrency", type=int, default=DEF_CONCURRENCY,
+                        help="maximum number of pages downloaded at once")
+    parser.add_argument("--delay", type=float, default=DEF_DELAY,
+                        help="minimum seconds between two requests")
+    parser.add_argument("--parse-workers", type=int, default=None,
+                        help="number of parsing processes")
+    parser.add_argument("--parser", choices=BACKENDS, default=DEF_BACKEND,
+                        help="html parsing backend")
+    parser.add_argument("--timeout", type=float, nargs=2,
+                        default=[http_client.DEF_CONNECT_TIMEOUT,
+                                 http_client.DEF_READ_TIMEOUT],
+                        metavar=("CONNECT", "READ"),
+                        help="connect and read timeouts in seconds")
+    parser.add_argument("--retries", type=int,
+                        default=http_client.DEF_RETRIES,
+                        help="maximum number of retries per page")
+    parser.add_argument("--cache-dir", default=None,
+                        help="record responses in this directory")
+    parser.add_argument("--replay", action="store_true",
+                        help="replay a recorded crawl from --cache-dir "
+                        "without touching the network")
+    parser.add_argument("--fingerprints", default=None,
+                        help="listing fingerprints file; when given, only "
+                        "the delta since the previous scrape is written to "
+                        "the output (json) and the file is updated")
+    parser.add_argument("--stop-after", type=int, default=DEF_STOP_AFTER,
+                        help="stop a delta scrape after this many fully "
+                        "unchanged pages in a row (0 to crawl all pages)")
+    args = parser.parse_args()
+    http = http_client.HttpClient(args.concurrency, tuple(args.timeout),
+                                  args.retries, delay=args.delay,
+                                  cache_dir=args.cache_dir,
+                                  replay=args.replay)
+
+    if args.fingerprints:
+        prev = {}
+        if os.path.exists(args.fingerprints):
+            with open(args.fingerprints) as f:
+                prev = json.load(f)
+        delta = scrape_delta(args.start_url, prev, args.stop_after,
+                             args.root_url, args.concurrency, args.delay,
+                             args.parse_workers, args.parser, http)
+        fingerprints = delta.pop("fingerprints")
+        with open(args.output, 'w') as f:
+            json.dump(delta, f)
+        with open(args.fingerprints, 'w') as f:
+            json.dump(fingerprints, f)
+    elif args.output.endswith(".jsonl"):
+        scrape_to_file(args.start_url, args.output,
+                       args.checkpoint or args.output + ".checkpoint.json",
+                       args.root_url, args.concurrency, args.delay,
+                       args.parse_workers, args.parser, http)
+    else:
+        hd = scrape(args.start_url, args.root_url, args.concurrency,
+                    args.delay, args.parse_workers, args.parser, http)
+        with open(args.output, 'wb') as f:
+            pickle.dump(hd, f)
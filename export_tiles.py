@@ -0,0 +1,295 @@
+'''
+Exports pre-tiled GeoJSON for interactive web maps: the block group
+aggregates (choropleth) and the locator database units (points), cut into
+XYZ (web mercator) tiles for each zoom level. At each zoom, block group
+geometry is simplified to about one screen pixel, clipped to the tile,
+and coordinates are rounded to the zoom's precision. Features only carry
+the properties the map needs.
+
+Output layout:
+    <output dir>/tiles.json                          zooms, bounds, layers
+    <output dir>/<layer>/<zoom>/<x>/<y>.geojson       one tile
+
+Usage:
+    python3 export_tiles.py <output dir> [--zooms 10 11 12 13 14]
+                            [--geometry-cache <block group GeoParquet>]
+
+Aya Liu, Bhargavi Ganesh, Vedika Ahuja
+'''
+
+import argparse
+import json
+import math
+import os
+import numpy as np
+import pandas as pd
+from shapely.geometry import box, mapping
+from shapely.ops import unary_union
+import generate_report
+from preprocess_geometry import simplify_coverage
+
+DEF_ZOOMS = [10, 11, 12, 13, 14]
+TILE_SIZE = 256
+# tiles overlap by this many pixels, so polygon edges do not show seams
+TILE_BUFFER = 4
+BLOCK_GROUP_LAYER = "block_groups"
+UNIT_LAYER = "units"
+# unit properties on the map, renamed to short keys
+UNIT_PROPERTIES = {"index": "id", "Monthly Rent": "rent", "Bed": "bed",
+                   "Bath": "bath"}
+
+
+def export_tiles(locator_database, agg_df_by_geoid, block_groups, output_dir,
+                 zooms=DEF_ZOOMS):
+    '''
+    Write the block group and unit tiles of every zoom level.
+
+    Inputs:
+        locator_database (DataFrame): locator database, indexed by listing
+        agg_df_by_geoid (DataFrame): report measures by block group, with a
+                                     GEOID column
+        block_groups (GeoDataFrame): one polygon per block group, with a
+                                     GEOID column, in lon/lat
+        output_dir (str): output directory
+        zooms (list of ints): zoom levels
+    Returns: (dict) number of tiles written by layer and zoom
+    '''
+    block_groups = block_groups.merge(
+        block_group_properties(agg_df_by_geoid), on='GEOID', how='left')
+    units = locator_database.reset_index().dropna(subset=['Lat', 'Long'])
+
+    counts = {}
+    for zoom in zooms:
+        counts[(BLOCK_GROUP_LAYER, zoom)] = write_layer(
+            output_dir, BLOCK_GROUP_LAYER, zoom,
+            block_group_tiles(block_groups, zoom))
+        counts[(UNIT_LAYER, zoom)] = write_layer(
+            output_dir, UNIT_LAYER, zoom, unit_tiles(units, zoom))
+        print("zoom {}: {} block group tiles, {} unit tiles".format(
+            zoom, counts[(BLOCK_GROUP_LAYER, zoom)],
+            counts[(UNIT_LAYER, zoom)]))
+
+    minx, miny, maxx, maxy = block_groups.total_bounds
+    metadata = {"zooms": list(zooms),
+                "bounds": [minx, miny, maxx, maxy],
+                "layers": {BLOCK_GROUP_LAYER: ["GEOID"] +
+                           sorted(generate_report.MAP_METRICS),
+                           UNIT_LAYER: list(UNIT_PROPERTIES.values())},
+                "tiles": "{layer}/{z}/{x}/{y}.geojson"}
+    with open(os.path.join(output_dir, "tiles.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    return counts
+
+
+def block_group_properties(agg_df_by_geoid):
+    '''
+    Compute the choropleth values of each block group: the batch map
+    metrics of generate_report.MAP_METRICS.
+
+    Input: agg_df_by_geoid (DataFrame): report measures by block group
+    Returns: (DataFrame) GEOID and one column per metric
+    '''
+    by_geoid = agg_df_by_geoid.groupby('GEOID').sum(numeric_only=True)
+    props = pd.DataFrame(index=by_geoid.index)
+    for metric, (numerator, denominator, _) in \
+            generate_report.MAP_METRICS.items():
+        if denominator:
+            values = by_geoid[numerator] / by_geoid[denominator]
+            props[metric] = values.replace([np.inf, -np.inf], np.nan)
+        else:
+            props[metric] = by_geoid[numerator].fillna(0)
+    return props.round(4).reset_index()
+
+
+def block_group_tiles(block_groups, zoom):
+    '''
+    Cut the block groups into the tiles of a zoom level, simplified to
+    about one pixel of the zoom.
+
+    Inputs:
+        block_groups (GeoDataFrame): block groups with their properties
+        zoom (int)
+    Returns: (generator) of ((x, y), list of GeoJSON features)
+    '''
+    pixel = pixel_size(zoom)
+    geometry = simplify_coverage(block_groups.geometry, pixel)
+    props = block_groups.drop(columns='geometry')
+    props = props[['GEOID'] + sorted(generate_report.MAP_METRICS)]
+    records = props.astype(object).where(props.notna(), None)
+    records = records.to_dict('records')
+    sindex = geometry.sindex
+    decimals = coord_decimals(zoom)
+
+    for x, y in tiles_in_bounds(geometry.total_bounds, zoom):
+        tile_box = box(*tile_bounds(x, y, zoom, TILE_BUFFER))
+        features = []
+        for i in sindex.query(tile_box):
+            clipped = geometry.iloc[i].intersection(tile_box)
+            if clipped.geom_type == 'GeometryCollection':
+                # keep the polygon parts of clips touching the tile edge
+                clipped = unary_union([g for g in clipped.geoms
+                                       if g.area > 0])
+            if clipped.is_empty or clipped.area == 0:
+                continue
+            features.append(feature(clipped, records[i], decimals))
+        if features:
+            yield (x, y), features
+
+
+def unit_tiles(units, zoom):
+    '''
+    Group the units into the tiles of a zoom level.
+
+    Inputs:
+        units (DataFrame): locator database units with Lat and Long
+        zoom (int)
+    Returns: (generator) of ((x, y), list of GeoJSON features)
+    '''
+    xs, ys = lonlat_to_tile(units['Long'].values, units['Lat'].values, zoom)
+    props = units[list(UNIT_PROPERTIES)].rename(columns=UNIT_PROPERTIES)
+    records = props.astype(object).where(props.notna(), None)
+    records = records.to_dict('records')
+    decimals = coord_decimals(zoom)
+    lon = units['Long'].round(decimals).values
+    lat = units['Lat'].round(decimals).values
+
+    tile_of = pd.Series(np.arange(len(units))).groupby([xs, ys])
+    for (x, y), rows in tile_of:
+        yield (int(x), int(y)), [
+            {"type": "Feature",
+             "geometry": {"type": "Point",
+                          "coordinates": [float(lon[i]), float(lat[i])]},
+             "properties": records[i]}
+            for i in rows.values]
+
+
+def write_layer(output_dir, layer, zoom, tiles):
+    '''
+    Write the tiles of a layer and zoom level as compact GeoJSON files.
+
+    Returns: (int) number of tiles written
+    '''
+    n_tiles = 0
+    for (x, y), features in tiles:
+        tile_dir = os.path.join(output_dir, layer, str(zoom), str(x))
+        os.makedirs(tile_dir, exist_ok=True)
+        with open(os.path.join(tile_dir, "{}.geojson".format(y)), "w") as f:
+            json.dump({"type": "FeatureCollection", "features": features},
+                      f, separators=(",", ":"))
+        n_tiles += 1
+    return n_tiles
+
+
+def feature(geometry, properties, decimals):
+    '''
+    Make a GeoJSON feature with coordinates rounded to decimals.
+    '''
+    geom = mapping(geometry)
+    geom = {"type": geom["type"],
+            "coordinates": quantize(geom["coordinates"], decimals)}
+    return {"type": "Feature", "geometry": geom, "properties": properties}
+
+
+def quantize(coords, decimals):
+    '''
+    Round nested GeoJSON coordinates, dropping repeated points that
+    rounding creates.
+    '''
+    if isinstance(coords[0], (int, float)):
+        return [round(c, decimals) for c in coords]
+    rounded = [quantize(c, decimals) for c in coords]
+    if isinstance(rounded[0][0], float):
+        rounded = [pt for i, pt in enumerate(rounded)
+                   if i == 0 or pt != rounded[i - 1]]
+    return rounded
+
+
+def pixel_size(zoom):
+    '''
+    Width of one pixel at a zoom level, in degrees of longitude.
+    '''
+    return 360 / (TILE_SIZE * 2 ** zoom)
+
+
+def coord_decimals(zoom):
+    '''
+    Number of decimals that keeps coordinates within a tenth of a pixel.
+    '''
+    return int(math.ceil(-math.log10(pixel_size(zoom) / 10)))
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    '''
+    Find the XYZ tiles of lon/lat points.
+
+    Inputs: lon, lat (arrays of floats), zoom (int)
+    Returns: (tuple) arrays of tile x and y
+    '''
+    n = 2 ** zoom
+    lat_rad = np.radians(lat)
+    x = np.floor((np.asarray(lon) + 180) / 360 * n).astype(int)
+    y = np.floor((1 - np.log(np.tan(lat_rad) + 1 / np.cos(lat_rad)) / np.pi)
+                 / 2 * n).astype(int)
+    return np.clip(x, 0, n - 1), np.clip(y, 0, n - 1)
+
+
+def tile_bounds(x, y, zoom, buffer=0):
+    '''
+    Get the lon/lat bounds of an XYZ tile, grown by buffer pixels.
+
+    Returns: (tuple) minx, miny, maxx, maxy
+    '''
+    n = 2 ** zoom
+    pad = buffer / TILE_SIZE
+
+    def lon(tx):
+        return tx / n * 360 - 180
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return (lon(x - pad), lat(y + 1 + pad), lon(x + 1 + pad), lat(y - pad))
+
+
+def tiles_in_bounds(bounds, zoom):
+    '''
+    List the XYZ tiles covering lon/lat bounds.
+    '''
+    minx, miny, maxx, maxy = bounds
+    (x0, x1), (y1, y0) = lonlat_to_tile([minx, maxx], [miny, maxy], zoom)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def read_block_groups(block_group_cache=None):
+    '''
+    Read one polygon per block group: from a GeoParquet file written by
+    preprocess_geometry.py, or by dissolving create_city_blocks.
+    '''
+    if block_group_cache:
+        return generate_report.read_block_group_cache(block_group_cache)
+    blocks = generate_report.create_city_blocks(
+        generate_report.CITY_BLOCKS_JSON, generate_report.ZILLOW_SHAPEFILE)
+    blocks = blocks[~blocks.index.duplicated()]
+    return blocks[['GEOID', 'geometry']].dissolve(by='GEOID').reset_index()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Export GeoJSON tiles of block groups and units")
+    parser.add_argument("output_dir")
+    parser.add_argument("--zooms", nargs="+", type=int, default=DEF_ZOOMS)
+    parser.add_argument("--geometry-cache", default=None,
+                        help="block group GeoParquet file written by "
+                        "preprocess_geometry.py")
+    args = parser.parse_args()
+
+    locator_db = generate_report.read_locator_db(
+        generate_report.LOCATOR_DB_CSV)
+    bgs = read_block_groups(args.geometry_cache)
+    block_group_df = generate_report.read_block_group_data(
+        generate_report.BLOCK_GROUPS_CSV)
+    agg_by_geoid = block_group_df.merge(
+        generate_report.aggregate_cha_by_geoid(locator_db), how="outer",
+        on="GEOID")
+    export_tiles(locator_db, agg_by_geoid, bgs, args.output_dir, args.zooms)
@@ -0,0 +1,99 @@
+'''
+Local stand-in for the CHA HCV Housing Finder serving saved result pages,
+so the scraper can be run and tested without touching the CHA site.
+
+Pages are stored one file per request path (including the query string),
+named by page_filename().
+
+Aya Liu
+'''
+
+import os
+import sys
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def page_filename(url):
+    '''
+    Map a page url (or request path) to the name of its saved file.
+
+    Input: url (str): absolute url or path with query string
+    Returns: (str) filename
+    '''
+    parsed = urllib.parse.urlparse(url)
+    path = parsed.path or "/"
+    if parsed.query:
+        path += "?" + parsed.query
+    return urllib.parse.quote(path, safe="") + ".html"
+
+
+def save_page(directory, url, html):
+    '''
+    Save the html of a page so it can be served by the stand-in server.
+
+    Inputs:
+        directory (str): directory of saved pages
+        url (str): url of the page
+        html (str): page content
+    '''
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, page_filename(url))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+
+
+def make_handler(directory):
+    '''
+    Create a request handler class serving saved pages from directory.
+    '''
+    class SavedPageHandler(BaseHTTPRequestHandler):
+        '''
+        Serve GET requests from saved pages, 404 for unknown pages.
+        '''
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            path = os.path.join(directory, page_filename(self.path))
+            if not os.path.exists(path):
+                self.send_error(404)
+                return
+            with open(path, "rb") as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return SavedPageHandler
+
+
+def serve(directory, port=0):
+    '''
+    Start the stand-in server on a background thread.
+
+    Inputs:
+        directory (str): directory of saved pages
+        port (int): port to listen on, 0 for any free port
+    Returns:
+        server (ThreadingHTTPServer): call server.shutdown() to stop
+        root_url (str): root url of the server, to be used in place of
+                        cha_scraper.ROOT_URL
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    root_url = "http://127.0.0.1:{}".format(server.server_address[1])
+    return server, root_url
+
+
+if __name__ == '__main__':
+    httpd = ThreadingHTTPServer(("127.0.0.1", int(sys.argv[2])),
+                                make_handler(sys.argv[1]))
+    print("Serving {} on port {}".format(sys.argv[1], sys.argv[2]))
+    httpd.serve_forever()
@@ -0,0 +1,318 @@
+'''
+Fused scan of the locator database for user.search: the active criteria
+compile into one boolean expression over the database's numpy arrays,
+evaluated in a single pass into one final mask, without a boolean Series
+per filter or a copy of the frame after each one.
+
+Text columns (address, property type, availability, neighborhood, city)
+are encoded once per database as integer codes, so their equality and
+membership tests become integer comparisons. The expression is evaluated
+by numexpr when it is installed (one blocked, multithreaded pass over the
+arrays), and otherwise by a numpy kernel that ands each clause into the
+mask in place.
+
+Aya Liu, Bhargavi Ganesh, and Vedika Ahuja
+
+'''
+import numpy as np
+import pandas as pd
+from locator_sqlite import DIST_TO_COL
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+RANGE_FIELDS = ["Monthly Rent", "Bed", "Bath"]
+# facets counted next to search results: facet name to the column it
+# counts, which is also the column of its own filter
+FACETS = {"Neighborhood": "Neighborhood",
+          "Property Type": "Property Type",
+          "Bed": "Bed",
+          "Rent": "Monthly Rent"}
+# lower bounds of the rent facet buckets
+RENT_BUCKETS = [0, 500, 750, 1000, 1250, 1500, 1750, 2000, 2500]
+CODED_COLS = ["Address", "Property Type", "Availability", "Neighborhood",
+              "City"]
+NUMERIC_COLS = RANGE_FIELDS + list(DIST_TO_COL.values())
+
+
+class ScanColumns:
+    '''
+    Numpy arrays of the searched columns of one database, with the text
+    columns encoded as integer codes from 1 (0 for missing values).
+
+    '''
+    def __init__(self, db):
+        '''
+        Constructor to initialize a ScanColumns object.
+
+        Input:
+            db (DataFrame): locator database
+        '''
+        self.db = db
+        self.arrays = {}
+        self.categories = {}
+        self.facets = {}
+        for col in NUMERIC_COLS:
+            self.arrays[col] = db[col].to_numpy(dtype=float,
+                                                na_value=np.nan)
+        for col in CODED_COLS:
+            codes, uniques = pd.factorize(db[col])
+            self.arrays[col] = codes + 1
+            self.categories[col] = pd.Index(uniques)
+
+    def codes(self, col, values):
+        '''
+        Codes of the values of a text column; values not in the column have
+        no code.
+        '''
+        codes = self.categories[col].get_indexer(list(values))
+        return [int(c) + 1 for c in codes if c >= 0]
+
+    def facet(self, facet):
+        '''
+        Codes of a facet, from 1 (0 for missing values), and the label of
+        each code from 1, encoded on first use.
+
+        Input:
+            facet (str): facet name, one of FACETS
+        Returns: (tuple) array of codes and list of labels
+        '''
+        if facet not in self.facets:
+            col = FACETS[facet]
+            if col in self.categories:
+                codes = self.arrays[col]
+                labels = list(self.categories[col])
+            elif facet == "Rent":
+                rent = self.arrays[col]
+                codes = np.searchsorted(RENT_BUCKETS, rent, side="right")
+                codes[np.isnan(rent)] = 0
+                labels = ["{}-{}".format(lb, ub - 1) for lb, ub in
+                          zip(RENT_BUCKETS[:-1], RENT_BUCKETS[1:])]
+                labels.append("{}+".format(RENT_BUCKETS[-1]))
+            else:
+                codes, uniques = pd.factorize(self.db[col], sort=True)
+                codes = codes + 1
+                labels = list(uniques)
+            self.facets[facet] = (codes, labels)
+        return self.facets[facet]
+
+
+# encoded columns of the last database scanned
+SCAN = None
+
+
+def scan_columns(db):
+    '''
+    Get the encoded columns of a database, encoding them on the first scan.
+    '''
+    global SCAN
+    if SCAN is None or SCAN.db is not db:
+        SCAN = ScanColumns(db)
+    return SCAN
+
+
+def compile_criteria(cd, columns):
+    '''
+    Compile a criteria dictionary into the clauses of user.search's
+    filters.
+
+    Inputs:
+        cd (dict): the dict attribute of a user.Criteria
+        columns (ScanColumns): encoded columns of the database
+    Returns: (list of tuples) clauses, one of
+        ("range", column, lb, ub): lb <= value <= ub
+        ("in", column, codes): code is one of codes
+        ("positive", column): value > 0
+    '''
+    clauses = []
+    if cd["Address"]:
+        clauses.append(("in", "Address",
+                        columns.codes("Address", [cd["Address"]])))
+    for field in RANGE_FIELDS:
+        if cd[field]:
+            lb, ub = cd[field]
+            clauses.append(("range", field, lb, ub))
+    if cd["Property Type"]:
+        clauses.append(("in", "Property Type",
+                        columns.codes("Property Type", cd["Property Type"])))
+    if cd["Available Now"]:
+        clauses.append(("in", "Availability",
+                        columns.codes("Availability", ["Available Now"])))
+    if cd["Neighborhood"]:
+        clauses.append(("in", "Neighborhood",
+                        columns.codes("Neighborhood", cd["Neighborhood"])))
+    if cd.get("City"):
+        clauses.append(("in", "City", columns.codes("City", cd["City"])))
+    if cd["Has L-Stop within _ Mile"]:
+        clauses.append(("positive",
+                        DIST_TO_COL[cd["Has L-Stop within _ Mile"]]))
+    return clauses
+
+
+def to_expression(clauses, columns):
+    '''
+    Write the clauses as one numexpr expression. Constants are passed as
+    variables, so queries of the same shape reuse one compiled expression.
+
+    Returns: (tuple) expression string and dict of its variables
+    '''
+    terms, variables = [], {}
+    for i, clause in enumerate(clauses):
+        kind, col = clause[:2]
+        name = "c{}".format(i)
+        variables[name] = columns.arrays[col]
+        if kind == "range":
+            terms.append("({0} >= lb{1}) & ({0} <= ub{1})".format(name, i))
+            variables["lb{}".format(i)] = float(clause[2])
+            variables["ub{}".format(i)] = float(clause[3])
+        elif kind == "in":
+            if not clause[2]:
+                return "False", {}
+            terms.append("(" + " | ".join(
+                "({} == k{}_{})".format(name, i, j)
+                for j in range(len(clause[2]))) + ")")
+            for j, code in enumerate(clause[2]):
+                variables["k{}_{}".format(i, j)] = code
+        else:
+            terms.append("({} > 0)".format(name))
+    return " & ".join(terms), variables
+
+
+def numpy_mask(clauses, columns, n):
+    '''
+    Evaluate the clauses with numpy, anding each into one mask in place
+    through preallocated scratch arrays.
+    '''
+    mask = np.ones(n, dtype=bool)
+    tmp = np.empty(n, dtype=bool)
+    scratch = np.empty(n, dtype=bool)
+    for clause in clauses:
+        clause_mask(clause, columns, tmp, scratch)
+        mask &= tmp
+    return mask
+
+
+def clause_mask(clause, columns, out, scratch=None):
+    '''
+    Evaluate one clause with numpy into the boolean array out (range
+    clauses also use a scratch array, allocated if not given).
+    '''
+    kind, col = clause[:2]
+    values = columns.arrays[col]
+    if kind == "range":
+        if scratch is None:
+            scratch = np.empty_like(out)
+        np.greater_equal(values, clause[2], out=out)
+        np.less_equal(values, clause[3], out=scratch)
+        out &= scratch
+    elif kind == "in":
+        # lookup table of the codes; missing values (0) map to False
+        lookup = np.zeros(len(columns.categories[col]) + 1, dtype=bool)
+        lookup[clause[2]] = True
+        np.take(lookup, values, out=out, mode="clip")
+    else:
+        np.greater(values, 0, out=out)
+    return out
+
+
+def fused_mask(db, cd, use_numexpr=None):
+    '''
+    Compute the mask of the listings matching the criteria in one pass.
+
+    Inputs:
+        db (DataFrame): locator database
+        cd (dict): the dict attribute of a user.Criteria
+        use_numexpr (bool): evaluate with numexpr (default: when installed)
+    Returns: (numpy array of bools) one per row of db
+    '''
+    columns = scan_columns(db)
+    clauses = compile_criteria(cd, columns)
+    if use_numexpr is None:
+        use_numexpr = numexpr is not None
+    if not clauses:
+        return np.ones(len(db), dtype=bool)
+    if use_numexpr:
+        expression, variables = to_expression(clauses, columns)
+        if not variables:
+            return np.zeros(len(db), dtype=bool)
+        return numexpr.evaluate(expression, local_dict=variables)
+    return numpy_mask(clauses, columns, len(db))
+
+
+def scan(db, cd, columns, limit=None):
+    '''
+    Select the matching listings and columns with a single copy.
+
+    Inputs:
+        db (DataFrame): locator database
+        cd (dict): the dict attribute of a user.Criteria
+        columns (list of str): columns to return
+        limit (int): maximum number of listings, None for all
+    Returns: (DataFrame) matching listings
+    '''
+    rows = np.flatnonzero(fused_mask(db, cd))
+    if limit is not None:
+        rows = rows[:limit]
+    return db.iloc[rows, db.columns.get_indexer(columns)]
+
+
+def facet_scan(db, cd, columns, limit=None, facets=FACETS):
+    '''
+    Select the matching listings like scan, and count them by facet in the
+    same pass: one bincount over the facet codes of the matching rows. For
+    a facet with an active filter of its own (e.g. neighborhood), also
+    count the "what-if" matches of every facet value with that filter
+    removed and all others kept.
+
+    Inputs:
+        db (DataFrame): locator database
+        cd (dict): the dict attribute of a user.Criteria
+        columns (list of str): columns to return
+        limit (int): maximum number of listings, None for all (facets
+                     always count all matches)
+        facets (list of str): facet names, keys of FACETS
+    Returns: (tuple) DataFrame of matching listings, and a dict of facet
+             name to a DataFrame indexed by facet value, with the "count"
+             of matches and the "what_if" count without the facet's own
+             filter (values with neither are left out)
+    '''
+    encoded = scan_columns(db)
+    clauses = compile_criteria(cd, encoded)
+    scratch = np.empty(len(db), dtype=bool)
+    masks = [clause_mask(clause, encoded, np.empty(len(db), dtype=bool),
+                         scratch) for clause in clauses]
+    mask = and_masks(masks, len(db))
+
+    counts = {}
+    for facet in facets:
+        codes, labels = encoded.facet(facet)
+        own = [clause[1] == FACETS[facet] for clause in clauses]
+        count = np.bincount(codes[mask], minlength=len(labels) + 1)
+        if any(own):
+            others = and_masks([m for m, is_own in zip(masks, own)
+                                if not is_own], len(db))
+            what_if = np.bincount(codes[others], minlength=len(labels) + 1)
+        else:
+            what_if = count
+        table = pd.DataFrame({"count": count[1:], "what_if": what_if[1:]},
+                             index=pd.Index(labels, name=facet))
+        counts[facet] = table[(table["count"] > 0) | (table["what_if"] > 0)]
+
+    rows = np.flatnonzero(mask)
+    if limit is not None:
+        rows = rows[:limit]
+    return db.iloc[rows, db.columns.get_indexer(columns)], counts
+
+
+def and_masks(masks, n):
+    '''
+    And a list of boolean arrays into a new array (all True for none).
+    '''
+    if not masks:
+        return np.ones(n, dtype=bool)
+    mask = masks[0].copy()
+    for other in masks[1:]:
+        mask &= other
+    return mask
@@ -8,23 +8,121 @@ Aya Liu, Bhargavi Ganesh, Vedika Ahuja
 import warnings
 warnings.filterwarnings("ignore")
 
-import sys
+import argparse
+import operator
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import geopandas
+import snapshot_store
+# geopandas and matplotlib are imported where geometry is read or maps are 
+# drawn, so that tables-only runs never load them
 pd.options.mode.chained_assignment = None
 
 LOCATOR_DB_CSV = "processed_data/locator_database.csv"
 BLOCK_GROUPS_CSV = "data/block-groups.csv" 
 CITY_BLOCKS_JSON = "data/Boundaries-CensusBlocks-2010.geojson"
 ZILLOW_SHAPEFILE = "data/ZillowNeighborhoods-IL.shp"
+# block groups pre-dissolved and simplified by preprocess_geometry.py, by
+# simplification tolerance
+BLOCK_GROUP_CACHE = "processed_data/block_groups_{}.parquet"
+# GEOID to zillow neighborhood lookup written by preprocess_geometry.py, for
+# tables-only runs
+BLOCK_GROUP_LOOKUP = "processed_data/block_group_lookup.csv"
+# threshold sweep tables: <prefix>_<sweep name>.csv
+SWEEP_OUTPUT = "{}_{}.csv"
+
+# batch maps: metric to (numerator, denominator or None, title) of the block
+# group values, and map files <map directory>/<metric>_<zoom>.png
+MAP_METRICS = {
+    'count_properties': ('num_cha_properties', None, 
+                         'Number of CHA properties by Census Block Group'),
+    'eviction_rate': ('evictions', 'renter-occupied-households', 
+                      'Eviction rate by Census Block Group'),
+    'transit_access': ('stop_wi_half_mi', 'num_cha_properties', 
+                       'Share of CHA properties within 1/2 mile of an L stop')}
+MAP_OUTPUT = "{}_{}.png"
+# the whole city, or a zillow neighborhood name
+CITY_ZOOM = "city"
+DEF_MAP_WIDTH = 1200
+DEF_MAP_DPI = 300
+DEF_MAP_BINS = 5
+# rasterized base layers of the zooms, set in map worker processes
+MAP_RASTERS = {}
+
+# Aggregation spec of the report tables. Block groups are summed by
+# neighborhood over the measure columns only, in one groupby pass; derived
+# columns and flags are then added to the neighborhood table, and every
+# table is built from it.
+NEIGH_MEASURES = ['num_cha_properties', 'total_rent', 'stop_wi_quart_mi', 
+                  'stop_wi_half_mi', 'num_props_w_potential_bad_landlord', 
+                  'renter-occupied-households', 'eviction-filings', 
+                  'evictions', 'people_in_poverty', 'population', 
+                  'af-am_pop', 'hispanic_pop', 'white_pop']
+# (name, kind, columns): 'ratio' of two columns, 'share' of the city total,
+# or 'pct_rank' across neighborhoods
+NEIGH_DERIVED = [
+    ('percent_wi_quart_mi_l_stop', 'ratio', 
+     ['stop_wi_quart_mi', 'num_cha_properties']),
+    ('percent_wi_half_mi_l_stop', 'ratio', 
+     ['stop_wi_half_mi', 'num_cha_properties']),
+    ('Avg_cha_monthly_rent', 'ratio', ['total_rent', 'num_cha_properties']),
+    ('perc_rentals_hcv', 'ratio', 
+     ['num_cha_properties', 'renter-occupied-households']),
+    ('perc_hcv_in_neigh', 'share', ['num_cha_properties']),
+    ('eviction_rate', 'ratio', ['evictions', 'renter-occupied-households']),
+    ('eviction_filing_rate', 'ratio', 
+     ['eviction-filings', 'renter-occupied-households']),
+    ('poverty_rate', 'ratio', ['people_in_poverty', 'population']),
+    ('evictions_chi_percentile_rank', 'pct_rank', ['eviction_rate']),
+    ('perc_black', 'ratio', ['af-am_pop', 'population']),
+    ('perc_latino', 'ratio', ['hispanic_pop', 'population']),
+    ('perc_white', 'ratio', ['white_pop', 'population'])]
+# (name, column, operator, threshold) 0/1 flags; 'none' is 1 where all of
+# the listed flags are 0
+NEIGH_FLAGS = [
+    ('at_least_10_homes', 'num_cha_properties', 'ge', 10),
+    ('less_20_perc_pov', 'poverty_rate', 'lt', .2),
+    ('maj_black', 'perc_black', 'ge', .66),
+    ('maj_white', 'perc_white', 'ge', .66),
+    ('maj_latino', 'perc_latino', 'ge', .66),
+    ('integrated', ['maj_black', 'maj_white', 'maj_latino'], 'none', None)]
+FLAG_OPS = {'ge': operator.ge, 'lt': operator.lt}
+FLAG_SPEC = {name: (col, op, threshold) 
+             for name, col, op, threshold in NEIGH_FLAGS}
+# table 1: neighborhood-level columns
+TABLE1_COLS = ['num_cha_properties', 'Avg_cha_monthly_rent', 
+               'stop_wi_quart_mi', 'stop_wi_half_mi', 
+               'percent_wi_quart_mi_l_stop', 'percent_wi_half_mi_l_stop', 
+               'num_props_w_potential_bad_landlord', 'poverty_rate',
+               'eviction-filings', 'evictions',
+               'eviction_filing_rate', 'eviction_rate',
+               'evictions_chi_percentile_rank', 'renter-occupied-households', 
+               'perc_rentals_hcv', 'population', 'perc_hcv_in_neigh', 
+               'at_least_10_homes', 'perc_black', 'perc_latino', 'perc_white']
+# tables 2 and 3: (group key, [(output column, column, aggregation)])
+SUMMARY_TABLES = [
+    ('at_least_10_homes', 
+     [('num_neighborhoods', 'num_cha_properties', 'count'),
+      ('poverty_rate', 'poverty_rate', 'mean'),
+      ('less_20_perc_pov', 'less_20_perc_pov', 'sum'),
+      ('eviction_rate', 'eviction_rate', 'mean'),
+      ('integrated', 'integrated', 'sum'),
+      ('maj_black', 'maj_black', 'sum'),
+      ('maj_white', 'maj_white', 'sum'),
+      ('maj_latino', 'maj_latino', 'sum')]),
+    ('less_20_perc_pov', 
+     [('num_cha_properties', 'num_cha_properties', 'sum'),
+      ('poverty_rate', 'poverty_rate', 'mean'),
+      ('eviction_rate', 'eviction_rate', 'mean')])]
 
 
 
 def build_agg_tables(locator_database_csv, block_groups_csv, city_blocks_json, 
                      zillow_shapefile, output_file1, output_file2, output_file3, 
-                     map_filename):
+                     map_filename, block_group_cache=None, sweeps=None, 
+                     sweep_output=None, maps=None, tables_only=False,
+                     block_group_lookup=BLOCK_GROUP_LOOKUP):
     '''
     Builds aggregate tables and map using functions below.
 
@@ -42,6 +140,17 @@ def build_agg_tables(locator_database_csv, block_groups_csv, city_blocks_json,
                        for aggregate table comparing CHA and non-CHA properties
         -map_filename: filename (specified by the user) with a ".png" ending for 
                        output map showing the number of CHA properties on a map
+        -block_group_cache: (optional) GeoParquet file of block groups written 
+                       by preprocess_geometry.py, read instead of 
+                       city_blocks_json and zillow_shapefile
+        -sweeps: (optional) dict of threshold vectors passed to sweep_report
+        -sweep_output: filename prefix of the sweep tables
+        -maps: (optional) dict of batch map options passed to generate_maps
+        -tables_only: (bool) only export the tables (and sweeps), mapping 
+                       block groups to neighborhoods with block_group_lookup 
+                       instead of loading any geometry
+        -block_group_lookup: csv of GEOID to zillow neighborhood written by 
+                       preprocess_geometry.py
     
     Returns:
         - Exports three csv files and png map
@@ -50,16 +159,32 @@ def build_agg_tables(locator_database_csv, block_groups_csv, city_blocks_json,
     locator_database = read_locator_db(locator_database_csv)
     block_group_df = read_block_group_data(block_groups_csv)
     ld_by_geoid = aggregate_cha_by_geoid(locator_database)
-    blocks_zillow_merge = create_city_blocks(city_blocks_json, zillow_shapefile)
+    if tables_only:
+        blocks_zillow_merge = read_block_group_lookup(block_group_lookup)
+    elif block_group_cache:
+        blocks_zillow_merge = read_block_group_cache(block_group_cache)
+    else:
+        blocks_zillow_merge = create_city_blocks(city_blocks_json, 
+                                                 zillow_shapefile)
     agg_df_by_geoid = make_master_agg_dataset(
         blocks_zillow_merge, block_group_df, ld_by_geoid)
 
     #Output files
-    master_agg_by_neigh = master_agg_by_neighborhood(
-        agg_df_by_geoid, output_file1)
-    agg_cha_non_cha_compare(master_agg_by_neigh, output_file2)
-    num_homes_in_mobility_neigh(master_agg_by_neigh, output_file3)
+    neigh_agg = aggregate_neighborhoods(agg_df_by_geoid)
+    tables = report_tables(neigh_agg)
+    for i, output_file in enumerate([output_file1, output_file2, 
+                                     output_file3]):
+        print("exporting table {}".format(i + 1))
+        tables[i].to_csv(output_file)
+    if sweeps:
+        for name, table in sweep_report(neigh_agg, **sweeps).items():
+            print("exporting {} sweep".format(name))
+            table.to_csv(SWEEP_OUTPUT.format(sweep_output, name))
+    if tables_only:
+        return
     generate_map(locator_database, blocks_zillow_merge, map_filename)
+    if maps and maps.get('metrics'):
+        generate_maps(agg_df_by_geoid, blocks_zillow_merge, **maps)
 
 
 def read_locator_db(filepath):
@@ -241,6 +366,7 @@ def create_city_blocks(city_blocks_json, zillow_shapefile):
         -blocks_zillow_merge: geopandas df of Census block groups mapped to 
                               zillow neighborhood
     '''
+    import geopandas
     city_blocks_df = geopandas.read_file(city_blocks_json)
     city_blocks_df['GEOID'] = \
     city_blocks_df['geoid10'].str.slice(start=0, stop=12)
@@ -254,6 +380,42 @@ def create_city_blocks(city_blocks_json, zillow_shapefile):
     return block_zillow_merge
 
 
+def read_block_group_cache(block_group_cache):
+    '''
+    Reads block groups pre-dissolved and simplified by preprocess_geometry.py,
+    in place of create_city_blocks.
+
+    Inputs:
+        -block_group_cache: GeoParquet file of block groups
+
+    Returns:
+        -block_groups: geopandas df of Census block groups with their 
+                       zillow neighborhood ('GEOID', 'Name', 'RegionID', 
+                       'geometry'), one row per block group
+    '''
+    import geopandas
+    block_groups = geopandas.read_parquet(block_group_cache)
+    if block_groups.crs is None:
+        block_groups.crs = {'init' :'epsg:4326'}
+
+    return block_groups
+
+
+def read_block_group_lookup(block_group_lookup):
+    '''
+    Reads the GEOID to zillow neighborhood lookup written by 
+    preprocess_geometry.py, in place of the block group geometry.
+
+    Inputs:
+        -block_group_lookup: csv of block groups
+
+    Returns:
+        -(DataFrame) of 'GEOID', 'Name' and 'RegionID', one row per block 
+                       group
+    '''
+    return pd.read_csv(block_group_lookup, dtype=str)
+
+
 def make_master_agg_dataset(blocks_zillow_merge, block_group_df, ld_by_geoid):
     '''
     Creates dataframe aggregated by geoid of evictions data 
@@ -282,10 +444,109 @@ def make_master_agg_dataset(blocks_zillow_merge, block_group_df, ld_by_geoid):
     return agg_df_by_geoid
 
 
+def aggregate_neighborhoods(agg_df_by_geoid, measures=NEIGH_MEASURES,
+                            derived=NEIGH_DERIVED, flags=NEIGH_FLAGS):
+    '''
+    Aggregates the block group table to zillow neighborhoods in a single 
+    groupby pass over the measure columns, then adds the derived ratios and 
+    flags of the aggregation spec as vectorized column operations.
+
+    Inputs:
+        -agg_df_by_geoid: (pandas df) master aggregated table of evictions 
+            data and locator database for city of Chicago, aggregated by geoid
+        -measures: (list) columns summed by neighborhood
+        -derived: (list) derived columns, see NEIGH_DERIVED
+        -flags: (list) 0/1 flag columns, see NEIGH_FLAGS
+    Returns:
+        -agg: (DataFrame) table aggregated by zillow neighborhood, sorted by 
+            number of CHA properties
+    '''
+    agg = agg_df_by_geoid.groupby('Neighborhood')[measures].sum()
+    agg = add_derived(agg, derived, flags)
+
+    return agg.sort_values(by='num_cha_properties', ascending=False)
+
+
+def add_derived(agg, derived=NEIGH_DERIVED, flags=NEIGH_FLAGS):
+    '''
+    Adds the derived ratios and flags of the aggregation spec to a table of 
+    summed measures, in place.
+
+    Inputs:
+        -agg: (DataFrame) summed measures by area
+        -derived: (list) derived columns, see NEIGH_DERIVED
+        -flags: (list) 0/1 flag columns, see NEIGH_FLAGS
+    Returns:
+        -agg: (DataFrame)
+    '''
+    for name, kind, cols in derived:
+        if kind == 'ratio':
+            agg[name] = agg[cols[0]] / agg[cols[1]]
+        elif kind == 'share':
+            agg[name] = agg[cols[0]] / agg[cols[0]].sum()
+        elif kind == 'pct_rank':
+            agg[name] = agg[cols[0]].rank(pct=True)
+
+    for name, col, op, threshold in flags:
+        if op == 'none':
+            agg[name] = (agg[col] == 0).all(axis=1).astype(int)
+        else:
+            agg[name] = FLAG_OPS[op](agg[col], threshold).astype(int)
+
+    return agg
+
+
+def summarize_neighborhoods(neigh_agg, group_key, aggregations):
+    '''
+    Summarizes the neighborhood table by one of its flags.
+
+    Inputs:
+        -neigh_agg: (DataFrame) table aggregated by zillow neighborhood, from 
+            aggregate_neighborhoods
+        -group_key: (str) flag column to group neighborhoods by
+        -aggregations: (list) of (output column, column, aggregation) tuples
+    Returns:
+        -(DataFrame) summary table indexed by the flag
+    '''
+    grouped = neigh_agg.groupby(group_key)
+    return pd.DataFrame({out_col: grouped[col].agg(how) 
+                         for out_col, col, how in aggregations})
+
+
+def report_tables(neigh_agg):
+    '''
+    Creates the three aggregation tables of the report from the 
+    neighborhood aggregation of the block group table:
+        1. neighborhoods containing CHA houses
+        2. neighborhoods with at least 10 homes available in them compared 
+           to those with less than 10. 96% of the HCV homes in the list are 
+           in neighborhoods with at least 10 homes available.
+        3. homes in neighborhoods with less and more than 20% poverty
+
+    Calculation Source:
+        - https://interactive.wbez.org/curiouscity/segregation-map/ 
+
+    Note: Used WBEZ's defintion of integrated from source above: 
+        Integrated = "Which we define as a condition where no single race 
+        comprises two-thirds or more of an area’s population.
+
+    Inputs:
+        -neigh_agg: (DataFrame) table aggregated by zillow neighborhood, from 
+            aggregate_neighborhoods
+    Returns:
+        -(list of DataFrames) the three tables
+    '''
+    tables = [neigh_agg[TABLE1_COLS]]
+    for group_key, aggregations in SUMMARY_TABLES:
+        tables.append(summarize_neighborhoods(neigh_agg, group_key, 
+                                              aggregations))
+    return tables
+
+
 def master_agg_by_neighborhood(agg_df_by_geoid, output_file):
     '''
     Creates first aggregation table of information about neighborhoods
-    containing CHA houses
+    containing CHA houses (table 1 of report_tables).
 
     Inputs:
         -agg_df_by_geoid: (pandas df) master aggregated table of evictions 
@@ -295,47 +556,8 @@ def master_agg_by_neighborhood(agg_df_by_geoid, output_file):
     Returns:
         -master_agg_by_neighborhood: table aggregated by zillow neighborhood
     '''
-    agg = agg_df_by_geoid.groupby('Neighborhood').agg('sum')
-
-    #neighborhood level calculations
-    #cha related stats
-    agg['percent_wi_quart_mi_l_stop'] = agg['stop_wi_quart_mi'] / \
-                                        agg['num_cha_properties']
-    agg['percent_wi_half_mi_l_stop'] = agg['stop_wi_half_mi'] / \
-                                       agg['num_cha_properties']
-    agg['Avg_cha_monthly_rent'] = agg['total_rent'] / \
-                                  agg['num_cha_properties']
-    agg['perc_rentals_hcv'] = agg['num_cha_properties'] / \
-                              agg['renter-occupied-households']
-    agg['perc_hcv_in_neigh'] = agg['num_cha_properties'] / \
-                                                agg['num_cha_properties'].sum()
-    agg['at_least_10_homes'] = np.where(agg['num_cha_properties'] >= 10, 1, 0)
-
-    #eviction and poverty rates
-    agg['eviction_rate'] = (agg['evictions'] / \
-                                    agg['renter-occupied-households'])
-    agg['eviction_filing_rate'] = (agg['eviction-filings'] / \
-                                   agg['renter-occupied-households'])   
-    agg['poverty_rate'] = agg['people_in_poverty'] / agg['population']
-    agg['evictions_chi_percentile_rank'] = (agg['eviction_rate'].rank(pct=True))
-    
-    #demographic rates
-    agg['perc_black'] = agg['af-am_pop'] / agg['population']
-    agg['perc_latino'] = agg['hispanic_pop'] / agg['population']
-    agg['perc_white'] = agg['white_pop'] / agg['population'] 
-    agg = agg.sort_values(by='num_cha_properties', ascending=False)
-    
     master_agg_by_neighborhood = \
-    agg[['num_cha_properties', 'Avg_cha_monthly_rent', 
-         'stop_wi_quart_mi', 'stop_wi_half_mi', 
-         'percent_wi_quart_mi_l_stop', 'percent_wi_half_mi_l_stop', 
-         'num_props_w_potential_bad_landlord', 'poverty_rate',
-         'eviction-filings', 'evictions',
-         'eviction_filing_rate', 'eviction_rate',
-         'evictions_chi_percentile_rank', 'renter-occupied-households', 
-         'perc_rentals_hcv', 'population', 'perc_hcv_in_neigh', 
-         'at_least_10_homes', 'perc_black', 'perc_latino', 'perc_white']]
-
+        aggregate_neighborhoods(agg_df_by_geoid)[TABLE1_COLS]
     print("exporting table 1")
     master_agg_by_neighborhood.to_csv(output_file)
 
@@ -345,79 +567,196 @@ def master_agg_by_neighborhood(agg_df_by_geoid, output_file):
 def agg_cha_non_cha_compare(master_agg_by_neigh, output_file):
     '''
     Creates second aggregation table comparing neighborhoods with at 
-    least 10 homes available in them to homes with less than 10. 
-    96% of the HCV homes in the list are in neighborhoods with at least 10 homes 
-    available.
-
-    Calculation Source:
-        - https://interactive.wbez.org/curiouscity/segregation-map/ 
-
-    Note: Used WBEZ's defintion of integrated from source above: 
-        Integrated = "Which we define as a condition where no single race 
-        comprises two-thirds or more of an area’s population.
+    least 10 homes available in them to homes with less than 10 (table 2 
+    of report_tables).
 
     Inputs:
-        -master_agg_by_neigh (DataFrame): master aggregated table of 
-             evictions data and locator database for Chicago, aggregated by 
-             zillow neighborhood
+        -master_agg_by_neigh (DataFrame): table 1, from 
+            master_agg_by_neighborhood
         -output_file: (str) output csv path for CHA vs non-CHA aggregated table
     Returns:
         -neigh_summary (DataFrame): summary table by zillow neighborhood
     '''
-    master_agg_by_neigh['less_20_perc_pov'] = \
-                        np.where(master_agg_by_neigh['poverty_rate'] < .2, 1, 0)
-    master_agg_by_neigh['maj_black'] = \
-                        np.where(master_agg_by_neigh['perc_black'] >= .66, 1, 0)
-    master_agg_by_neigh['maj_white'] = \
-                        np.where(master_agg_by_neigh['perc_white'] >= .66, 1, 0)
-    master_agg_by_neigh['maj_latino'] = \
-                       np.where(master_agg_by_neigh['perc_latino'] >= .66, 1, 0)
-    integrated_mask = (master_agg_by_neigh['maj_black'] == 0) & \
-                      (master_agg_by_neigh['maj_white'] == 0) & \
-                      (master_agg_by_neigh['maj_latino'] == 0)                  
-    master_agg_by_neigh['integrated'] = np.where(integrated_mask is True, 1, 0)
-    grouped = master_agg_by_neigh.groupby('at_least_10_homes')
-    agg = grouped.agg({'num_cha_properties' : 'count',
-                       'eviction_rate' : 'mean',
-                       'poverty_rate' : 'mean',
-                       'less_20_perc_pov' : 'sum',
-                       'maj_black' : 'sum',
-                       'maj_white' : 'sum',
-                       'maj_latino' : 'sum',
-                       'integrated' : 'sum'})  
-    agg = agg.rename(columns={'num_cha_properties' : 'num_neighborhoods'})
-    neigh_summary = agg[['num_neighborhoods', 'poverty_rate', 
-                         'less_20_perc_pov', 'eviction_rate', 'integrated',
-                         'maj_black', 'maj_white', 'maj_latino']]
+    neigh_agg = add_derived(master_agg_by_neigh.copy(), [], NEIGH_FLAGS)
+    neigh_summary = summarize_neighborhoods(neigh_agg, *SUMMARY_TABLES[0])
     print("exporting table 2")
     neigh_summary.to_csv(output_file)
 
+    return neigh_summary
+
 
 def num_homes_in_mobility_neigh(master_agg_by_neigh, output_file):
     '''
     Creates final aggregation table of % of homes in neighborhoods with less 
-    than 20% poverty.
+    than 20% poverty (table 3 of report_tables).
 
     Inputs:
-        -master_agg_by_neigh: (DataFrame): master aggregated table of 
-            evictions data and locator database for city of Chicago,
-            aggregated by zillow neighborhood
-    
-    Return: (str) output csv path for neighborhood-level poverty table
-
+        -master_agg_by_neigh: (DataFrame): table 1, from 
+            master_agg_by_neighborhood
+        -output_file: (str) output csv path for neighborhood-level poverty 
+            table
+    Returns:
+        -neigh_by_pov (DataFrame): summary table by poverty flag
     '''
-    master_agg_by_neigh['less_20_perc_pov'] = \
-                        np.where(master_agg_by_neigh['poverty_rate'] < .2, 1, 0)
-    grouped = master_agg_by_neigh.groupby('less_20_perc_pov')
-    agg = grouped.agg({'num_cha_properties' : 'sum',
-                       'eviction_rate' : 'mean',
-                       'poverty_rate' : 'mean'})
-
-    neigh_by_pov = agg[['num_cha_properties', 'poverty_rate', 'eviction_rate']]
-    
+    neigh_agg = add_derived(master_agg_by_neigh.copy(), [], NEIGH_FLAGS)
+    neigh_by_pov = summarize_neighborhoods(neigh_agg, *SUMMARY_TABLES[1])
     print("exporting table 3")
     neigh_by_pov.to_csv(output_file)
 
+    return neigh_by_pov
+
+
+def sweep_report(neigh_agg, homes=None, poverty=None, race=None):
+    '''
+    Recomputes the split tables of the report for vectors of thresholds. 
+    Each threshold is swept on its own, with the others at their default 
+    value in NEIGH_FLAGS.
+
+    Inputs:
+        -neigh_agg: (DataFrame) table aggregated by zillow neighborhood, from 
+            aggregate_neighborhoods
+        -homes: (list of floats) minimum numbers of HCV homes (table 2 split)
+        -poverty: (list of floats) poverty rate cutoffs (table 3 split and 
+            the less_20_perc_pov counts of table 2)
+        -race: (list of floats) race majority cutoffs (the majority and 
+            integrated counts of table 2)
+    Returns:
+        -sweeps: (dict) sweep name to table indexed by threshold and group
+    '''
+    homes_key, homes_aggs = SUMMARY_TABLES[0]
+    pov_key, pov_aggs = SUMMARY_TABLES[1]
+    sweeps = {}
+    if homes:
+        sweeps['homes'] = sweep_split_table(neigh_agg, homes_key, homes_aggs, 
+                                            homes)
+    if poverty:
+        sweeps['poverty'] = sweep_split_table(neigh_agg, pov_key, pov_aggs, 
+                                              poverty)
+        sweeps['poverty_by_homes'] = sweep_flag_sums(
+            neigh_agg, homes_key, [pov_key], poverty)
+    if race:
+        sweeps['race_by_homes'] = sweep_flag_sums(
+            neigh_agg, homes_key, 
+            ['maj_black', 'maj_white', 'maj_latino', 'integrated'], race)
+    return sweeps
+
+
+def sweep_split_table(neigh_agg, group_key, aggregations, thresholds):
+    '''
+    Computes a summary table (see summarize_neighborhoods) for every 
+    threshold of its group key flag at once. The neighborhoods are sorted 
+    by the flag's column once; each threshold then splits the sorted rows 
+    in two, and the sums and counts of both groups are read off cumulative 
+    sums.
+
+    Inputs:
+        -neigh_agg: (DataFrame) table aggregated by zillow neighborhood
+        -group_key: (str) flag of NEIGH_FLAGS splitting the neighborhoods
+        -aggregations: (list) of (output column, column, aggregation) tuples,
+            with 'sum', 'count' or 'mean' aggregations
+        -thresholds: (list of floats) flag thresholds
+    Returns:
+        -(DataFrame) summary table indexed by threshold and flag value
+    '''
+    col, op, _ = FLAG_SPEC[group_key]
+    values = neigh_agg[col].values.astype(float)
+    order = np.argsort(values, kind='mergesort')
+    n_valid = np.count_nonzero(~np.isnan(values))
+    thresholds = np.asarray(thresholds, dtype=float)
+    # rows of order[:cut] are below the threshold; missing values sort last 
+    # and are never flagged
+    cut = np.searchsorted(values[order][:n_valid], thresholds, side='left')
+    if op == 'lt':
+        flagged = (np.zeros_like(cut), cut)
+    else:
+        flagged = (cut, np.full_like(cut, n_valid))
+
+    columns = {}
+    for out_col, agg_col, how in aggregations:
+        agg_values = neigh_agg[agg_col].values.astype(float)[order]
+        prefix_sum = np.concatenate(
+            [[0], np.cumsum(np.nan_to_num(agg_values))])
+        prefix_count = np.concatenate([[0], np.cumsum(~np.isnan(agg_values))])
+        for flag in [0, 1]:
+            total_sum = prefix_sum[flagged[1]] - prefix_sum[flagged[0]]
+            total_count = prefix_count[flagged[1]] - prefix_count[flagged[0]]
+            if flag == 0:
+                total_sum = prefix_sum[-1] - total_sum
+                total_count = prefix_count[-1] - total_count
+            if how == 'sum':
+                result = total_sum
+            elif how == 'count':
+                result = total_count
+            else:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result = total_sum / total_count
+            columns.setdefault(out_col, []).append(result)
+
+    index = pd.MultiIndex.from_product([[0, 1], thresholds], 
+                                       names=[group_key, 'threshold'])
+    table = pd.DataFrame({out_col: np.concatenate(results) 
+                          for out_col, results in columns.items()}, 
+                         index=index)
+    return table.swaplevel().sort_index()
+
+
+def sweep_flag_sums(neigh_agg, group_key, flags, thresholds):
+    '''
+    Counts the neighborhoods with each flag for every threshold at once, 
+    by value of a group key flag at its default threshold. Within each 
+    group, a flag's column is sorted once and every threshold is a binary 
+    search. 'none' flags (e.g. integrated) use one threshold for all of 
+    their component flags.
+
+    Inputs:
+        -neigh_agg: (DataFrame) table aggregated by zillow neighborhood
+        -group_key: (str) flag column grouping the neighborhoods
+        -flags: (list of str) flags of NEIGH_FLAGS to count
+        -thresholds: (list of floats) flag thresholds
+    Returns:
+        -(DataFrame) flag counts indexed by threshold and group
+    '''
+    thresholds = np.asarray(thresholds, dtype=float)
+    tables = []
+    for group, rows in neigh_agg.groupby(group_key):
+        counts = {}
+        for flag in flags:
+            col, op, _ = FLAG_SPEC[flag]
+            if op == 'none':
+                # the component flags are all 'ge' flags: none of them is 
+                # set where the largest component value is below threshold
+                values = np.fmax.reduce(
+                    [rows[FLAG_SPEC[f][0]].values.astype(float) 
+                     for f in col])
+                counts[flag] = len(rows) - count_at_thresholds(
+                    values, thresholds, 'ge')
+            else:
+                counts[flag] = count_at_thresholds(
+                    rows[col].values.astype(float), thresholds, op)
+        index = pd.MultiIndex.from_product([thresholds, [group]], 
+                                           names=['threshold', group_key])
+        tables.append(pd.DataFrame(counts, index=index))
+    return pd.concat(tables).sort_index()
+
+
+def count_at_thresholds(values, thresholds, op):
+    '''
+    Counts the values passing a 'ge' or 'lt' comparison with each 
+    threshold, sorting the values once. Missing values never pass.
+
+    Inputs:
+        -values: (array of floats)
+        -thresholds: (array of floats)
+        -op: (str) 'ge' or 'lt'
+    Returns:
+        -(array of ints) count for each threshold
+    '''
+    valid = np.sort(values[~np.isnan(values)])
+    below = np.searchsorted(valid, thresholds, side='left')
+    if op == 'lt':
+        return below
+    return len(valid) - below
+
 
 def generate_map(locator_database, blocks_zillow_merge, map_filename):
     '''
@@ -427,20 +766,20 @@ def generate_map(locator_database, blocks_zillow_merge, map_filename):
     Inputs:
         -locator_database:(DataFrame) of locator database read in using 
          read_locator_db
-        -blocks_zillow_merge: geopandas dataframe of Census block groups mapped 
-            to zillow neighborhoods
+        -blocks_zillow_merge: geopandas dataframe of Census blocks or block 
+            groups mapped to zillow neighborhoods
         -map_filename: (str) output png path for map
 
     Returns:
         - map_filename (png)
     '''
+    import matplotlib.pyplot as plt
+
     #preparing data for map
     count_series = locator_database.groupby('GEOID').size()
     new_df = pd.DataFrame()
     new_df['GEOID'] = count_series.index
-    city_blocks = blocks_zillow_merge[['statefp10', 'name10', 'blockce10', 
-                                       'tract_bloc', 'geoid10', 'tractce10', 
-                                       'countyfp10', 'geometry', 'GEOID']]
+    city_blocks = blocks_zillow_merge[['geometry', 'GEOID']]
     new_df['count_properties'] = count_series.values
     merged = pd.merge(city_blocks, new_df, how="left")
     merged = merged.fillna(0)
@@ -461,21 +800,257 @@ def generate_map(locator_database, blocks_zillow_merge, map_filename):
     print("creating map")
 
 
-def main(output1, output2, output3, map_filename):
+def generate_maps(agg_df_by_geoid, blocks_zillow_merge, metrics, 
+                  zooms=(CITY_ZOOM,), map_dir=".", workers=None, 
+                  width=DEF_MAP_WIDTH):
+    '''
+    Creates one choropleth map per metric and zoom. The block group 
+    geometry is rasterized once per zoom into a grid of block group labels; 
+    each map then only colors the labels by its metric's values. Maps are 
+    rendered on a process pool.
+
+    Inputs:
+        -agg_df_by_geoid: (pandas df) master aggregated table, by geoid
+        -blocks_zillow_merge: geopandas dataframe of Census blocks or block 
+            groups mapped to zillow neighborhoods
+        -metrics: (list of str) keys of MAP_METRICS
+        -zooms: (list of str) CITY_ZOOM or zillow neighborhood names
+        -map_dir: (str) output directory
+        -workers: (int) number of rendering processes (default: one per cpu)
+        -width: (int) map width in raster cells
+
+    Returns:
+        -map_files: (list of str) filenames of the maps
+    '''
+    geoids = pd.Index(blocks_zillow_merge['GEOID'].unique())
+    rasters = {zoom: rasterize_block_groups(
+                         blocks_zillow_merge, geoids, 
+                         zoom_bounds(blocks_zillow_merge, zoom), width)
+               for zoom in zooms}
+
+    by_geoid = agg_df_by_geoid.groupby('GEOID').sum(numeric_only=True)
+    by_geoid = by_geoid.reindex(geoids)
+    os.makedirs(map_dir, exist_ok=True)
+    jobs = []
+    for metric in metrics:
+        numerator, denominator, _ = MAP_METRICS[metric]
+        if denominator:
+            values = by_geoid[numerator] / by_geoid[denominator]
+            values = values.replace([np.inf, -np.inf], np.nan)
+        else:
+            values = by_geoid[numerator].fillna(0)
+        for zoom in zooms:
+            map_file = os.path.join(map_dir, MAP_OUTPUT.format(
+                metric, zoom.replace(" ", "_")))
+            jobs.append((metric, zoom, values.values, map_file))
+
+    with ProcessPoolExecutor(workers, initializer=init_map_worker,
+                             initargs=(rasters,)) as renderers:
+        map_files = list(renderers.map(render_map, *zip(*jobs)))
+    print("creating {} maps".format(len(map_files)))
+
+    return map_files
+
+
+def zoom_bounds(blocks_zillow_merge, zoom, pad=.02):
+    '''
+    Gets the lon/lat bounds of a zoom: the whole city, or the block groups 
+    of a zillow neighborhood, padded on each side by a share of their size.
+    '''
+    if zoom != CITY_ZOOM:
+        blocks_zillow_merge = \
+            blocks_zillow_merge[blocks_zillow_merge['Name'] == zoom]
+        if blocks_zillow_merge.empty:
+            raise ValueError("Unknown neighborhood: " + zoom)
+    minx, miny, maxx, maxy = blocks_zillow_merge.total_bounds
+    dx, dy = (maxx - minx) * pad, (maxy - miny) * pad
+    return (minx - dx, miny - dy, maxx + dx, maxy + dy)
+
+
+def rasterize_block_groups(blocks_zillow_merge, geoids, bounds, width):
+    '''
+    Rasterizes block (group) polygons into a grid of block group labels: 
+    the position of the cell's GEOID in geoids, or -1 outside all 
+    polygons. Cells are square on the ground at the latitude of the map.
+
+    Inputs:
+        -blocks_zillow_merge: geopandas dataframe of Census blocks or block 
+            groups, in lon/lat
+        -geoids: (Index) GEOIDs of the labels
+        -bounds: (tuple) minx, miny, maxx, maxy of the map
+        -width: (int) number of cells across
+
+    Returns:
+        -(tuple) labels (2d int array), the map extent for imshow and the 
+            aspect ratio of the cells
+    '''
+    from matplotlib.path import Path
+
+    minx, miny, maxx, maxy = bounds
+    aspect = 1 / np.cos(np.radians((miny + maxy) / 2))
+    height = max(1, int(round(width * (maxy - miny) * aspect / (maxx - minx))))
+    xs = minx + (np.arange(width) + .5) * (maxx - minx) / width
+    ys = maxy - (np.arange(height) + .5) * (maxy - miny) / height
+    labels = np.full((height, width), -1, dtype=np.int32)
+
+    codes = geoids.get_indexer(blocks_zillow_merge['GEOID'])
+    for code, geom in zip(codes, blocks_zillow_merge.geometry):
+        if geom is None:
+            continue
+        for poly in getattr(geom, 'geoms', [geom]):
+            x0, y0, x1, y1 = poly.bounds
+            cols = np.nonzero((xs >= x0) & (xs <= x1))[0]
+            rows = np.nonzero((ys >= y0) & (ys <= y1))[0]
+            if not len(cols) or not len(rows):
+                continue
+            grid_x, grid_y = np.meshgrid(xs[cols], ys[rows])
+            points = np.column_stack([grid_x.ravel(), grid_y.ravel()])
+            inside = Path(np.asarray(poly.exterior.coords)).contains_points(
+                points)
+            for hole in poly.interiors:
+                inside &= ~Path(np.asarray(hole.coords)).contains_points(
+                    points)
+            cells = labels[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+            cells[inside.reshape(cells.shape)] = code
+
+    return labels, (minx, maxx, miny, maxy), aspect
+
+
+def init_map_worker(rasters):
+    '''
+    Initializes a map rendering process with the rasterized base layers.
+    '''
+    MAP_RASTERS.update(rasters)
+
+
+def render_map(metric, zoom, values, map_file, bins=DEF_MAP_BINS):
+    '''
+    Renders one choropleth map from a rasterized base layer, with the 
+    block group values classified into quantile bins.
+
+    Inputs:
+        -metric: (str) key of MAP_METRICS
+        -zoom: (str) key of MAP_RASTERS
+        -values: (array) metric value of each block group label
+        -map_file: (str) output png path
+        -bins: (int) number of quantile bins
+
+    Returns:
+        -map_file (png)
+    '''
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.colors import BoundaryNorm, ListedColormap
+    from matplotlib.figure import Figure
+
+    labels, extent, aspect = MAP_RASTERS[zoom]
+    valid = values[~np.isnan(values)]
+    edges = np.unique(np.quantile(valid, np.linspace(0, 1, bins + 1))) \
+            if len(valid) else np.array([0, 1])
+    if len(edges) == 1:
+        edges = np.append(edges, edges[0] + 1)
+    bin_of = np.clip(np.searchsorted(edges, values, side='left') - 1, 
+                     0, len(edges) - 2)
+
+    colors = plt.get_cmap('Blues')(np.linspace(.15, 1, len(edges) - 1))
+    # one color per label, then no data (grey) and outside (transparent); 
+    # label -1 picks the last row
+    label_colors = np.vstack([colors[bin_of], [.85, .85, .85, 1], 
+                              [1, 1, 1, 0]])
+    label_colors[:-2][np.isnan(values)] = label_colors[-2]
+
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.imshow(label_colors[labels], extent=extent, aspect=aspect, 
+              interpolation='nearest')
+    ax.axis('off')
+    cmap = ListedColormap(colors)
+    sm = plt.cm.ScalarMappable(cmap=cmap, 
+                               norm=BoundaryNorm(edges, cmap.N))
+    sm._A = []
+    fig.colorbar(sm, ax=ax)
+    title = MAP_METRICS[metric][2]
+    if zoom != CITY_ZOOM:
+        title += ": " + zoom
+    ax.set_title(title, fontdict={'fontsize': '15', 'fontweight' : '3'})
+    fig.savefig(map_file, dpi=DEF_MAP_DPI)
+
+    return map_file
+
+
+def main(output1, output2, output3, map_filename, block_group_cache=None,
+         sweeps=None, sweep_output=None, maps=None, tables_only=False,
+         block_group_lookup=BLOCK_GROUP_LOOKUP,
+         locator_db_csv=LOCATOR_DB_CSV):
     '''
     Builds, formats, and stores database as csv.
     Returns nothing.
     '''
     db = build_agg_tables(
-        LOCATOR_DB_CSV, 
+        locator_db_csv, 
         BLOCK_GROUPS_CSV, 
         CITY_BLOCKS_JSON,   
         ZILLOW_SHAPEFILE, 
         output1,
         output2,
         output3,
-        map_filename)
+        map_filename,
+        block_group_cache,
+        sweeps,
+        sweep_output,
+        maps,
+        tables_only,
+        block_group_lookup)
 
 
 if __name__ == '__main__':
-    main(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+    parser = argparse.ArgumentParser(
+        description="Generate neighborhood summary tables and a map")
+    parser.add_argument("output1")
+    parser.add_argument("output2")
+    parser.add_argument("output3")
+    parser.add_argument("map_filename", nargs="?", default=None,
+                        help="output png (not needed with --tables-only)")
+    parser.add_argument("--geometry-cache", default=None,
+                        help="block group GeoParquet file written by "
+                        "preprocess_geometry.py, e.g. " + 
+                        BLOCK_GROUP_CACHE.format(0.0005))
+    parser.add_argument("--sweep-homes", nargs="+", type=float, default=None,
+                        help="minimum numbers of HCV homes for table 2")
+    parser.add_argument("--sweep-poverty", nargs="+", type=float, 
+                        default=None, help="poverty rate cutoffs")
+    parser.add_argument("--sweep-race", nargs="+", type=float, default=None,
+                        help="race majority cutoffs")
+    parser.add_argument("--sweep-output", default="sweep",
+                        help="filename prefix of the sweep tables")
+    parser.add_argument("--maps", nargs="+", default=None, 
+                        choices=sorted(MAP_METRICS),
+                        help="metrics of the batch maps")
+    parser.add_argument("--zooms", nargs="+", default=[CITY_ZOOM],
+                        help="'{}' and/or zillow neighborhood names of the "
+                        "batch maps".format(CITY_ZOOM))
+    parser.add_argument("--map-dir", default=".",
+                        help="output directory of the batch maps")
+    parser.add_argument("--map-workers", type=int, default=None)
+    parser.add_argument("--tables-only", action="store_true",
+                        help="only export the tables, using the block group "
+                        "lookup instead of any geometry")
+    parser.add_argument("--block-group-lookup", default=BLOCK_GROUP_LOOKUP,
+                        help="GEOID to neighborhood csv written by "
+                        "preprocess_geometry.py")
+    parser.add_argument("--store", default=None,
+                        help="read the locator database from the current "
+                        "snapshot of a versioned store (snapshot_store.py)")
+    args = parser.parse_args()
+    if not (args.map_filename or args.tables_only):
+        parser.error("map_filename is required without --tables-only")
+    maps = {"metrics": args.maps, "zooms": args.zooms, 
+            "map_dir": args.map_dir, "workers": args.map_workers}
+    sweeps = {"homes": args.sweep_homes, "poverty": args.sweep_poverty,
+              "race": args.sweep_race}
+    main(args.output1, args.output2, args.output3, args.map_filename,
+         args.geometry_cache, sweeps, args.sweep_output, maps, 
+         args.tables_only, args.block_group_lookup,
+         snapshot_store.current_path(args.store) if args.store
+         else LOCATOR_DB_CSV)
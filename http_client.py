@@ -0,0 +1,234 @@
+'''
+HTTP client layer for the scrapers: a shared pooled session with
+connect/read timeouts, bounded exponential-backoff retries, gzip, per-host
+politeness limits, and an optional content-addressed on-disk response cache
+that can replay a recorded crawl offline.
+
+Cache layout under cache_dir:
+    objects/<sha256 of body>    response bodies, stored once per content
+    index/<sha256 of url>       json record of the url and its body hash
+
+Aya Liu
+'''
+
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+import requests
+import util
+
+# default client settings
+DEF_POOL_SIZE = 10
+DEF_CONNECT_TIMEOUT = 5
+DEF_READ_TIMEOUT = 30
+DEF_RETRIES = 3
+DEF_BACKOFF = 1
+
+# responses worth retrying, and responses meaning the page does not exist
+RETRY_STATUS = [429, 500, 502, 503, 504]
+MISSING_STATUS = [403, 404]
+
+
+class FetchError(Exception):
+    '''
+    Raised when a page cannot be fetched (after retries) or, in replay mode,
+    is not in the cache.
+    '''
+
+
+def get_session(pool_size=DEF_POOL_SIZE):
+    '''
+    Create a requests session that keeps up to pool_size connections per
+    host alive, to be shared by concurrent requests.
+
+    Inputs:
+        pool_size: (int) maximum number of pooled connections per host
+
+    Outputs:
+        requests.Session object
+    '''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class RateLimiter:
+    '''
+    Thread-safe politeness limiter spacing out the start of requests by
+    at least delay seconds.
+    '''
+    def __init__(self, delay):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        '''
+        Block until the next request is allowed to start.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+
+class HttpClient:
+    '''
+    Thread-safe HTTP client shared by all downloads of a crawl.
+
+    '''
+    def __init__(self, pool_size=DEF_POOL_SIZE,
+                 timeout=(DEF_CONNECT_TIMEOUT, DEF_READ_TIMEOUT),
+                 retries=DEF_RETRIES, backoff=DEF_BACKOFF, delay=0,
+                 cache_dir=None, replay=False):
+        '''
+        Constructor to initialize an HttpClient object.
+
+        Inputs:
+            pool_size (int): maximum number of pooled connections per host
+            timeout (tuple): connect and read timeouts in seconds
+            retries (int): maximum number of retries per request
+            backoff (float): seconds to wait before the first retry, doubled
+                             for each further retry
+            delay (float): minimum seconds between the start of two requests
+                           to the same host
+            cache_dir (str): directory of the response cache, None for no
+                             cache. Live requests only write to it.
+            replay (bool): serve responses from the cache only, without
+                           touching the network
+        '''
+        if replay and not cache_dir:
+            raise ValueError("Replay needs a cache directory")
+        self.session = get_session(pool_size)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.delay = delay
+        self.cache_dir = cache_dir
+        self.replay = replay
+        self.limiters = {}
+
+    def get(self, url):
+        '''
+        Fetch the text of a page. In replay mode it is read from the cache;
+        otherwise it is downloaded, and recorded in the cache if there is
+        one, so live crawls never serve stale pages.
+
+        Input: url (str): absolute url
+        Returns: (str) page content
+        '''
+        if self.replay:
+            text = self.read_cache(url)
+            if text is None:
+                raise FetchError("Not in replay cache: " + url)
+            return text
+
+        text = self.fetch(url)
+        if self.cache_dir:
+            self.write_cache(url, text)
+        return text
+
+    def fetch(self, url):
+        '''
+        Fetch the text of a page from the network, retrying connection
+        errors, timeouts and server errors with exponential backoff.
+
+        Input: url (str): absolute url
+        Returns: (str) page content
+        '''
+        if not util.is_absolute_url(url):
+            raise FetchError("Not an absolute url: " + url)
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            self.limiter(url).wait()
+            try:
+                r = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = repr(e)
+                continue
+            if r.status_code in MISSING_STATUS:
+                raise FetchError("HTTP {}: {}".format(r.status_code, url))
+            if r.status_code in RETRY_STATUS:
+                error = "HTTP {}".format(r.status_code)
+                continue
+            try:
+                r.raise_for_status()
+            except requests.HTTPError as e:
+                raise FetchError("{}: {}".format(e, url))
+            return r.text
+
+        raise FetchError("Failed after {} retries ({}): {}".format(
+            self.retries, error, url))
+
+    def limiter(self, url):
+        '''
+        Get the politeness limiter of the host of url.
+        '''
+        host = urllib.parse.urlparse(url).netloc
+        if host not in self.limiters:
+            self.limiters.setdefault(host, RateLimiter(self.delay))
+        return self.limiters[host]
+
+    def index_path(self, url):
+        '''
+        Path of the cache index record of url.
+        '''
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, "index", key)
+
+    def read_cache(self, url):
+        '''
+        Read a recorded response.
+
+        Input: url (str)
+        Returns: (str) page content, or None if url is not recorded
+        '''
+        path = self.index_path(url)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            record = json.load(f)
+        with open(os.path.join(self.cache_dir, "objects",
+                               record["sha256"]), "rb") as f:
+            return f.read().decode("utf-8")
+
+    def write_cache(self, url, text):
+        '''
+        Record a response. Files are written to a temporary name and
+        renamed, so concurrent readers never see partial files.
+
+        Inputs:
+            url (str)
+            text (str): page content
+        '''
+        body = text.encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()
+        obj_path = os.path.join(self.cache_dir, "objects", digest)
+        if not os.path.exists(obj_path):
+            atomic_write(obj_path, body)
+        record = {"url": url, "sha256": digest, "fetched": time.time()}
+        atomic_write(self.index_path(url), json.dumps(record).encode())
+
+
+def atomic_write(path, data):
+    '''
+    Write bytes to path through a temporary file and a rename.
+    '''
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -0,0 +1,202 @@
+'''
+Embedded SQLite store of the locator database, for searching without
+loading the whole database into every process.
+
+The listings table keeps the rows of locator_database.csv in order (row_id
+is the row number of the csv) with B-tree indexes on the search fields
+(rent, bed, bath, neighborhood, property type, availability) and an R*Tree
+on Lat/Long. A user.Criteria compiles into one parameterized SQL query with
+a LIMIT, and its results are the rows user.search finds in the csv.
+
+Usage:
+    python3 locator_sqlite.py <locator database csv> <sqlite output>
+
+Aya Liu, Bhargavi Ganesh, and Vedika Ahuja
+
+'''
+import argparse
+import os
+import sqlite3
+import pandas as pd
+import pandas.io.sql
+
+DEF_SQLITE = "processed_data/locator_database.sqlite"
+TABLE = "listings"
+RTREE = "listings_rtree"
+# columns whose pandas dtype SQLite does not keep
+DTYPES_TABLE = "listings_dtypes"
+INDEXED_COLS = ["Monthly Rent", "Bed", "Bath", "Neighborhood",
+                "Property Type", "Availability"]
+
+# search result columns and L-stop distance columns, shared with user.py
+USER_COLS = ['Address', 'Monthly Rent', 'Property Type', 'Bath', 'Bed',
+             'Availability', 'Contact', 'URL', 'State', 'County', 'City',
+             'Neighborhood', '2016_evict_rate', 'er_percentile',
+             '2016_evict_filing_rate', 'efr_percentile',
+             '2011-2015_rent_perc_change', '2015-2019_rent_perc_change',
+             'potential_bad_landlord', 'bad_landlord_address',
+             'num_stops_quart_mi', 'num_stops_half_mi',
+             'num_stops_3quart_mi', 'num_stops_1_mi']
+DIST_TO_COL = {0.25: "num_stops_quart_mi",
+               0.5: "num_stops_half_mi",
+               0.75: "num_stops_3quart_mi",
+               1: "num_stops_1_mi"}
+
+
+def write_sqlite(db, filename):
+    '''
+    Write the locator database to a new SQLite file with its indexes.
+
+    Inputs:
+        db (DataFrame or iterator of DataFrames): locator database as read
+            from its csv (listing id in the 'index' column), or its
+            consecutive chunks (pd.read_csv with chunksize), so large
+            databases are written with bounded memory
+        filename (str): output filename, replaced if it exists
+    '''
+    if os.path.exists(filename):
+        os.remove(filename)
+    chunks = [db] if isinstance(db, pd.DataFrame) else db
+    rows = 0
+    bool_cols = None
+    with sqlite3.connect(filename) as con:
+        for chunk in chunks:
+            chunk = chunk.reset_index(drop=True)
+            chunk.index = pd.RangeIndex(rows, rows + len(chunk),
+                                        name="row_id")
+            if bool_cols is None:
+                # row_id is the INTEGER PRIMARY KEY, an alias of SQLite's
+                # rowid
+                con.execute(pandas.io.sql.get_schema(
+                    chunk.reset_index(), TABLE, keys="row_id", con=con))
+                bool_cols = [col for col in chunk.columns
+                             if chunk[col].dtype == bool]
+            chunk.to_sql(TABLE, con, if_exists="append")
+            bool_cols = [col for col in bool_cols if chunk[col].dtype == bool]
+            rows += len(chunk)
+
+        for col in INDEXED_COLS:
+            con.execute("CREATE INDEX {} ON {} ({})".format(
+                quote("ix_" + col.replace(" ", "_").lower()), TABLE,
+                quote(col)))
+
+        con.execute("CREATE VIRTUAL TABLE {} USING rtree(id, min_lat, "
+                    "max_lat, min_long, max_long)".format(RTREE))
+        con.execute("INSERT INTO {} SELECT row_id, Lat, Lat, Long, Long "
+                    "FROM {} WHERE Lat IS NOT NULL AND Long IS NOT NULL"
+                    .format(RTREE, TABLE))
+
+        pd.DataFrame({"column": bool_cols or [], "dtype": "bool"}).to_sql(
+            DTYPES_TABLE, con, index=False)
+        con.execute("ANALYZE")
+
+
+def connect(filename=DEF_SQLITE):
+    '''
+    Open a read-only connection. Readers only take shared locks, so any
+    number of threads or processes can search at the same time, each with
+    its own connection.
+    '''
+    if not os.path.exists(filename):
+        raise FileNotFoundError(filename)
+    return sqlite3.connect("file:{}?mode=ro".format(filename), uri=True,
+                           check_same_thread=False)
+
+
+def compile_criteria(cd, columns=USER_COLS, limit=None, bounds=None):
+    '''
+    Compile a criteria dictionary into one parameterized query, applying
+    the filters of user.search.
+
+    Inputs:
+        cd (dict): the dict attribute of a user.Criteria
+        columns (list of str): columns to select
+        limit (int): maximum number of rows, None for all
+        bounds (tuple): optional (min lat, min long, max lat, max long)
+                        box the listings must lie in, answered by the
+                        R*Tree
+    Returns: (tuple) SQL string and list of parameters
+    '''
+    clauses, params = [], []
+    if cd["Address"]:
+        clauses.append('"Address" = ?')
+        params.append(cd["Address"])
+    for field in ["Monthly Rent", "Bath", "Bed"]:
+        if cd[field]:
+            clauses.append("{} BETWEEN ? AND ?".format(quote(field)))
+            params.extend(cd[field])
+    for field in ["Property Type", "Neighborhood", "City"]:
+        if cd.get(field):
+            clauses.append("{} IN ({})".format(
+                quote(field), ", ".join("?" * len(cd[field]))))
+            params.extend(cd[field])
+    if cd["Available Now"]:
+        clauses.append('"Availability" = ?')
+        params.append("Available Now")
+    if cd["Has L-Stop within _ Mile"]:
+        clauses.append("{} > 0".format(
+            quote(DIST_TO_COL[cd["Has L-Stop within _ Mile"]])))
+    if bounds:
+        min_lat, min_long, max_lat, max_long = bounds
+        # the R*Tree stores rounded-out 32-bit boxes; the exact check
+        # follows on the candidates
+        clauses.append("row_id IN (SELECT id FROM {} WHERE max_lat >= ? AND "
+                       "min_lat <= ? AND max_long >= ? AND min_long <= ?)"
+                       .format(RTREE))
+        clauses.append('"Lat" BETWEEN ? AND ? AND "Long" BETWEEN ? AND ?')
+        params += [min_lat, max_lat, min_long, max_long] * 2
+
+    sql = "SELECT row_id, {} FROM {}".format(
+        ", ".join(quote(col) for col in columns), TABLE)
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY row_id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    return sql, [to_sql_param(p) for p in params]
+
+
+def query(criteria, con, columns=USER_COLS, limit=None, bounds=None):
+    '''
+    Search the SQLite store.
+
+    Inputs:
+        criteria (Criteria): a user.Criteria object
+        con: connection from connect()
+        columns, limit, bounds: see compile_criteria
+    Returns: (DataFrame) matching listings, indexed by their row number in
+             the locator database csv
+    '''
+    sql, params = compile_criteria(criteria.dict, columns, limit, bounds)
+    rv = pd.read_sql_query(sql, con, params=params, index_col="row_id")
+    rv.index.name = None
+    bool_cols = pd.read_sql_query("SELECT * FROM {}".format(DTYPES_TABLE),
+                                  con)["column"]
+    for col in bool_cols:
+        if col in rv.columns and rv[col].notna().all():
+            rv[col] = rv[col].astype(bool)
+    return rv
+
+
+def to_sql_param(value):
+    '''
+    Convert numpy scalars in criteria to Python values for sqlite3.
+    '''
+    return value.item() if hasattr(value, "item") else value
+
+
+def quote(name):
+    '''
+    Quote a column or index name for SQL.
+    '''
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Write the locator database to SQLite")
+    parser.add_argument("database_csv")
+    parser.add_argument("sqlite_output", nargs="?", default=DEF_SQLITE)
+    args = parser.parse_args()
+    write_sqlite(pd.read_csv(args.database_csv), args.sqlite_output)
@@ -0,0 +1,102 @@
+'''
+One-time preprocessing of the Census block geometry used by
+generate_report: dissolves the Chicago census blocks to block groups,
+attaches each block group's Zillow neighborhood, and stores the geometry
+simplified at a few tolerance levels as GeoParquet files. Report runs read
+one of those files instead of the raw block GeoJSON. The GEOID to
+neighborhood lookup is also written as a csv for tables-only report runs.
+
+Usage:
+    python3 preprocess_geometry.py [<output directory>]
+
+Aya Liu, Bhargavi Ganesh, Vedika Ahuja
+'''
+import os
+import sys
+import geopandas
+import shapely
+from generate_report import (create_city_blocks, CITY_BLOCKS_JSON,
+                             ZILLOW_SHAPEFILE, BLOCK_GROUP_CACHE,
+                             BLOCK_GROUP_LOOKUP)
+
+# simplification tolerances in degrees (0 keeps the full geometry)
+TOLERANCES = [0, 0.0001, 0.0005, 0.001]
+
+
+def build_block_group_cache(city_blocks_json, zillow_shapefile, output_dir,
+                            tolerances=TOLERANCES):
+    '''
+    Dissolve census blocks to block groups and write one GeoParquet file
+    per simplification tolerance, and the csv lookup of block group to
+    neighborhood.
+
+    Inputs:
+        -city_blocks_json: geojson of Census blocks clipped for Chicago
+        -zillow_shapefile: (shapefile) of the state of Illinois by
+                            zillow-defined neighborhood
+        -output_dir: (str) directory of the output files
+        -tolerances: (list of floats) simplification tolerances in degrees
+
+    Returns:
+        -paths: (list of str) output filenames, one per tolerance, and the
+                lookup filename
+    '''
+    blocks_zillow_merge = create_city_blocks(city_blocks_json,
+                                             zillow_shapefile)
+    # neighborhood of each block group, as in make_master_agg_dataset
+    lookup = blocks_zillow_merge[['GEOID', 'Name', 'RegionID']]
+    lookup = lookup.drop_duplicates('GEOID', keep="first")
+
+    # the sjoin repeats blocks intersecting several neighborhoods
+    blocks = blocks_zillow_merge[~blocks_zillow_merge.index.duplicated()]
+    block_groups = blocks[['GEOID', 'geometry']].dissolve(by='GEOID')
+    block_groups = block_groups.reset_index()
+    block_groups = block_groups.merge(lookup, on='GEOID', how='left')
+
+    os.makedirs(output_dir, exist_ok=True)
+    lookup_path = os.path.join(output_dir,
+                               os.path.basename(BLOCK_GROUP_LOOKUP))
+    lookup.to_csv(lookup_path, index=False)
+    print("wrote " + lookup_path)
+    paths = [lookup_path]
+    for tolerance in tolerances:
+        simplified = block_groups.copy()
+        simplified['geometry'] = simplify_coverage(block_groups.geometry,
+                                                   tolerance)
+        path = os.path.join(output_dir,
+                            os.path.basename(BLOCK_GROUP_CACHE.format(
+                                tolerance)))
+        simplified.to_parquet(path)
+        paths.append(path)
+        print("wrote " + path)
+
+    return paths
+
+
+def simplify_coverage(geometry, tolerance):
+    '''
+    Simplify block group polygons while preserving topology. Where shapely
+    supports it, the block groups are simplified as a coverage, so that
+    shared edges stay shared and no gaps or overlaps appear between
+    neighbors; otherwise each polygon is simplified on its own.
+
+    Inputs:
+        -geometry: (GeoSeries) block group polygons
+        -tolerance: (float) simplification tolerance in degrees
+
+    Returns:
+        -(GeoSeries) simplified polygons
+    '''
+    if not tolerance:
+        return geometry
+    if hasattr(shapely, 'coverage_simplify'):
+        return geopandas.GeoSeries(
+            shapely.coverage_simplify(geometry.values, tolerance),
+            index=geometry.index, crs=geometry.crs)
+    return geometry.simplify(tolerance, preserve_topology=True)
+
+
+if __name__ == '__main__':
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else \
+        os.path.dirname(BLOCK_GROUP_CACHE)
+    build_block_group_cache(CITY_BLOCKS_JSON, ZILLOW_SHAPEFILE, out_dir)
@@ -4,12 +4,16 @@ Joins units to Census block groups and Zillow neighborhoods on geocodes
 
 Aya Liu, Bhargavi Ganesh, Vedika Ahuja
 '''
+import json
 import pickle
 import pandas as pd
 import geopandas
 from shapely.geometry import Point
 import matplotlib.pyplot as plt
 
+CHA_COLS = ['Address', 'Monthly Rent', 'Property Type', 'Bath', 'Bed',
+            'Availability', 'Contact', 'URL', 'Lat', 'Long']
+
 
 def process_cha_data(cha_dict_raw, blocks_filename, zillow_filename):
     '''
@@ -29,19 +33,22 @@ def load_and_clean_cha(cha_filename):
     Load and clean CHA data.
     
     Input:
-        (str) file name of the raw CHA housing unit data
+        (str) file name of the raw CHA housing unit data, either a pickled
+            listing dictionary or a JSON lines file written by
+            cha_scraper.scrape_to_file
     Returns:
         (DataFrame) clean CHA data
     '''
     # load raw CHA data
-    with open(cha_filename, "rb") as f:    
-        d = pickle.load(f)
+    if cha_filename.endswith(".jsonl"):
+        d = read_cha_jsonl(cha_filename, CHA_COLS)
+    else:
+        with open(cha_filename, "rb") as f:    
+            d = pickle.load(f)
     cha = pd.DataFrame.from_dict(data=d, orient="index")
     
     # clean CHA data
-    cols = ['Address', 'Monthly Rent', 'Property Type', 'Bath', 'Bed',
-            'Availability', 'Contact', 'URL', 'Lat', 'Long']
-    cha = cha[cols]
+    cha = cha[CHA_COLS]
     cha.Long = -1 * cha.Long
 
     # correct an one-off location error
@@ -51,6 +58,43 @@ def load_and_clean_cha(cha_filename):
     return cha
 
 
+def read_cha_jsonl(cha_filename, cols=None):
+    '''
+    Stream-read a JSON lines file of CHA listings, one listing per line,
+    keeping only the given attributes. A listing appearing on several
+    lines (e.g. a page scraped again after resuming a crawl) keeps its
+    last line. A last line that does not parse, torn by a crash while the
+    file was written, is skipped.
+
+    Input:
+        cha_filename: (str) JSON lines filename
+        cols: (list) listing attributes to keep (default: all but the
+              id)
+    Returns:
+        (dict) listing id to attributes
+    '''
+    d = {}
+    torn = None
+    with open(cha_filename) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if torn:
+                # only the last line can be torn by a crash
+                raise torn
+            try:
+                listing = json.loads(line)
+            except ValueError as e:
+                torn = e
+                continue
+            l_id = listing.pop("id")
+            if cols is None:
+                d[l_id] = listing
+            else:
+                d[l_id] = {col: listing.get(col) for col in cols}
+    return d
+
+
 def convert_to_gdf(df):
     '''
     Convert a DataFrame with "Lat" and "Long" columns to a GeoDataFrame
@@ -73,15 +117,7 @@ def add_blocks_to_cha(gcha, blocks_filename):
         blocks_filename: (str) filename of the block group geojson
     Returns: (GeoDataFrame) CHA geodataframe with block group GEOIDs
     '''
-    blocks = geopandas.read_file(blocks_filename).filter(
-        ['geometry', 'GEOID'])
-    blocks.crs = {'init': 'epsg:4326'}
-    gcha.crs = {'init': 'epsg:4326'}
-
-    cha_with_geoid = geopandas.sjoin(gcha, blocks, how="left", 
-                                     op='intersects')
-    cha_with_geoid.drop('index_right', axis=1, inplace=True)
-    return cha_with_geoid
+    return join_blocks(gcha, read_blocks(blocks_filename))
 
 
 def add_zillow_regionid_to_cha(gcha, zillow_filename):
@@ -93,10 +129,61 @@ def add_zillow_regionid_to_cha(gcha, zillow_filename):
         zillow_filename: (str) filename of the zillow region shp file  
     Returns: (GeoDataFrame) CHA geodataframe with block group GEOIDs
     '''
+    return join_zillow(gcha, read_zillow_neighborhoods(zillow_filename))
+
+
+def process_cha_frame(cha, blocks, zillow_neighborhoods):
+    '''
+    Map clean CHA housing units to geoid and zillow regionid, with the
+    geography already read (e.g. once for all partitions of a chunked
+    build).
+
+    Inputs:
+        cha: (DataFrame) clean CHA data from load_and_clean_cha
+        blocks: (GeoDataFrame) from read_blocks
+        zillow_neighborhoods: (GeoDataFrame) from read_zillow_neighborhoods
+    Returns: (GeoDataFrame) as process_cha_data
+    '''
+    gcha = convert_to_gdf(cha)
+    return join_zillow(join_blocks(gcha, blocks), zillow_neighborhoods)
+
+
+def read_blocks(blocks_filename):
+    '''
+    Read the block group geometry and GEOIDs.
+    '''
+    blocks = geopandas.read_file(blocks_filename).filter(
+        ['geometry', 'GEOID'])
+    blocks.crs = {'init': 'epsg:4326'}
+    return blocks
+
+
+def read_zillow_neighborhoods(zillow_filename):
+    '''
+    Read the zillow neighborhood geometry and attributes.
+    '''
     zillow_neighborhoods = geopandas.read_file(zillow_filename)
     zillow_neighborhoods.crs = {'init': 'epsg:4326'}
+    return zillow_neighborhoods
+
+
+def join_blocks(gcha, blocks):
+    '''
+    Spatially join CHA housing units to block groups.
+    '''
     gcha.crs = {'init': 'epsg:4326'}
+    cha_with_geoid = geopandas.sjoin(gcha, blocks, how="left", 
+                                     op='intersects')
+    cha_with_geoid.drop('index_right', axis=1, inplace=True)
+    return cha_with_geoid
+
 
+def join_zillow(gcha, zillow_neighborhoods):
+    '''
+    Spatially join CHA housing units to zillow neighborhoods, dropping
+    units outside every neighborhood.
+    '''
+    gcha.crs = {'init': 'epsg:4326'}
     cha_geoid_zillow = geopandas.sjoin(gcha, zillow_neighborhoods, 
                                        how="left", op='intersects')
     # drop unmatches and extra columns
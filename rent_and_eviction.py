@@ -10,6 +10,8 @@ import pandas as pd
 ZILLOW_FILE = "data/Neighborhood_Zri_AllHomesPlusMultifamily.csv"
 EVICTIONS_FILE = "data/block-groups.csv"
 ZILLOW_WITH_INC = "processed_data/zillow_rindex_with_increase.csv"
+# Eviction Lab parent locations (counties) of the block groups kept
+DEF_COUNTIES = ['Cook County, Illinois']
 
 def read_and_process_rindex(csv_file, output_filename):
     '''
@@ -53,7 +55,7 @@ def read_and_process_rindex(csv_file, output_filename):
     return neighborhood_rent_df
 
 
-def read_and_process_evictions(csv_file):
+def read_and_process_evictions(csv_file, counties=DEF_COUNTIES):
     '''
     This function takes the block groups data (for Illinois) 
     downloaded from the evictions database and creates a 
@@ -61,6 +63,8 @@ def read_and_process_evictions(csv_file):
 
     Inputs:
         - evictions_file: csv file path
+        - counties: list of the parent locations to keep, e.g.
+                    'Cook County, Illinois'
     Returns:
         - blockgroups_df: pandas dataframe of blockgroups
     '''
@@ -94,6 +98,6 @@ def read_and_process_evictions(csv_file):
                 }
     if os.path.exists(csv_file):
         df = pd.read_csv(csv_file, dtype=col_types)
-        filtered_df = df[df['parent-location'].isin(['Cook County, Illinois'])]
+        filtered_df = df[df['parent-location'].isin(counties)]
         
     return filtered_df
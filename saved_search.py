@@ -0,0 +1,293 @@
+'''
+Saved searches for the rental unit locator.
+
+Stores user.Criteria objects under a name and matches newly added listings
+against all of them at once through a reverse index over the criteria, so
+alerting families about new units does not require rerunning user.search
+for every saved search after every scrape.
+
+Aya Liu, Bhargavi Ganesh, and Vedika Ahuja
+
+'''
+import copy
+import pickle
+from user import DIST_TO_COL
+
+RANGE_FIELDS = ["Monthly Rent", "Bed", "Bath"]
+LIST_FIELDS = ["Neighborhood", "Property Type", "City"]
+# listing id column of the database csv (read with pd.read_csv, the frame
+# index is only the row position)
+ID_COL = "index"
+
+
+class IntervalTree:
+    '''
+    Static centered interval tree answering stabbing queries: which of the
+    stored closed intervals [lb, ub] contain a point.
+
+    '''
+    def __init__(self, intervals):
+        '''
+        Build the tree.
+
+        Input:
+            intervals: (list of tuples) (lb, ub, key) triples
+        '''
+        self.center = None
+        self.left = None
+        self.right = None
+        if not intervals:
+            return
+
+        points = sorted([lb for lb, _, _ in intervals] +
+                        [ub for _, ub, _ in intervals])
+        self.center = points[len(points) // 2]
+        to_left, to_right, here = [], [], []
+        for interval in intervals:
+            lb, ub, _ = interval
+            if ub < self.center:
+                to_left.append(interval)
+            elif lb > self.center:
+                to_right.append(interval)
+            else:
+                here.append(interval)
+
+        # intervals overlapping the center, sorted by each endpoint
+        self.by_lb = sorted(here, key=lambda i: i[0])
+        self.by_ub = sorted(here, key=lambda i: i[1], reverse=True)
+        if to_left:
+            self.left = IntervalTree(to_left)
+        if to_right:
+            self.right = IntervalTree(to_right)
+
+    def stab(self, point):
+        '''
+        Find the keys of all intervals containing point.
+
+        Input:
+            point: (int or float) value to look up
+        Returns: (set) keys of the matching intervals
+        '''
+        keys = set()
+        if point != point:
+            # missing values are in no interval
+            return keys
+        node = self
+        while node is not None and node.center is not None:
+            if point < node.center:
+                for lb, _, key in node.by_lb:
+                    if lb > point:
+                        break
+                    keys.add(key)
+                node = node.left
+            elif point > node.center:
+                for _, ub, key in node.by_ub:
+                    if ub < point:
+                        break
+                    keys.add(key)
+                node = node.right
+            else:
+                keys.update(key for _, _, key in node.by_lb)
+                break
+        return keys
+
+
+class SavedSearches:
+    '''
+    Registry of named search criteria with a reverse index used to match
+    new listings against every saved search.
+
+    '''
+    def __init__(self):
+        '''
+        Constructor to initialize an empty registry.
+
+        Attributes:
+            searches (dict): search name to a copy of the criteria dict
+            index (dict): reverse index over the criteria, rebuilt lazily
+                          after the registry changes
+        '''
+        self.searches = {}
+        self.index = None
+
+    def save(self, name, criteria):
+        '''
+        Save (or replace) a search.
+
+        Inputs:
+            name: (str) name of the search, e.g. a family or case id
+            criteria: (Criteria) a user.Criteria object
+        '''
+        self.searches[name] = copy.deepcopy(criteria.dict)
+        self.index = None
+
+    def remove(self, name):
+        '''
+        Remove a saved search.
+
+        Input:
+            name: (str) name of the search
+        '''
+        del self.searches[name]
+        self.index = None
+
+    def build_index(self):
+        '''
+        Build the reverse index over the saved criteria:
+            - an interval tree per range field (rent, bed, bath)
+            - inverted lists per list field (neighborhood, property type)
+            - exact-value lists for address and L-stop distance
+            - the set of searches requiring units available now
+        Each field also records the searches that leave it unset, which
+        match any listing on that field.
+        '''
+        index = {"any": {}}
+        for field in RANGE_FIELDS:
+            intervals = []
+            unset = set()
+            for name, cd in self.searches.items():
+                if cd[field]:
+                    lb, ub = cd[field]
+                    intervals.append((lb, ub, name))
+                else:
+                    unset.add(name)
+            index[field] = IntervalTree(intervals)
+            index["any"][field] = unset
+
+        for field in LIST_FIELDS + ["Address", "Has L-Stop within _ Mile"]:
+            inverted = {}
+            unset = set()
+            for name, cd in self.searches.items():
+                # searches saved before a field existed leave it unset
+                values = cd.get(field)
+                if not values:
+                    unset.add(name)
+                    continue
+                if field not in LIST_FIELDS:
+                    values = [values]
+                for value in values:
+                    inverted.setdefault(value, set()).add(name)
+            index[field] = inverted
+            index["any"][field] = unset
+
+        index["Available Now"] = {name for name, cd in self.searches.items()
+                                  if cd["Available Now"]}
+        self.index = index
+
+    def match(self, listings):
+        '''
+        Match listings against all saved searches.
+
+        Input:
+            listings: (DataFrame) new rows of the locator database
+        Returns:
+            (dict) search name to the list of matching listing ids (see
+                listing_ids). Searches without matches are left out.
+        '''
+        if not self.searches or listings.empty:
+            return {}
+        if self.index is None:
+            self.build_index()
+        ind = self.index
+        everyone = set(self.searches)
+
+        cols = {field: listings[field].tolist() for field in
+                RANGE_FIELDS + LIST_FIELDS + ["Address", "Availability"]}
+        stops = {dist: listings[col].tolist()
+                 for dist, col in DIST_TO_COL.items()}
+
+        matches = {}
+        for i, l_id in enumerate(listing_ids(listings)):
+            candidates = everyone - ind["Available Now"] \
+                if cols["Availability"][i] != "Available Now" else everyone
+
+            for field in RANGE_FIELDS:
+                if not candidates:
+                    break
+                candidates = candidates & (ind[field].stab(cols[field][i]) |
+                                           ind["any"][field])
+
+            for field in LIST_FIELDS + ["Address"]:
+                if not candidates:
+                    break
+                candidates = candidates & (
+                    ind[field].get(cols[field][i], set()) |
+                    ind["any"][field])
+
+            if candidates:
+                field = "Has L-Stop within _ Mile"
+                allowed = set(ind["any"][field])
+                for dist, names in ind[field].items():
+                    if stops[dist][i] > 0:
+                        allowed |= names
+                candidates = candidates & allowed
+
+            for name in candidates:
+                matches.setdefault(name, []).append(l_id)
+
+        return matches
+
+
+def listing_ids(db):
+    '''
+    Listing ids of the rows of a locator database: its ID_COL column as
+    read from the csv, or its index if the csv was read with
+    index_col=ID_COL.
+    '''
+    if ID_COL in db.columns:
+        return db[ID_COL]
+    if db.index.name != ID_COL:
+        raise ValueError("Locator database without a {!r} column of "
+                         "listing ids".format(ID_COL))
+    return db.index.to_series()
+
+
+def new_listings(old_db, new_db):
+    '''
+    Find the listings added by a database build.
+
+    Inputs:
+        old_db: (DataFrame) locator database before the build
+        new_db: (DataFrame) locator database after the build
+    Returns: (DataFrame) rows of new_db whose listing id is not in old_db
+    '''
+    return new_db[~listing_ids(new_db).isin(listing_ids(old_db)).values]
+
+
+def match_new_listings(saved, old_db, new_db):
+    '''
+    Match only the listings added between two database builds against all
+    saved searches.
+
+    Inputs:
+        saved: (SavedSearches) registry of saved searches
+        old_db: (DataFrame) locator database before the build
+        new_db: (DataFrame) locator database after the build
+    Returns: (dict) search name to the list of new matching listing ids
+    '''
+    return saved.match(new_listings(old_db, new_db))
+
+
+def load_saved_searches(filename):
+    '''
+    Load a saved search registry from a pickle file.
+
+    Input: filename (str)
+    Returns: (SavedSearches) the registry
+    '''
+    with open(filename, "rb") as f:
+        return pickle.load(f)
+
+
+def store_saved_searches(saved, filename):
+    '''
+    Store a saved search registry as a pickle file. The reverse index is
+    not stored and is rebuilt on the first match.
+
+    Inputs:
+        saved: (SavedSearches) the registry
+        filename: (str) output filename
+    '''
+    saved.index = None
+    with open(filename, "wb") as f:
+        pickle.dump(saved, f)
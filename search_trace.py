@@ -0,0 +1,317 @@
+'''
+Opt-in tracing of user.search. While enabled, every search records its
+total latency, the time and the rows in and out of each filter it applies,
+and whether it was served from a cache. Traces are aggregated into latency
+histograms and percentiles (p50/p95/p99), exported as JSON or as a
+Prometheus text snapshot.
+
+Disabled tracing costs user.search one check of user.TRACER per filter.
+
+Usage:
+    import search_trace
+    tracer = search_trace.enable()
+    user.search(c, output_filepath)
+    print(tracer.to_prometheus())
+    search_trace.disable()
+
+Aya Liu, Bhargavi Ganesh, and Vedika Ahuja
+
+'''
+import collections
+import json
+import time
+import numpy as np
+import user
+
+# upper bounds in seconds of the latency histogram buckets
+DEF_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+               0.5, 1, 2.5, 5]
+PERCENTILES = [50, 95, 99]
+# number of most recent queries the percentiles are computed over
+DEF_WINDOW = 10000
+METRIC_PREFIX = "locator_search"
+
+
+class QueryTrace:
+    '''
+    Trace of a single search.
+
+    '''
+    def __init__(self, rows):
+        '''
+        Constructor to initialize a QueryTrace object when a search starts.
+
+        Input:
+            rows (int): number of listings searched, None if unknown
+        '''
+        self.start = time.perf_counter()
+        self.rows = rows
+        self.predicates = []
+
+    def predicate(self, field, seconds, rows_in, rows_out):
+        '''
+        Record one filter of the search.
+
+        Inputs:
+            field (str): search field of the filter
+            seconds (float): time spent filtering
+            rows_in, rows_out (int): listings before and after the filter
+        '''
+        self.predicates.append({"field": field, "seconds": seconds,
+                                "rows_in": rows_in, "rows_out": rows_out})
+
+
+class LatencyHistogram:
+    '''
+    Cumulative latency histogram over fixed buckets, with a window of the
+    most recent latencies for percentiles.
+
+    '''
+    def __init__(self, buckets=DEF_BUCKETS, window=DEF_WINDOW):
+        self.buckets = np.asarray(buckets, dtype=float)
+        self.counts = np.zeros(len(buckets) + 1, dtype=np.int64)
+        self.total = 0.0
+        self.recent = collections.deque(maxlen=window)
+
+    def observe(self, seconds):
+        '''
+        Add a latency.
+        '''
+        self.counts[np.searchsorted(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.recent.append(seconds)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentiles(self, percentiles=PERCENTILES):
+        '''
+        Latency percentiles of the recent window.
+
+        Returns: (dict) "p<percentile>" to seconds, None before any query
+        '''
+        if not self.recent:
+            return {"p{}".format(p): None for p in percentiles}
+        values = np.percentile(np.fromiter(self.recent, float), percentiles)
+        return {"p{}".format(p): float(v) for p, v in zip(percentiles, values)}
+
+    def snapshot(self):
+        '''
+        Summary of the histogram as a JSON-serializable dict.
+        '''
+        summary = {"count": self.count, "sum": self.total}
+        summary.update(self.percentiles())
+        summary["buckets"] = {str(le): int(n) for le, n in
+                              zip(list(self.buckets) + ["+Inf"],
+                                  np.cumsum(self.counts))}
+        return summary
+
+
+class SearchTracer:
+    '''
+    Aggregates the traces of all searches since it was created or reset.
+
+    '''
+    def __init__(self, buckets=DEF_BUCKETS, window=DEF_WINDOW):
+        '''
+        Constructor to initialize a SearchTracer object.
+
+        Inputs:
+            buckets (list of floats): latency histogram bucket bounds
+            window (int): number of recent queries kept for percentiles and
+                          for the query log
+        '''
+        self.buckets = buckets
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        '''
+        Drop all recorded traces.
+        '''
+        self.latency = LatencyHistogram(self.buckets, self.window)
+        self.predicate_latency = collections.OrderedDict()
+        self.predicate_rows = collections.OrderedDict()
+        self.cache_hits = 0
+        self.queries = collections.deque(maxlen=self.window)
+
+    def start(self, rows):
+        '''
+        Start the trace of a search over rows listings.
+
+        Returns: (QueryTrace)
+        '''
+        return QueryTrace(rows)
+
+    def finish(self, trace, rows_out, cache_hit=False):
+        '''
+        Record a finished search.
+
+        Inputs:
+            trace (QueryTrace): trace returned by start
+            rows_out (int): number of listings found
+            cache_hit (bool): whether the search was served from a cache
+        '''
+        seconds = time.perf_counter() - trace.start
+        self.latency.observe(seconds)
+        self.cache_hits += bool(cache_hit)
+        for step in trace.predicates:
+            field = step["field"]
+            if field not in self.predicate_latency:
+                self.predicate_latency[field] = LatencyHistogram(
+                    self.buckets, self.window)
+                self.predicate_rows[field] = [0, 0]
+            self.predicate_latency[field].observe(step["seconds"])
+            self.predicate_rows[field][0] += step["rows_in"]
+            self.predicate_rows[field][1] += step["rows_out"]
+        self.queries.append({"seconds": seconds, "rows": trace.rows,
+                             "rows_out": rows_out, "cache_hit": cache_hit,
+                             "predicates": trace.predicates})
+
+    def snapshot(self, queries=False):
+        '''
+        Summary of all traces as a JSON-serializable dict.
+
+        Input:
+            queries (bool): include the log of recent queries
+        Returns: (dict) query and cache hit counts, search latency and, per
+                 filter, latency and total rows in and out
+        '''
+        summary = {"queries": self.latency.count,
+                   "cache_hits": self.cache_hits,
+                   "latency": self.latency.snapshot(),
+                   "predicates": {}}
+        for field, histogram in self.predicate_latency.items():
+            rows_in, rows_out = self.predicate_rows[field]
+            summary["predicates"][field] = {"rows_in": rows_in,
+                                            "rows_out": rows_out,
+                                            "latency": histogram.snapshot()}
+        if queries:
+            summary["recent_queries"] = list(self.queries)
+        return summary
+
+    def to_json(self, filename=None, queries=False):
+        '''
+        Export the snapshot as JSON.
+
+        Inputs:
+            filename (str): output filename, None to only return the JSON
+            queries (bool): include the log of recent queries
+        Returns: (str) the JSON
+        '''
+        text = json.dumps(self.snapshot(queries), indent=2)
+        if filename:
+            with open(filename, "w") as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self):
+        '''
+        Export the aggregates in the Prometheus text exposition format:
+        latency histograms and percentile summaries of searches and of each
+        filter, row counters per filter, and query and cache hit counters.
+
+        Returns: (str)
+        '''
+        lines = []
+        name = METRIC_PREFIX + "_seconds"
+        lines += ["# HELP {} Search latency.".format(name),
+                  "# TYPE {} histogram".format(name)]
+        lines += histogram_lines(name, self.latency, {})
+        name = METRIC_PREFIX + "_predicate_seconds"
+        lines += ["# HELP {} Latency of each search filter.".format(name),
+                  "# TYPE {} histogram".format(name)]
+        for field, histogram in self.predicate_latency.items():
+            lines += histogram_lines(name, histogram, {"predicate": field})
+
+        name = METRIC_PREFIX + "_latency_seconds"
+        lines += ["# HELP {} Search latency percentiles over the last {} "
+                  "queries.".format(name, self.window),
+                  "# TYPE {} summary".format(name)]
+        lines += summary_lines(name, self.latency, {})
+        name = METRIC_PREFIX + "_predicate_latency_seconds"
+        lines += ["# HELP {} Search filter latency percentiles.".format(name),
+                  "# TYPE {} summary".format(name)]
+        for field, histogram in self.predicate_latency.items():
+            lines += summary_lines(name, histogram, {"predicate": field})
+
+        for i, direction in enumerate(["in", "out"]):
+            name = "{}_predicate_rows_{}_total".format(METRIC_PREFIX,
+                                                       direction)
+            lines += ["# HELP {} Listings {} of each search filter.".format(
+                name, "into" if direction == "in" else "left by"),
+                      "# TYPE {} counter".format(name)]
+            lines += ["{}{} {}".format(name, labels({"predicate": field}),
+                                       rows[i])
+                      for field, rows in self.predicate_rows.items()]
+
+        for name, value, text in [
+                ("queries_total", self.latency.count, "Searches traced."),
+                ("cache_hits_total", self.cache_hits,
+                 "Searches served from a cache.")]:
+            name = "{}_{}".format(METRIC_PREFIX, name)
+            lines += ["# HELP {} {}".format(name, text),
+                      "# TYPE {} counter".format(name),
+                      "{} {}".format(name, value)]
+        return "\n".join(lines) + "\n"
+
+
+def histogram_lines(name, histogram, label_dict):
+    '''
+    Prometheus lines of a histogram: cumulative buckets, sum and count.
+    '''
+    lines = []
+    cumulative = np.cumsum(histogram.counts)
+    for le, n in zip(list(histogram.buckets) + ["+Inf"], cumulative):
+        bucket_labels = dict(label_dict, le=str(le))
+        lines.append("{}_bucket{} {}".format(name, labels(bucket_labels), n))
+    lines.append("{}_sum{} {}".format(name, labels(label_dict),
+                                      histogram.total))
+    lines.append("{}_count{} {}".format(name, labels(label_dict),
+                                        histogram.count))
+    return lines
+
+
+def summary_lines(name, histogram, label_dict):
+    '''
+    Prometheus lines of the percentiles of a histogram.
+    '''
+    lines = []
+    for p, value in zip(PERCENTILES, histogram.percentiles().values()):
+        quantile_labels = dict(label_dict, quantile=str(p / 100))
+        lines.append("{}{} {}".format(name, labels(quantile_labels),
+                                      "NaN" if value is None else value))
+    return lines
+
+
+def labels(label_dict):
+    '''
+    Format Prometheus labels, e.g. {predicate="Bed",le="0.01"}.
+    '''
+    if not label_dict:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"'))
+                          for k, v in label_dict.items()) + "}"
+
+
+def enable(tracer=None):
+    '''
+    Start tracing user.search.
+
+    Input:
+        tracer (SearchTracer): tracer to record into (default: a new one)
+    Returns: (SearchTracer) the tracer
+    '''
+    user.TRACER = tracer if tracer is not None else SearchTracer()
+    return user.TRACER
+
+
+def disable():
+    '''
+    Stop tracing user.search.
+
+    Returns: (SearchTracer) the tracer that was recording, or None
+    '''
+    tracer, user.TRACER = user.TRACER, None
+    return tracer
@@ -0,0 +1,254 @@
+'''
+City-sharded layout of the locator database, for running the locator for
+several housing authorities from one deployment.
+
+build_database writes one shard csv per city and records it in the shard
+directory's manifest, next to the shards of other cities built earlier.
+user.search loads only the shards a search touches (through its city,
+neighborhood or address criteria) and keeps the most recently used shards
+in memory, so memory tracks the active cities rather than all of them.
+
+Layout:
+    <shard dir>/manifest.json      city to shard file, rows, neighborhoods,
+                                   cities, counties and bounds
+    <shard dir>/<city>.csv         rows of the locator database csv
+
+Usage:
+    python3 shards.py <locator database csv> <shard dir>
+
+Aya Liu, Bhargavi Ganesh, and Vedika Ahuja
+
+'''
+import argparse
+import collections
+import json
+import os
+import re
+import pandas as pd
+
+MANIFEST = "manifest.json"
+SHARD_KEY = "City"
+DEF_MAX_SHARDS = 4
+# shard of the rows without a value of the key
+NO_KEY = "(missing)"
+
+
+def write_shards(db, shard_dir, key=SHARD_KEY):
+    '''
+    Write one shard per city (or other key) and update the manifest. The
+    shards of cities not in db are kept. Rows without a value of the key
+    go to the NO_KEY shard.
+
+    Inputs:
+        db (DataFrame or iterator of DataFrames): locator database as read
+            from its csv, or its consecutive chunks (pd.read_csv with
+            chunksize)
+        shard_dir (str): shard directory
+        key (str): column the database is sharded on
+    Returns: (dict) the manifest
+    '''
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest = read_manifest(shard_dir)
+    if manifest["shards"] and manifest["key"] != key:
+        raise ValueError("{} is sharded on {}, not {}".format(
+            shard_dir, manifest["key"], key))
+    manifest["key"] = key
+    chunks = [db] if isinstance(db, pd.DataFrame) else db
+    written = {}
+    for chunk in chunks:
+        for city, shard in chunk.groupby(key, sort=True, dropna=False):
+            if pd.isna(city):
+                city = NO_KEY
+            if city not in written:
+                written[city] = {"file": shard_filename(city), "rows": 0,
+                                 "neighborhoods": set(), "cities": set(),
+                                 "counties": set(), "bounds": [None] * 4}
+            entry = written[city]
+            # shards are written next to the old ones and replace them at
+            # the end
+            shard.to_csv(os.path.join(shard_dir, entry["file"] + ".tmp"),
+                         mode="a" if entry["rows"] else "w",
+                         header=not entry["rows"], index=False)
+            entry["rows"] += len(shard)
+            entry["neighborhoods"].update(shard["Neighborhood"].dropna())
+            entry["cities"].update(shard["City"].dropna())
+            entry["counties"].update(shard["County"].dropna())
+            bounds = [shard["Lat"].min(), shard["Long"].min(),
+                      shard["Lat"].max(), shard["Long"].max()]
+            entry["bounds"] = [
+                new if old is None else (min(old, new) if i < 2 else
+                                         max(old, new))
+                for i, (old, new) in enumerate(zip(entry["bounds"], bounds))]
+
+    for city, entry in written.items():
+        os.replace(os.path.join(shard_dir, entry["file"] + ".tmp"),
+                   os.path.join(shard_dir, entry["file"]))
+        entry["neighborhoods"] = sorted(entry["neighborhoods"])
+        entry["cities"] = sorted(entry["cities"])
+        entry["counties"] = sorted(entry["counties"])
+        manifest["shards"][city] = entry
+
+    tmp = os.path.join(shard_dir, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, default=float)
+    os.replace(tmp, os.path.join(shard_dir, MANIFEST))
+    return manifest
+
+
+def read_manifest(shard_dir):
+    '''
+    Read the manifest of a shard directory (empty if there is none yet).
+    '''
+    filename = os.path.join(shard_dir, MANIFEST)
+    if not os.path.exists(filename):
+        return {"key": SHARD_KEY, "shards": {}}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def shard_filename(city):
+    '''
+    Shard filename of a city, e.g. "Chicago" -> "chicago.csv".
+    '''
+    return re.sub(r"[^a-z0-9]+", "_", str(city).lower()).strip("_") + ".csv"
+
+
+class ShardedDB:
+    '''
+    Lazily loaded shards of the locator database with an LRU of the loaded
+    shards. Searches touching several shards keep their concatenated frame
+    in the LRU too, counted as that many shards, so at most max_loaded
+    shards' rows are kept in memory.
+
+    '''
+    def __init__(self, shard_dir, max_loaded=DEF_MAX_SHARDS):
+        '''
+        Constructor to initialize a ShardedDB object.
+
+        Inputs:
+            shard_dir (str): shard directory written by write_shards
+            max_loaded (int): maximum number of shards kept in memory
+        '''
+        self.shard_dir = shard_dir
+        self.max_loaded = max_loaded
+        self.manifest = read_manifest(shard_dir)
+        self.shards = self.manifest["shards"]
+        self.neighborhoods = {nbh for shard in self.shards.values()
+                              for nbh in shard["neighborhoods"]}
+        # tuple of shard names to the frame of their rows
+        self.loaded = collections.OrderedDict()
+
+    def route(self, cd):
+        '''
+        Find the shards a search touches: those containing one of its
+        cities, one of its neighborhoods and the city named in its address,
+        whatever the shards' key. Searches without any of these touch every
+        shard.
+
+        Input:
+            cd (dict): the dict attribute of a user.Criteria
+        Returns: (list of str) shard names, sorted
+        '''
+        names = set(self.shards)
+        if cd.get("City"):
+            names = self.with_cities(names, set(cd["City"]))
+        if cd.get("Neighborhood"):
+            wanted = set(cd["Neighborhood"])
+            names = {name for name in names
+                     if wanted & set(self.shards[name]["neighborhoods"])}
+        if cd.get("Address"):
+            # addresses are "<street>, <city>, <state> <zip>"
+            parts = cd["Address"].split(",")
+            if len(parts) >= 3:
+                names = self.with_cities(names, {parts[-2].strip()})
+        return sorted(names)
+
+    def with_cities(self, names, cities):
+        '''
+        Keep the shards that may contain one of the cities. Shards written
+        without their cities are known only by name when sharded on City.
+        '''
+        kept = set()
+        for name in names:
+            shard = self.shards[name]
+            if "cities" in shard:
+                if cities & set(shard["cities"]):
+                    kept.add(name)
+            elif self.manifest["key"] != SHARD_KEY or name in cities:
+                kept.add(name)
+        return kept
+
+    def is_loaded(self, cd):
+        '''
+        Whether the shards a search touches are already in memory.
+        '''
+        return tuple(self.route(cd)) in self.loaded
+
+    def load(self, cd):
+        '''
+        Get the listings of the shards a search touches, loading them if
+        they are not in memory.
+
+        Input:
+            cd (dict): the dict attribute of a user.Criteria
+        Returns: (DataFrame) rows of the touched shards, in shard order
+        '''
+        names = tuple(self.route(cd))
+        if not names:
+            return self.empty()
+        return self.get(names)
+
+    def shard(self, name):
+        '''
+        Get one shard, loading it if it is not in memory.
+        '''
+        return self.get((name,))
+
+    def get(self, names):
+        '''
+        Get the rows of a tuple of shards, concatenating shards not loaded
+        together before, and evict the least recently used frames beyond
+        max_loaded shards. Shards already in memory on their own are
+        reused rather than read again.
+        '''
+        if names in self.loaded:
+            self.loaded.move_to_end(names)
+            return self.loaded[names]
+        frames = [self.loaded[(name,)] if (name,) in self.loaded
+                  else pd.read_csv(os.path.join(self.shard_dir,
+                                                self.shards[name]["file"]))
+                  for name in names]
+        db = frames[0] if len(frames) == 1 else pd.concat(
+            frames, ignore_index=True)
+        del frames
+        # a frame larger than the whole budget is not kept
+        if len(names) <= self.max_loaded:
+            self.loaded[names] = db
+            while sum(len(key) for key in self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+        return db
+
+    def empty(self):
+        '''
+        Empty frame with the columns of the shards, for searches touching
+        no shard.
+        '''
+        if not self.shards:
+            raise ValueError("No shards in " + self.shard_dir)
+        first = next(iter(self.shards.values()))
+        return pd.read_csv(os.path.join(self.shard_dir, first["file"]),
+                           nrows=0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Shard a locator database by city")
+    parser.add_argument("database_csv")
+    parser.add_argument("shard_dir")
+    parser.add_argument("--key", default=SHARD_KEY,
+                        help="column to shard on, e.g. City or County")
+    args = parser.parse_args()
+    written = write_shards(pd.read_csv(args.database_csv), args.shard_dir,
+                           args.key)
+    for city, entry in written["shards"].items():
+        print("{}: {} rows in {}".format(city, entry["rows"], entry["file"]))
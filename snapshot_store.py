@@ -0,0 +1,374 @@
+'''
+Versioned store of locator database builds, so readers never see a
+half-written database and consumers can pull only what changed.
+
+Each build is written to a staging directory and published as a new,
+immutable snapshot directory; the CURRENT file naming the current snapshot
+is then replaced atomically. Readers resolve CURRENT once and read a
+complete snapshot. Publishing also hashes every row of the database and
+records the change feed against the previous snapshot: the listings added,
+removed, with a new rent ("price_changed"), or otherwise changed. Old
+snapshots are removed by a retention policy (the most recent keep
+snapshots, and any younger than keep_days).
+
+Layout:
+    <store>/CURRENT                       name of the current snapshot
+    <store>/snapshots/<version>/          one directory per build
+        locator_database.csv              the database (and other outputs)
+        row_hashes.csv                    listing index, row hash and rent
+        changes.csv                       change feed against the parent
+        snapshot.json                     version, parent, rows and counts
+
+A store has a single writer (one build at a time); any number of readers.
+
+Usage:
+    python3 snapshot_store.py publish <database csv> [--store STORE]
+                              [--keep N] [--keep-days DAYS]
+    python3 snapshot_store.py list [--store STORE]
+    python3 snapshot_store.py changes <output csv> [--since VERSION]
+                              [--store STORE]
+
+Aya Liu, Bhargavi Ganesh, and Vedika Ahuja
+
+'''
+import argparse
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import pandas as pd
+
+DEF_STORE = "processed_data/store"
+CURRENT = "CURRENT"
+SNAPSHOTS = "snapshots"
+STAGING_PREFIX = ".staging-"
+# snapshots are readable by every user (staging directories are private)
+SNAPSHOT_MODE = 0o755
+DB_FILE = "locator_database.csv"
+HASH_FILE = "row_hashes.csv"
+CHANGES_FILE = "changes.csv"
+META_FILE = "snapshot.json"
+# listing index and rent columns of the database csv
+KEY_COL = "index"
+PRICE_COL = "Monthly Rent"
+# retention: number of most recent snapshots kept
+DEF_KEEP = 7
+CHANGE_TYPES = ["added", "removed", "price_changed", "changed"]
+
+
+def stage(store_dir=DEF_STORE):
+    '''
+    Create a staging directory for a new build. Write the build's outputs
+    into it, then publish it.
+
+    Returns: (str) path of the staging directory
+    '''
+    snapshots = os.path.join(store_dir, SNAPSHOTS)
+    os.makedirs(snapshots, exist_ok=True)
+    return tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=snapshots)
+
+
+def discard(staged_dir):
+    '''
+    Remove a staging directory that will not be published, e.g. of a
+    failed build. Does nothing if it was published (moved) already.
+    '''
+    shutil.rmtree(staged_dir, ignore_errors=True)
+
+
+def publish(staged_dir, store_dir=DEF_STORE, keep=DEF_KEEP, keep_days=None):
+    '''
+    Publish a staged build as the current snapshot: hash its rows, write the
+    change feed against the current snapshot, move it to its version
+    directory and replace CURRENT atomically, then apply the retention
+    policy.
+
+    Inputs:
+        staged_dir (str): staging directory from stage, with DB_FILE
+        store_dir (str): store directory
+        keep (int): number of most recent snapshots kept
+        keep_days (float): also keep snapshots younger than this many days
+    Returns: (str) version of the new snapshot
+    '''
+    hashes = row_hashes(read_db(os.path.join(staged_dir, DB_FILE)))
+    parent = current_version(store_dir)
+    if parent:
+        changes = diff_hashes(read_hashes(store_dir, parent), hashes)
+    else:
+        changes = diff_hashes(None, hashes)
+    hashes.to_csv(os.path.join(staged_dir, HASH_FILE), index=False)
+    changes.to_csv(os.path.join(staged_dir, CHANGES_FILE), index=False)
+
+    version = new_version(store_dir)
+    created = datetime.datetime.now(datetime.timezone.utc)
+    meta = {"version": version, "parent": parent,
+            "created": created.isoformat(), "rows": len(hashes),
+            "changes": changes["change"].value_counts().reindex(
+                CHANGE_TYPES, fill_value=0).to_dict()}
+    with open(os.path.join(staged_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2, default=int)
+    os.chmod(staged_dir, SNAPSHOT_MODE)
+    os.rename(staged_dir, snapshot_path(store_dir, version))
+    set_current(store_dir, version)
+    prune(store_dir, keep, keep_days)
+    return version
+
+
+def publish_file(database_csv, store_dir=DEF_STORE, keep=DEF_KEEP,
+                 keep_days=None):
+    '''
+    Publish an existing database csv as a new snapshot.
+
+    Returns: (str) version of the new snapshot
+    '''
+    staged_dir = stage(store_dir)
+    try:
+        shutil.copyfile(database_csv, os.path.join(staged_dir, DB_FILE))
+        return publish(staged_dir, store_dir, keep, keep_days)
+    finally:
+        discard(staged_dir)
+
+
+def new_version(store_dir):
+    '''
+    Name of a new snapshot: the UTC time of publishing, which sorts in
+    publishing order, with a zero-padded counter (so it still sorts) past
+    those of the retained snapshots of that second.
+    '''
+    version = datetime.datetime.now(datetime.timezone.utc).strftime(
+        "%Y%m%dT%H%M%SZ")
+    same_second = [name for name in os.listdir(
+        os.path.join(store_dir, SNAPSHOTS)) if name.startswith(version)]
+    if not same_second:
+        return version
+    return "{}-{:04d}".format(version, max(
+        int(name[len(version) + 1:] or 0) for name in same_second) + 1)
+
+
+def set_current(store_dir, version):
+    '''
+    Point CURRENT to a snapshot, replacing the file atomically.
+    '''
+    tmp = os.path.join(store_dir, CURRENT + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(store_dir, CURRENT))
+
+
+def current_version(store_dir=DEF_STORE):
+    '''
+    Version of the current snapshot, None for an empty store.
+    '''
+    filename = os.path.join(store_dir, CURRENT)
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        return f.read().strip() or None
+
+
+def current_path(store_dir=DEF_STORE, filename=DB_FILE):
+    '''
+    Path of a file of the current snapshot, e.g. its database csv.
+    '''
+    version = current_version(store_dir)
+    if version is None:
+        raise FileNotFoundError("No snapshot published in " + store_dir)
+    return os.path.join(snapshot_path(store_dir, version), filename)
+
+
+def snapshot_path(store_dir, version):
+    '''
+    Directory of a snapshot.
+    '''
+    return os.path.join(store_dir, SNAPSHOTS, version)
+
+
+def list_snapshots(store_dir=DEF_STORE):
+    '''
+    Metadata of the published snapshots, oldest first (by publishing time,
+    then version).
+
+    Returns: (list of dicts) contents of each snapshot's META_FILE
+    '''
+    snapshots = os.path.join(store_dir, SNAPSHOTS)
+    if not os.path.isdir(snapshots):
+        return []
+    metas = []
+    for name in sorted(os.listdir(snapshots)):
+        filename = os.path.join(snapshots, name, META_FILE)
+        if not name.startswith(STAGING_PREFIX) and os.path.exists(filename):
+            with open(filename) as f:
+                metas.append(json.load(f))
+    metas.sort(key=lambda meta: (
+        datetime.datetime.fromisoformat(meta["created"]), meta["version"]))
+    return metas
+
+
+def prune(store_dir=DEF_STORE, keep=DEF_KEEP, keep_days=None):
+    '''
+    Remove the snapshots outside the retention policy: all but the keep
+    most recent and (with keep_days) those younger than keep_days. The
+    current snapshot is always kept.
+
+    Returns: (list of str) versions removed
+    '''
+    current = current_version(store_dir)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    metas = list_snapshots(store_dir)
+    removed = []
+    for meta in metas[:max(len(metas) - keep, 0)]:
+        age = now - datetime.datetime.fromisoformat(meta["created"])
+        if meta["version"] == current or (keep_days is not None and
+                                          age.total_seconds() <
+                                          keep_days * 86400):
+            continue
+        shutil.rmtree(snapshot_path(store_dir, meta["version"]))
+        removed.append(meta["version"])
+    return removed
+
+
+def read_db(filename):
+    '''
+    Read a database csv as text, so rows hash the same however their
+    values would be parsed.
+    '''
+    return pd.read_csv(filename, dtype=str, keep_default_na=False)
+
+
+def row_hashes(db):
+    '''
+    Hash every row of the database.
+
+    Input:
+        db (DataFrame): database read with read_db
+    Returns: (DataFrame) listing index, 64-bit hash of the row's values
+             and rent, one row per listing
+    '''
+    db = db[~db[KEY_COL].duplicated()]
+    return pd.DataFrame({
+        KEY_COL: db[KEY_COL].values,
+        "row_hash": pd.util.hash_pandas_object(db.drop(columns=KEY_COL),
+                                               index=False).values,
+        PRICE_COL: db[PRICE_COL].values})
+
+
+def read_hashes(store_dir, version):
+    '''
+    Read the row hashes of a snapshot.
+    '''
+    return pd.read_csv(
+        os.path.join(snapshot_path(store_dir, version), HASH_FILE),
+        dtype={KEY_COL: str, "row_hash": "uint64", PRICE_COL: str},
+        keep_default_na=False)
+
+
+def diff_hashes(old, new):
+    '''
+    Compute the change feed between the row hashes of two snapshots.
+
+    Inputs:
+        old (DataFrame): row hashes of the earlier snapshot (None for none)
+        new (DataFrame): row hashes of the later snapshot
+    Returns: (DataFrame) listing index, change (one of CHANGE_TYPES) and
+             the old and new rent, one row per changed listing
+    '''
+    if old is None:
+        old = new.iloc[:0]
+    # aligned on the listing index, so the 64-bit hashes are compared
+    # exactly
+    old = old.set_index(KEY_COL)
+    new = new.set_index(KEY_COL)
+    common = new.index.intersection(old.index, sort=False)
+    old_common, new_common = old.loc[common], new.loc[common]
+    changed = old_common["row_hash"].values != new_common["row_hash"].values
+    price = old_common[PRICE_COL].values != new_common[PRICE_COL].values
+    parts = [
+        ("added", new.index.difference(old.index, sort=False)),
+        ("removed", old.index.difference(new.index, sort=False)),
+        ("price_changed", common[changed & price]),
+        ("changed", common[changed & ~price])]
+    feed = pd.concat([pd.DataFrame({
+        KEY_COL: keys, "change": change,
+        "old_rent": old[PRICE_COL].reindex(keys).values,
+        "new_rent": new[PRICE_COL].reindex(keys).values})
+        for change, keys in parts], ignore_index=True)
+    return feed
+
+
+def pull(since=None, store_dir=DEF_STORE):
+    '''
+    Get what changed since a snapshot a consumer already has: the change
+    feed between it and the current snapshot, and the current rows of the
+    added and changed listings.
+
+    Inputs:
+        since (str): version the consumer has, None for none (every
+                     listing is added)
+        store_dir (str): store directory
+    Returns: (tuple) current version, change feed (see diff_hashes) and
+             DataFrame of the current rows of the added or changed listings
+    '''
+    version = current_version(store_dir)
+    if version is None:
+        raise FileNotFoundError("No snapshot published in " + store_dir)
+    old = None
+    if since:
+        if not os.path.isdir(snapshot_path(store_dir, since)):
+            raise ValueError("Snapshot {} is no longer retained; read the "
+                             "full database".format(since))
+        old = read_hashes(store_dir, since)
+    changes = diff_hashes(old, read_hashes(store_dir, version))
+    db = pd.read_csv(current_path(store_dir), dtype={KEY_COL: str})
+    rows = db[db[KEY_COL].isin(changes.loc[changes["change"] != "removed",
+                                           KEY_COL])]
+    return version, changes, rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Versioned snapshots of the locator database")
+    store = argparse.ArgumentParser(add_help=False)
+    store.add_argument("--store", default=DEF_STORE,
+                       help="store directory (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    publish_cmd = commands.add_parser(
+        "publish", parents=[store],
+        help="publish a database csv as the current snapshot")
+    publish_cmd.add_argument("database_csv")
+    publish_cmd.add_argument("--keep", type=int, default=DEF_KEEP,
+                             help="number of most recent snapshots kept")
+    publish_cmd.add_argument("--keep-days", type=float, default=None,
+                             help="also keep snapshots younger than this")
+    commands.add_parser("list", parents=[store],
+                        help="list the snapshots")
+    changes_cmd = commands.add_parser(
+        "changes", parents=[store],
+        help="write the changes since a snapshot to a csv")
+    changes_cmd.add_argument("output")
+    changes_cmd.add_argument("--since", default=None,
+                             help="version to diff against (default: the "
+                             "current snapshot's parent)")
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        version = publish_file(args.database_csv, args.store, args.keep,
+                               args.keep_days)
+        print("published {}".format(version))
+    elif args.command == "list":
+        current = current_version(args.store)
+        for meta in list_snapshots(args.store):
+            print("{}{} {} rows {}".format(
+                "* " if meta["version"] == current else "  ",
+                meta["version"], meta["rows"], meta["changes"]))
+    else:
+        if args.since:
+            _, changes, _ = pull(args.since, args.store)
+        else:
+            changes = pd.read_csv(current_path(args.store, CHANGES_FILE),
+                                  dtype=str)
+        changes.to_csv(args.output, index=False)
+        print("{} changes written to {}".format(len(changes), args.output))
@@ -0,0 +1,261 @@
+'''
+Seeded generator of a synthetic city inside the Chicago bounding box, in
+the formats of the real data sources, for benchmarking the pipeline at
+scales beyond the real snapshot:
+
+    - CHA rental listings (pickled listing dictionary, as cha_scraper
+      writes it)
+    - CTA L-stops csv
+    - problem landlords csv
+    - Census block group geojson and Eviction Lab block group csv
+    - Zillow neighborhood shapefile and Zillow Rent Index csv
+    - block group to neighborhood lookup, as written by preprocess_geometry
+
+Usage:
+    python3 synthetic_city.py <output dir> <number of listings> [--seed N]
+
+Aya Liu, Bhargavi Ganesh, Vedika Ahuja
+'''
+
+import argparse
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import geopandas
+from shapely.geometry import box
+import user
+
+# Chicago bounding box: min long, min lat, max long, max lat
+CHI_BOUNDS = (-87.94, 41.64, -87.52, 42.02)
+# block groups and zillow neighborhoods are grid cells of the bounding box
+DEF_BLOCK_GRID = (40, 40)
+DEF_NEIGH_GRID = (8, 8)
+DEF_STOPS = 300
+# one problem landlord per this many listings
+LISTINGS_PER_LANDLORD = 250
+DEF_SEED = 0
+
+# filenames in the output directory
+CITY_FILES = {"cha": "CHA_rental_data.obj",
+              "lstops": "CTA_L_stops_locations.csv",
+              "landlords": "problem_landlords.csv",
+              "blocks": "block-groups.geojson",
+              "evictions": "block-groups.csv",
+              "zillow_geo": "ZillowNeighborhoods-IL.shp",
+              "zillow": "Neighborhood_Zri_AllHomesPlusMultifamily.csv",
+              "lookup": "block_group_lookup.csv"}
+# listing id corrected by hand in process_cha_data.load_and_clean_cha
+CORRECTED_ID = "4545145"
+
+
+def generate_city(output_dir, n_listings, seed=DEF_SEED,
+                  block_grid=DEF_BLOCK_GRID, neigh_grid=DEF_NEIGH_GRID,
+                  n_stops=DEF_STOPS):
+    '''
+    Write all data sources of a synthetic city.
+
+    Inputs:
+        output_dir (str): output directory
+        n_listings (int): number of CHA listings
+        seed (int): random seed; the same seed gives the same city
+        block_grid (tuple): columns and rows of block groups
+        neigh_grid (tuple): columns and rows of zillow neighborhoods
+        n_stops (int): number of L-stops
+    Returns: (dict) data source to filename, keys of CITY_FILES
+    '''
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {key: os.path.join(output_dir, filename)
+             for key, filename in CITY_FILES.items()}
+
+    if block_grid[0] % neigh_grid[0] or block_grid[1] % neigh_grid[1]:
+        raise ValueError("Block group grid must refine neighborhood grid")
+    blocks = grid_cells(block_grid)
+    blocks['GEOID'] = ["17031{:07d}".format(i) for i in range(len(blocks))]
+    blocks[['GEOID', 'geometry']].to_file(paths["blocks"], driver="GeoJSON")
+    block_group_table(blocks['GEOID'], rng).to_csv(paths["evictions"],
+                                                  index=False)
+
+    neighborhoods = grid_cells(neigh_grid)
+    neighborhoods['RegionID'] = [str(300000 + i)
+                                 for i in range(len(neighborhoods))]
+    names = sorted(user.NBH)
+    neighborhoods['Name'] = [names[i % len(names)] if i < len(names) else
+                             "Neighborhood {}".format(i)
+                             for i in range(len(neighborhoods))]
+    neighborhoods['State'] = "IL"
+    neighborhoods['County'] = "Cook"
+    neighborhoods['City'] = "Chicago"
+    neighborhoods.to_file(paths["zillow_geo"])
+    rent_index_table(neighborhoods, rng).to_csv(paths["zillow"], index=False)
+
+    # each block group lies inside one neighborhood cell
+    col, row = np.divmod(np.arange(len(blocks)), block_grid[1])
+    neigh = (col * neigh_grid[0] // block_grid[0]) * neigh_grid[1] + \
+            row * neigh_grid[1] // block_grid[1]
+    lookup = neighborhoods[['Name', 'RegionID']].iloc[neigh]
+    lookup.insert(0, 'GEOID', blocks['GEOID'].values)
+    lookup.to_csv(paths["lookup"], index=False)
+
+    with open(paths["cha"], "wb") as f:
+        pickle.dump(listings(n_listings, rng), f)
+    l_stops(n_stops, rng).to_csv(paths["lstops"], index=False)
+    landlords(max(1, n_listings // LISTINGS_PER_LANDLORD), rng).to_csv(
+        paths["landlords"], index=False)
+
+    return paths
+
+
+def grid_cells(grid):
+    '''
+    Split the Chicago bounding box into a grid of rectangles.
+
+    Input: grid (tuple): number of columns and rows
+    Returns: (GeoDataFrame) one row per cell
+    '''
+    minx, miny, maxx, maxy = CHI_BOUNDS
+    xs = np.linspace(minx, maxx, grid[0] + 1)
+    ys = np.linspace(miny, maxy, grid[1] + 1)
+    cells = [box(xs[i], ys[j], xs[i + 1], ys[j + 1])
+             for i in range(grid[0]) for j in range(grid[1])]
+    return geopandas.GeoDataFrame(geometry=cells, crs="EPSG:4326")
+
+
+def random_points(n, rng):
+    '''
+    Draw n lat, long points inside the bounding box.
+    '''
+    minx, miny, maxx, maxy = CHI_BOUNDS
+    return rng.uniform(miny, maxy, n), rng.uniform(minx, maxx, n)
+
+
+def listings(n, rng):
+    '''
+    Generate a CHA rental listing dictionary, mapping listing id to the
+    attributes scraped by cha_scraper (with Long positive, as scraped).
+    '''
+    lat, lon = random_points(n, rng)
+    bed = rng.integers(0, 6, n)
+    bath = rng.choice([1.0, 1.5, 2.0, 2.5, 3.0], n)
+    rent = (600 + 250 * bed + rng.normal(0, 150, n)).round().astype(int)
+    ptypes = rng.choice(user.PTYPES, n)
+    available = rng.random(n) < .2
+    ids = [str(4000000 + i) for i in range(n)]
+    if n:
+        ids[0] = CORRECTED_ID
+
+    hd = {}
+    for i, l_id in enumerate(ids):
+        hd[l_id] = {
+            'Address': "{} S Synthetic St, Chicago, IL 606{:02d}".format(
+                i, i % 100),
+            'Voucher Necessary': 'Yes',
+            'Lat': round(float(lat[i]), 4),
+            'Long': round(float(-lon[i]), 4),
+            'Monthly Rent': int(rent[i]),
+            'Contact': None,
+            'Property Type': str(ptypes[i]),
+            'Bath': float(bath[i]),
+            'Bed': float(bed[i]),
+            'Availability': 'Available Now' if available[i] else
+                            'Check Availability',
+            'URL': "http://chicagoha.gosection8.com/listing/" + l_id}
+    return hd
+
+
+def l_stops(n, rng):
+    '''
+    Generate an L-stops table in the format of the CTA list of L stops.
+    '''
+    lat, lon = random_points(n, rng)
+    return pd.DataFrame({
+        'STOP_ID': np.arange(30000, 30000 + n),
+        'STOP_NAME': ["Stop {}".format(i) for i in range(n)],
+        'Location': ["({:.6f}, {:.6f})".format(a, b)
+                     for a, b in zip(lat, lon)]})
+
+
+def landlords(n, rng):
+    '''
+    Generate a problem landlords table in the format of the city's
+    building code scofflaw list.
+    '''
+    lat, lon = random_points(n, rng)
+    return pd.DataFrame({
+        'ADDRESS': ["{} W Scofflaw Ave".format(i) for i in range(n)],
+        'LONGITUDE': lon,
+        'LATITUDE': lat})
+
+
+def block_group_table(geoids, rng):
+    '''
+    Generate Eviction Lab block group data for 2016.
+    '''
+    n = len(geoids)
+    population = rng.integers(300, 3000, n).astype(float)
+    renters = (population * rng.uniform(.2, .6, n)).round()
+    race = rng.dirichlet([2, 2, 2, 1, 1], n) * 100
+    evictions = rng.poisson(renters * .02).astype(float)
+    filings = evictions + rng.poisson(renters * .01)
+    return pd.DataFrame({
+        'GEOID': geoids.values,
+        'year': '2016',
+        'name': ["{}.{}".format(i // 10, i % 10) for i in range(n)],
+        'parent-location': 'Cook County, Illinois',
+        'population': population,
+        'poverty-rate': rng.uniform(2, 50, n).round(2),
+        'renter-occupied-households': renters,
+        'pct-renter-occupied': (renters / population * 100).round(2),
+        'median-gross-rent': rng.integers(600, 2000, n).astype(float),
+        'median-household-income': rng.integers(15000, 120000,
+                                                n).astype(float),
+        'median-property-value': rng.integers(50000, 600000,
+                                              n).astype(float),
+        'rent-burden': rng.uniform(20, 50, n).round(1),
+        'pct-white': race[:, 0].round(2),
+        'pct-af-am': race[:, 1].round(2),
+        'pct-hispanic': race[:, 2].round(2),
+        'pct-am-ind': 0.0,
+        'pct-asian': race[:, 3].round(2),
+        'pct-nh-pi': 0.0,
+        'pct-multiple': race[:, 4].round(2),
+        'pct-other': 0.0,
+        'eviction-filings': filings,
+        'evictions': evictions,
+        'eviction-rate': (evictions / renters * 100).round(2),
+        'eviction-filing-rate': (filings / renters * 100).round(2),
+        'low-flag': 0,
+        'imputed': 0,
+        'subbed': 0})
+
+
+def rent_index_table(neighborhoods, rng):
+    '''
+    Generate Zillow Rent Index data (January of each year) for the
+    neighborhoods.
+    '''
+    n = len(neighborhoods)
+    table = pd.DataFrame({'RegionID': neighborhoods['RegionID'].values,
+                          'RegionName': neighborhoods['Name'].values,
+                          'City': 'Chicago',
+                          'State': 'IL',
+                          'Metro': 'Chicago',
+                          'CountyName': 'Cook County'})
+    rent = rng.integers(900, 2500, n).astype(float)
+    for year in range(2011, 2020):
+        table['{}-01'.format(year)] = rent.round().astype(int)
+        rent *= rng.uniform(.98, 1.06, n)
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic city for benchmarks")
+    parser.add_argument("output_dir")
+    parser.add_argument("n_listings", type=int)
+    parser.add_argument("--seed", type=int, default=DEF_SEED)
+    args = parser.parse_args()
+    for source, path in generate_city(args.output_dir, args.n_listings,
+                                      args.seed).items():
+        print("{}: {}".format(source, path))
@@ -0,0 +1,11 @@
+'''
+Test setup: the modules are imported from the repository root and read
+their data files relative to it.
+
+'''
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
@@ -0,0 +1,39 @@
+'''
+Tests of cha_details.
+
+'''
+import json
+import pytest
+import cha_details
+
+LISTINGS = {"4100011": {"Address": "1718 W 66th St 1, Chicago, IL 60636",
+                        "Monthly Rent": 800},
+            "4100024": {"Address": "6130 S Eberhart Ave 1, Chicago, IL 60637",
+                        "Monthly Rent": 1200}}
+
+
+def write_jsonl(path, tail=""):
+    with open(path, "w") as f:
+        for l_id, listing in LISTINGS.items():
+            f.write(json.dumps(dict(listing, id=l_id)) + "\n")
+        f.write(tail)
+
+
+def test_load_listings_jsonl(tmp_path):
+    path = str(tmp_path / "listings.jsonl")
+    write_jsonl(path)
+    assert cha_details.load_listings(path) == LISTINGS
+
+
+def test_load_listings_torn_last_line(tmp_path):
+    # an interrupted scrape tears its last line
+    path = str(tmp_path / "listings.jsonl")
+    write_jsonl(path, '{"Address": "428 E 45th')
+    assert cha_details.load_listings(path) == LISTINGS
+
+
+def test_load_listings_bad_line_inside(tmp_path):
+    path = str(tmp_path / "listings.jsonl")
+    write_jsonl(path, '{"Address": "428 E 45th\n{"id": "4100127"}\n')
+    with pytest.raises(ValueError):
+        cha_details.load_listings(path)
@@ -0,0 +1,158 @@
+'''
+Tests of cha_scraper against the stand-in server (fixture_server.py)
+serving the saved result pages of tests/fixtures/cha_pages: four pages of
+three listings, linked by Prev/Next pager buttons.
+
+'''
+import json
+import os
+import shutil
+import pytest
+import cha_scraper
+import fixture_server
+import http_client
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "cha_pages")
+START_PATH = "/Tenant/tn_Results.aspx"
+NUM_LISTINGS = 12
+
+
+@pytest.fixture
+def site(tmp_path):
+    '''
+    Serve a copy of the saved pages, which a test may change.
+
+    Returns: (tuple) directory of the served pages and root url
+    '''
+    pages = str(tmp_path / "pages")
+    shutil.copytree(FIXTURES, pages)
+    server, root_url = fixture_server.serve(pages)
+    yield pages, root_url
+    server.shutdown()
+
+
+@pytest.fixture
+def pg_site(tmp_path):
+    '''
+    Serve the saved pages with pager links using a "pg" query parameter
+    rather than "page".
+
+    Returns: (tuple) directory of the served pages and root url
+    '''
+    pages = str(tmp_path / "pg_pages")
+    os.makedirs(pages)
+    for filename in os.listdir(FIXTURES):
+        with open(os.path.join(FIXTURES, filename)) as f:
+            html = f.read().replace("?page=", "?pg=")
+        with open(os.path.join(pages, filename.replace("%3Fpage%3D",
+                                                       "%3Fpg%3D")), "w") as f:
+            f.write(html)
+    server, root_url = fixture_server.serve(pages)
+    yield pages, root_url
+    server.shutdown()
+
+
+def crawl_args(root_url):
+    return {"root_url": root_url, "concurrency": 2, "delay": 0,
+            "parse_workers": 1}
+
+
+def page_file(pages, root_url, page):
+    return os.path.join(pages, fixture_server.page_filename(
+        "{}{}?page={}".format(root_url, START_PATH, page)))
+
+
+def test_scrape(site):
+    _, root_url = site
+    hd = cha_scraper.scrape(root_url + START_PATH, **crawl_args(root_url))
+    assert len(hd) == NUM_LISTINGS
+    assert hd["4100011"] == {
+        "Address": "1718 W 66th St 1, Chicago, IL 60636",
+        "Monthly Rent": 800, "Bed": 2.0, "Bath": 1.0,
+        "Property Type": "Apt", "Voucher Necessary": "Yes",
+        "Availability": "Available Now", "Contact": "(773) 555-0101",
+        "URL": root_url + "/Section-8-housing-in-Chicago-IL/4100011",
+        "Lat": 41.7736, "Long": -87.6683}
+    assert hd["4100037"]["Bed"] == 0
+    assert hd["4100024"]["Contact"] is None
+    assert hd["4100063"]["Voucher Necessary"] == "No"
+
+
+@pytest.mark.parametrize("backend", ["lxml", "xpath"])
+def test_backends_agree(site, backend):
+    _, root_url = site
+    start = root_url + START_PATH
+    assert cha_scraper.scrape(start, backend=backend,
+                              **crawl_args(root_url)) == \
+        cha_scraper.scrape(start, **crawl_args(root_url))
+
+
+def test_scrape_missing_page(site):
+    pages, root_url = site
+    os.remove(page_file(pages, root_url, 3))
+    with pytest.raises(http_client.FetchError):
+        cha_scraper.scrape(root_url + START_PATH, **crawl_args(root_url))
+
+
+def test_scrape_to_file_resume(site, tmp_path):
+    pages, root_url = site
+    start = root_url + START_PATH
+    output = str(tmp_path / "listings.jsonl")
+    checkpoint = str(tmp_path / "checkpoint.json")
+    missing = page_file(pages, root_url, 3)
+    shutil.move(missing, missing + ".away")
+
+    # pages 3 (missing) and 4 (only linked from page 3) are left to crawl
+    with pytest.raises(http_client.FetchError):
+        cha_scraper.scrape_to_file(start, output, checkpoint,
+                                   **crawl_args(root_url))
+    state = cha_scraper.load_checkpoint(checkpoint)
+    assert state["pending"] == ["{}?page=3".format(start)]
+    # a line torn by a crash after the checkpoint
+    with open(output, "a") as f:
+        f.write('{"Address": "428 E 45th')
+
+    shutil.move(missing + ".away", missing)
+    assert cha_scraper.scrape_to_file(start, output, checkpoint,
+                                      **crawl_args(root_url)) == 2
+    with open(output) as f:
+        ids = [json.loads(line)["id"] for line in f]
+    assert sorted(ids) == sorted(cha_scraper.scrape(
+        start, **crawl_args(root_url)))
+    assert cha_scraper.scrape_to_file(start, output, checkpoint,
+                                      **crawl_args(root_url)) == 0
+
+
+def test_scrape_delta_stops_after_unchanged_pages(pg_site):
+    _, root_url = pg_site
+    start = root_url + START_PATH
+    first = cha_scraper.scrape_delta(start, {}, None, **crawl_args(root_url))
+    assert len(first["added"]) == NUM_LISTINGS and first["complete"]
+
+    # pages 1 and 2 are unchanged: stop before the last two
+    delta = cha_scraper.scrape_delta(start, first["fingerprints"], 2,
+                                     **crawl_args(root_url))
+    assert not delta["complete"]
+    assert delta["added"] == {} and delta["removed"] == []
+    assert delta["fingerprints"] == first["fingerprints"]
+
+
+def test_scrape_delta_changed_page(pg_site):
+    pages, root_url = pg_site
+    start = root_url + START_PATH
+    first = cha_scraper.scrape_delta(start, {}, None, **crawl_args(root_url))
+    page2 = os.path.join(pages, fixture_server.page_filename(
+        "{}?pg=2".format(START_PATH)))
+    with open(page2) as f:
+        html = f.read()
+    with open(page2, "w") as f:
+        f.write(html.replace("$950", "$975"))
+
+    # the changed page 2 resets the unchanged run, which pages 3 and 4 do
+    # not complete
+    delta = cha_scraper.scrape_delta(start, first["fingerprints"], 3,
+                                     **crawl_args(root_url))
+    assert delta["complete"]
+    assert list(delta["changed"]) == ["4100058"]
+    assert delta["changed"]["4100058"]["Monthly Rent"] == 975
+    assert delta["removed"] == []
@@ -0,0 +1,48 @@
+'''
+Tests of saved_search.
+
+'''
+import pandas as pd
+import pytest
+import saved_search
+import user
+
+DB_CSV = "processed_data/locator_database.csv"
+
+
+@pytest.fixture(scope="module")
+def db():
+    return pd.read_csv(DB_CSV, nrows=200)
+
+
+def everything():
+    criteria = user.Criteria()
+    criteria.set_criteria({})
+    return criteria
+
+
+def test_new_listings_removed_in_middle(db):
+    # the old database had a listing the new one lacks: nothing is new
+    new_db = db.drop(index=100).reset_index(drop=True)
+    assert saved_search.new_listings(db, new_db).empty
+
+
+def test_new_listings_inserted_in_middle(db):
+    old_db = db.drop(index=[50, 120]).reset_index(drop=True)
+    new = saved_search.new_listings(old_db, db)
+    assert list(new["index"]) == [db.loc[50, "index"], db.loc[120, "index"]]
+
+
+def test_match_new_listings_returns_listing_ids(db):
+    saved = saved_search.SavedSearches()
+    saved.save("all", everything())
+    old_db = db.drop(index=50).reset_index(drop=True)
+    assert saved_search.match_new_listings(saved, old_db, db) == {
+        "all": [db.loc[50, "index"]]}
+
+
+def test_listing_ids_from_index_col(db):
+    indexed = db.set_index("index")
+    assert list(saved_search.listing_ids(indexed)) == list(db["index"])
+    with pytest.raises(ValueError):
+        saved_search.listing_ids(db.drop(columns="index"))
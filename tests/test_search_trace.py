@@ -0,0 +1,55 @@
+'''
+Tests of search_trace through user.search.
+
+'''
+import pandas as pd
+import pytest
+import locator_sqlite
+import search_trace
+import snapshot_store
+import user
+
+DB_CSV = "processed_data/locator_database.csv"
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    '''
+    Trace searches, restoring the database and tracer of user afterwards.
+    '''
+    for name in ["DB", "DB_CSV", "STORE", "SHARDS", "TRACER"]:
+        monkeypatch.setattr(user, name, getattr(user, name))
+    return search_trace.enable(search_trace.SearchTracer())
+
+
+def chicago():
+    criteria = user.Criteria()
+    criteria.set_criteria({"City": ["Chicago"]})
+    return criteria
+
+
+def test_cache_hit_follows_store(tracer, tmp_path):
+    db_csv = str(tmp_path / "db.csv")
+    pd.read_csv(DB_CSV, nrows=50).to_csv(db_csv, index=False)
+    store = str(tmp_path / "store")
+    snapshot_store.publish_file(db_csv, store)
+    user.use_store(store)
+    output = str(tmp_path / "out.csv")
+    user.search(chicago(), output)
+    user.search(chicago(), output)
+    # a newly published snapshot is read, not served from memory
+    snapshot_store.publish_file(db_csv, store)
+    user.search(chicago(), output)
+    user.search(chicago(), output, fused=True)
+    assert [q["cache_hit"] for q in tracer.queries] == [False, True, False,
+                                                        True]
+    assert [q["rows"] for q in tracer.queries] == [50] * 4
+
+
+def test_sqlite_rows_unknown(tracer, tmp_path):
+    sqlite_db = str(tmp_path / "db.sqlite")
+    locator_sqlite.write_sqlite(pd.read_csv(DB_CSV, nrows=50), sqlite_db)
+    user.search(chicago(), str(tmp_path / "out.csv"), sqlite_db=sqlite_db)
+    query, = tracer.queries
+    assert query["rows"] is None and query["rows_out"] == 50
+    assert not query["cache_hit"]
@@ -0,0 +1,52 @@
+'''
+Tests of shards.
+
+'''
+import pandas as pd
+import pytest
+import shards
+
+DB_CSV = "processed_data/locator_database.csv"
+
+
+@pytest.fixture(scope="module")
+def db():
+    '''
+    Listings of three cities in two counties.
+    '''
+    db = pd.read_csv(DB_CSV, nrows=90)
+    db["City"] = ["Chicago", "Evanston", "Cicero"] * 30
+    db["County"] = db["City"].map({"Chicago": "Cook County",
+                                   "Evanston": "Cook County",
+                                   "Cicero": "Suburban County"})
+    return db
+
+
+def test_route_on_county_key(db, tmp_path):
+    shards.write_shards(db, str(tmp_path), key="County")
+    sdb = shards.ShardedDB(str(tmp_path))
+    assert sdb.route({"City": ["Evanston"]}) == ["Cook County"]
+    assert sdb.route({"City": ["Cicero", "Chicago"]}) == [
+        "Cook County", "Suburban County"]
+    address = db.loc[db["City"] == "Cicero", "Address"].iloc[0]
+    address = address.replace("Chicago", "Cicero")
+    assert sdb.route({"Address": address}) == ["Suburban County"]
+    assert sdb.route({"City": ["Skokie"]}) == []
+    rows = sdb.load({"City": ["Evanston"]})
+    assert len(rows) == 60 and set(rows["City"]) == {"Chicago", "Evanston"}
+
+
+def test_rows_without_key(db, tmp_path):
+    db = db.copy()
+    db.loc[:9, "City"] = None
+    manifest = shards.write_shards(db, str(tmp_path))
+    assert manifest["shards"][shards.NO_KEY]["rows"] == 10
+    sdb = shards.ShardedDB(str(tmp_path))
+    assert len(sdb.load({})) == len(db)
+    assert sdb.route({"City": ["Chicago"]}) == ["Chicago"]
+
+
+def test_key_change_raises(db, tmp_path):
+    shards.write_shards(db, str(tmp_path))
+    with pytest.raises(ValueError):
+        shards.write_shards(db, str(tmp_path), key="County")
@@ -0,0 +1,34 @@
+'''
+Tests of the problem landlord flags of transit_and_landlord.
+
+'''
+import numpy as np
+import pandas as pd
+import pytest
+import transit_and_landlord as trl
+
+UNITS = pd.DataFrame({"Lat": [41.8, 41.9, np.nan],
+                      "Long": [-87.6, -87.7, -87.7]}, index=[10, 11, 12])
+
+
+@pytest.mark.parametrize("landlords", [
+    pd.DataFrame({"Lat": [], "Long": [], "Address": []}, dtype=object),
+    pd.DataFrame({"Lat": [np.nan], "Long": [np.nan], "Address": ["x"]})])
+def test_flags_without_located_landlords(landlords):
+    apt_to_ll = trl.flag_bad_landlords(UNITS, landlords, 0.015)
+    assert list(apt_to_ll["ind_apt"]) == ["10", "11", "12"]
+    assert not apt_to_ll["potential_bad_landlord"].any()
+    assert apt_to_ll["Address_ll"].isna().all()
+    calibration = trl.landlord_calibration(UNITS, landlords, [0.01, 0.1])
+    assert list(calibration["units_flagged"]) == [0, 0]
+
+
+def test_flags_nearest_address():
+    # two landlords within the threshold of unit 10, the second nearer
+    landlords = pd.DataFrame({"Lat": [41.8001, 41.80002, 42.5],
+                              "Long": [-87.6, -87.6, -87.6],
+                              "Address": ["far", "near", "elsewhere"]})
+    apt_to_ll = trl.flag_bad_landlords(UNITS, landlords, 0.015)
+    assert list(apt_to_ll["potential_bad_landlord"]) == [True, False, False]
+    assert apt_to_ll["Address_ll"][0] == "near"
+    assert apt_to_ll["Address_ll"][1:].isna().all()
@@ -9,6 +9,10 @@ Data from:
 '''
 import pandas as pd
 import numpy as np
+from scipy.spatial import cKDTree
+
+# radius of the Earth in miles, as used by haversine
+EARTH_RADIUS_MI = 0.621371 * 6367
 
 
 def clean_L_stations(L_stations_csv):
@@ -199,6 +203,20 @@ def compute_num_stations(cha, l_stations_filepath):
             
     '''
     l_stations = clean_L_stations(l_stations_filepath)
+    return count_stations(cha, l_stations)
+
+
+def count_stations(cha, l_stations):
+    '''
+    Compute the number of stations within .25, .5, .75 and 1 mile of each
+    housing unit, with the L stations already read and cleaned.
+
+    Inputs: 
+        - cha: (DataFrame)
+        - l_stations: (DataFrame) from clean_L_stations
+
+    Returns: apt_w_l_stations (DataFrame)
+    '''
     df = create_cross_join(cha, l_stations, ("_apt", "_stop")) 
     df['distance'] = haversine(df["Long_apt"], df["Lat_apt"], 
                                df["Long_stop"], df["Lat_stop"])
@@ -225,9 +243,188 @@ def flag_potential_bad_landlord(cha, problem_landlords_filepath, threshold):
         - apt_to_ll: (DataFrame)
     '''
     landlords_df = read_clean_landlords(problem_landlords_filepath)
-    ll_match = landlords_apt_fuzzy_match(cha, landlords_df, threshold)
-    apts = cha.reset_index().rename(columns={"index": "ind_apt"}).filter(["ind_apt"])
-    apt_to_ll = pd.merge(apts, ll_match, how="left", on="ind_apt")
-    apt_to_ll['potential_bad_landlord'].fillna(False, inplace=True)
+    return flag_bad_landlords(cha, landlords_df, threshold)
+
+
+def flag_bad_landlords(cha, landlords_df, threshold, nearest=None):
+    '''
+    Flag units with potential problem landlords, with the problem landlords
+    already read and cleaned. A unit is flagged when its nearest problem
+    landlord (from the k-d tree of nearest_landlord) is within threshold,
+    i.e. exactly when any problem landlord is.
+
+    Inputs: 
+        - cha: (DataFrame) 
+        - landlords_df: (DataFrame) from read_clean_landlords
+        - threshold (float): fuzzy match threshold in miles
+        - nearest: (DataFrame) from nearest_landlord, computed if missing
+
+    Returns: 
+        - apt_to_ll: (DataFrame) housing unit indices mapped to the flag 
+            and, for flagged units, the nearest problem landlord address
+    '''
+    if nearest is None:
+        nearest = nearest_landlord(cha, landlords_df)
+    flagged = (nearest["nearest_ll_distance"] <= threshold).values
+    apt_to_ll = pd.DataFrame({
+        "ind_apt": nearest["ind_apt"].values,
+        "potential_bad_landlord": flagged,
+        "Address_ll": nearest["nearest_ll_address"].where(flagged).values})
 
     return apt_to_ll
+
+
+def to_unit_sphere(lat, lon):
+    '''
+    Converts lat, lon points to 3d points on the unit sphere, where the 
+    straight-line (chord) distance between points grows with their 
+    haversine distance.
+
+    Inputs: lat, lon (arrays of floats)
+    Returns: (n x 3 array)
+    '''
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), 
+                            np.cos(lat) * np.sin(lon), 
+                            np.sin(lat)])
+
+
+def chord_to_miles(chord):
+    '''
+    Converts chord distances on the unit sphere to haversine miles.
+    '''
+    return 2 * np.arcsin(np.minimum(chord, 2) / 2) * EARTH_RADIUS_MI
+
+
+def miles_to_chord(mi):
+    '''
+    Converts haversine miles to chord distances on the unit sphere.
+    '''
+    return 2 * np.sin(np.asarray(mi) / EARTH_RADIUS_MI / 2)
+
+
+def nearest_landlord(cha, landlords_df):
+    '''
+    Find the nearest problem landlord location of each housing unit, 
+    using a k-d tree of the landlord locations instead of a cross join.
+
+    Inputs: 
+        - cha: (DataFrame)
+        - landlords_df: (DataFrame) from read_clean_landlords
+    Returns: (DataFrame) housing unit indices mapped to the distance in 
+        miles to the nearest problem landlord and its address (missing for 
+        units without coordinates; infinite distance and missing address 
+        if no problem landlord has coordinates)
+    '''
+    landlords_df = landlords_df.dropna(subset=["Lat", "Long"])
+    nearest = pd.DataFrame({"ind_apt": cha.index.astype(str), 
+                            "nearest_ll_distance": np.nan, 
+                            "nearest_ll_address": None})
+    located = (cha["Lat"].notna() & cha["Long"].notna()).values
+    if landlords_df.empty:
+        # no problem landlord is near any unit
+        nearest.loc[located, "nearest_ll_distance"] = np.inf
+        return nearest
+
+    tree = cKDTree(to_unit_sphere(landlords_df["Lat"].values, 
+                                  landlords_df["Long"].values))
+    chord, ll_row = tree.query(to_unit_sphere(cha["Lat"].values[located], 
+                                              cha["Long"].values[located]))
+    nearest.loc[located, "nearest_ll_distance"] = chord_to_miles(chord)
+    nearest.loc[located, "nearest_ll_address"] = \
+        landlords_df["Address"].values[ll_row]
+
+    return nearest
+
+
+def landlord_flags(nearest, thresholds):
+    '''
+    Flag units with potential problem landlords for several thresholds at 
+    once: a unit has a problem landlord within a threshold exactly when 
+    its nearest one is.
+
+    Inputs: 
+        - nearest: (DataFrame) from nearest_landlord
+        - thresholds: (list of floats) fuzzy match thresholds in miles
+    Returns: (DataFrame) housing unit indices mapped to one 
+        potential_bad_landlord_<threshold> column per threshold
+    '''
+    flags = nearest["nearest_ll_distance"].values[:, None] <= \
+            np.asarray(thresholds)[None, :]
+    columns = ["potential_bad_landlord_{}".format(t) for t in thresholds]
+    apt_flags = pd.DataFrame(flags, columns=columns)
+    apt_flags.insert(0, "ind_apt", nearest["ind_apt"].values)
+
+    return apt_flags
+
+
+def landlord_calibration(cha, landlords_df, thresholds, nearest=None):
+    '''
+    Tabulate matches against the fuzzy match threshold, to pick the 
+    threshold from the data. The unit-to-landlord distances are computed 
+    once (for the largest threshold) and sorted; each threshold is then a 
+    binary search.
+
+    Inputs: 
+        - cha: (DataFrame)
+        - landlords_df: (DataFrame) from read_clean_landlords
+        - thresholds: (list of floats) fuzzy match thresholds in miles
+        - nearest: (DataFrame) from nearest_landlord, computed if missing
+    Returns: (DataFrame) for each threshold, the number and share of units 
+        flagged, the number of unit-landlord pairs matched (rows of 
+        landlords_apt_fuzzy_match) and the number of landlords matched 
+    '''
+    if nearest is None:
+        nearest = nearest_landlord(cha, landlords_df)
+    thresholds = np.sort(np.asarray(thresholds, dtype=float))
+    landlords_df = landlords_df.dropna(subset=["Lat", "Long"])
+    cha = cha.dropna(subset=["Lat", "Long"])
+    ll_tree = cKDTree(to_unit_sphere(landlords_df["Lat"].values, 
+                                     landlords_df["Long"].values))
+    apt_tree = cKDTree(to_unit_sphere(cha["Lat"].values, cha["Long"].values))
+
+    pairs = apt_tree.sparse_distance_matrix(
+        ll_tree, miles_to_chord(thresholds[-1]), output_type="ndarray")
+    pair_dist = np.sort(chord_to_miles(pairs["v"]))
+    ll_chord, _ = apt_tree.query(to_unit_sphere(landlords_df["Lat"].values, 
+                                                landlords_df["Long"].values))
+    ll_dist = np.sort(chord_to_miles(ll_chord))
+    apt_dist = np.sort(nearest["nearest_ll_distance"].dropna().values)
+
+    calibration = pd.DataFrame({
+        "threshold": thresholds,
+        "units_flagged": np.searchsorted(apt_dist, thresholds, side="right"),
+        "matched_pairs": np.searchsorted(pair_dist, thresholds, 
+                                         side="right"),
+        "landlords_matched": np.searchsorted(ll_dist, thresholds, 
+                                             side="right")})
+    calibration.insert(2, "share_units_flagged", 
+                       calibration["units_flagged"] / len(nearest))
+
+    return calibration
+
+
+def landlord_threshold_sweep(cha, problem_landlords_filepath, thresholds):
+    '''
+    Compute each unit's nearest problem landlord once, and derive the 
+    flags and the calibration table for a list of thresholds from it.
+
+    Inputs: 
+        - cha: (DataFrame) 
+        - problem_landlords_filepath (csv)
+        - thresholds (list of floats): fuzzy match thresholds in miles
+
+    Returns: 
+        - apt_to_ll: (DataFrame) housing unit indices mapped to the nearest 
+            problem landlord distance and address, and one flag per 
+            threshold
+        - calibration: (DataFrame) matches vs threshold, see 
+            landlord_calibration
+    '''
+    landlords_df = read_clean_landlords(problem_landlords_filepath)
+    nearest = nearest_landlord(cha, landlords_df)
+    apt_to_ll = nearest.merge(landlord_flags(nearest, thresholds), 
+                              on="ind_apt")
+    calibration = landlord_calibration(cha, landlords_df, thresholds, nearest)
+
+    return apt_to_ll, calibration
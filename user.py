@@ -4,93 +4,227 @@ User functions to search the locator
 Aya Liu, Bhargavi Ganesh, and Vedika Ahuja
 
 '''
+import time
 import pandas as pd
-
-# initialize database
-DB = pd.read_csv("processed_data/locator_database.csv")
+import fused_scan
+import locator_sqlite
+import shards
+import snapshot_store
+from locator_sqlite import DIST_TO_COL, USER_COLS
+
+# database, read on the first search of the csv (searches of the SQLite
+# store never load it)
+DB_CSV = "processed_data/locator_database.csv"
+DB = None
+# sharded database (shards.ShardedDB) searched instead of DB_CSV when set
+# with use_shards
+SHARDS = None
+# versioned store (snapshot_store.py) whose current snapshot is searched
+# instead of DB_CSV when set with use_store
+STORE = None
 
 # setup constants for input type check
 Z = pd.read_csv("data/Neighborhood_Zri_AllHomesPlusMultifamily.csv",
                 usecols=["City", "RegionName"])
 NBH = Z[Z.City == 'Chicago'].groupby('RegionName').groups.keys()
 PTYPES = ["4-Plex", "Apt", "Duplex", "House", "Townhouse", "TriPlex"]
-DIST_TO_COL = {0.25: "num_stops_quart_mi",
-               0.5: "num_stops_half_mi",
-               0.75: "num_stops_3quart_mi",
-               1: "num_stops_1_mi"}
+# search tracer (search_trace.SearchTracer), None when tracing is disabled
+TRACER = None
 
-def search(criteria, output_filepath):
+def search(criteria, output_filepath, sqlite_db=None, limit=None,
+           fused=False, facets=False):
     '''
     Search for rental unit listings that satisfies specific
     criteria and stores results as a csv file.
 
     Inputs:
         criteria (Criteria): a Criteria object
-        db (DataFrame): affordable rental unit locator database
+        output_filepath (str): output csv filename
+        sqlite_db (str): search this SQLite store (locator_sqlite.py)
+                         instead of the database csv
+        limit (int): maximum number of listings, None for all
+        fused (bool): evaluate all filters in one pass over the database's
+                      arrays (fused_scan.py) instead of one by one
+        facets (bool): also count the matches by neighborhood, property
+                       type, bed count and rent bucket in the same pass
+                       (implies fused)
 
     Returns:
-        (DataFrame): listing search results
+        (dict) with facets, facet name to a DataFrame of the "count" of
+        matches by facet value and the "what_if" count without the facet's
+        own filter; None otherwise
 
     '''
-    rv = DB
-    cd = criteria.dict
-
-    if cd["Address"]:
-        fil1 = rv.Address == cd["Address"]
-        rv = rv[fil1]
-
-    if cd["Monthly Rent"]:
-        lb_rent, ub_rent = cd["Monthly Rent"]
-        fil2 = (rv["Monthly Rent"] >= lb_rent) & (
-            rv["Monthly Rent"] <= ub_rent)
-        rv = rv[fil2]
-
-    if cd["Property Type"]:
-        fil3 = rv["Property Type"].isin(cd["Property Type"])
-        rv = rv[fil3]
-
-    if cd["Bath"]:
-        lb_bath, ub_bath = cd["Bath"]
-        fil4 = (rv.Bath >= lb_bath) & (rv.Bath <= ub_bath)
-        rv = rv[fil4]
-
-    if cd["Bed"]:
-        lb_bed, ub_bed = cd["Bed"]
-        fil5 = (rv.Bed >= lb_bed) & (rv.Bed <= ub_bed)
-        rv = rv[fil5]
-
-    if cd["Available Now"]:
-        fil6 = rv.Availability == "Available Now"
-        rv = rv[fil6]
-
-    if cd["Neighborhood"]:
-        fil7 = rv.Neighborhood.isin(cd["Neighborhood"])
-        rv = rv[fil7]
-
-    if cd["Has L-Stop within _ Mile"]:
-        dist = cd["Has L-Stop within _ Mile"]
-        fil8 = rv[DIST_TO_COL[dist]] > 0
-        rv = rv[fil8]
+    # only the csv database (or its shards) is cached in memory between
+    # searches; load_db tells whether it had to read it
+    cache_hit = []
+    # the number of listings searched is not known for the SQLite store
+    trace = TRACER.start(None) if TRACER else None
+    counts = None
+    if sqlite_db and facets:
+        raise ValueError("Facets are counted over the database csv, not "
+                         "the SQLite store")
+
+    if sqlite_db:
+        # all filters run in one SQL query, traced as a whole
+        con = locator_sqlite.connect(sqlite_db)
+        try:
+            rv = locator_sqlite.query(criteria, con, limit=limit)
+        finally:
+            con.close()
+    elif fused or facets:
+        rv = load_db(criteria.dict, cache_hit)
+        if trace:
+            trace.rows, start = len(rv), time.perf_counter()
+        if facets:
+            rv, counts = fused_scan.facet_scan(rv, criteria.dict, USER_COLS,
+                                               limit)
+        else:
+            rv = fused_scan.scan(rv, criteria.dict, USER_COLS, limit)
+        if trace:
+            trace.predicate("fused", time.perf_counter() - start, trace.rows,
+                            len(rv))
+    else:
+        rv = load_db(criteria.dict, cache_hit)
+        cd = criteria.dict
+        if trace:
+            trace.rows = len(rv)
+        for field, predicate in PREDICATES:
+            if cd[field]:
+                if trace:
+                    rows_in, start = len(rv), time.perf_counter()
+                rv = rv[predicate(rv, cd[field])]
+                if trace:
+                    trace.predicate(field, time.perf_counter() - start,
+                                    rows_in, len(rv))
+        rv = rv[USER_COLS]
+        if limit is not None:
+            rv = rv.head(limit)
 
     if rv.empty:
         print("No listing found")
-        return
     else:
-        cols_for_user = ['Address', 'Monthly Rent', 'Property Type',
-                         'Bath', 'Bed', 'Availability', 'Contact',
-                         'URL', 'State', 'County', 'City', 'Neighborhood',
-                         '2016_evict_rate', 'er_percentile',
-                         '2016_evict_filing_rate', 'efr_percentile',
-                         '2011-2015_rent_perc_change',
-                         '2015-2019_rent_perc_change',
-                         'potential_bad_landlord', 'bad_landlord_address',
-                         'num_stops_quart_mi', 'num_stops_half_mi',
-                         'num_stops_3quart_mi', 'num_stops_1_mi']
-        rv = rv[cols_for_user]
         rv.to_csv(output_filepath)
         print("{} search results saved in {}".format(
             len(rv), output_filepath))
 
+    if trace:
+        TRACER.finish(trace, len(rv), cache_hit=any(cache_hit))
+    return counts
+
+
+def load_db(cd=None, cache_hit=None):
+    '''
+    Get the locator database, reading it from DB_CSV the first time. With
+    shards, get the shards touched by the criteria dictionary cd. With a
+    snapshot store, read its current snapshot.
+
+    If cache_hit (list) is given, whether the database was already in
+    memory (rather than read) is appended to it.
+    '''
+    global DB, DB_CSV
+    if SHARDS:
+        hit = SHARDS.is_loaded(cd or {})
+        db = SHARDS.load(cd or {})
+    else:
+        if STORE:
+            # a newly published snapshot is read on the next search
+            filename = snapshot_store.current_path(STORE)
+            if filename != DB_CSV:
+                DB_CSV, DB = filename, None
+        hit = DB is not None
+        if DB is None:
+            DB = pd.read_csv(DB_CSV)
+        db = DB
+    if cache_hit is not None:
+        cache_hit.append(hit)
+    return db
+
+
+def use_shards(shard_dir, max_loaded=shards.DEF_MAX_SHARDS):
+    '''
+    Search a city-sharded database (shards.py) instead of DB_CSV, keeping
+    at most max_loaded shards in memory. Neighborhoods of every shard
+    become valid criteria. Pass None to go back to DB_CSV.
+    '''
+    global SHARDS
+    SHARDS = shards.ShardedDB(shard_dir, max_loaded) if shard_dir else None
+    return SHARDS
+
+
+def use_store(store_dir):
+    '''
+    Search the current snapshot of a versioned store (snapshot_store.py)
+    instead of DB_CSV, switching to newer snapshots as they are published.
+    Pass None to stop following the store (DB_CSV stays the last snapshot
+    read).
+    '''
+    global STORE
+    STORE = store_dir
+    return STORE
+
+
+# search filters: each takes the listings and the criteria value and
+# returns a boolean mask of the listings to keep
+def filter_address(rv, address):
+    '''Listings at the address.'''
+    return rv.Address == address
+
+
+def filter_rent(rv, bounds):
+    '''Listings with rent within (min, max).'''
+    lb_rent, ub_rent = bounds
+    return (rv["Monthly Rent"] >= lb_rent) & (rv["Monthly Rent"] <= ub_rent)
+
+
+def filter_property_type(rv, ptypes):
+    '''Listings of one of the property types.'''
+    return rv["Property Type"].isin(ptypes)
+
+
+def filter_bath(rv, bounds):
+    '''Listings with a number of bathrooms within (min, max).'''
+    lb_bath, ub_bath = bounds
+    return (rv.Bath >= lb_bath) & (rv.Bath <= ub_bath)
+
+
+def filter_bed(rv, bounds):
+    '''Listings with a number of bedrooms within (min, max).'''
+    lb_bed, ub_bed = bounds
+    return (rv.Bed >= lb_bed) & (rv.Bed <= ub_bed)
+
+
+def filter_available_now(rv, _):
+    '''Listings available now.'''
+    return rv.Availability == "Available Now"
+
+
+def filter_neighborhood(rv, neighborhoods):
+    '''Listings in one of the neighborhoods.'''
+    return rv.Neighborhood.isin(neighborhoods)
+
+
+def filter_city(rv, cities):
+    '''Listings in one of the cities.'''
+    return rv.City.isin(cities)
+
+
+def filter_l_stop(rv, dist):
+    '''Listings with an L-stop within dist miles.'''
+    return rv[DIST_TO_COL[dist]] > 0
+
+
+# search fields and their filters, in the order they are applied
+PREDICATES = [("Address", filter_address),
+              ("Monthly Rent", filter_rent),
+              ("Property Type", filter_property_type),
+              ("Bath", filter_bath),
+              ("Bed", filter_bed),
+              ("Available Now", filter_available_now),
+              ("Neighborhood", filter_neighborhood),
+              ("City", filter_city),
+              ("Has L-Stop within _ Mile", filter_l_stop)]
+
 
 class Criteria:
     '''
@@ -118,6 +252,8 @@ class Criteria:
                     whether the unit is available now
             - Neighborhood (list of str):
                     a list containing one or more of the zillow neighborhoods
+            - City (list of str):
+                    a list containing one or more cities, e.g. "Chicago"
             - Has L-Stop within _ Mile (float):
                     one of the following: 0.25, 0.5, 0.75, 1
 
@@ -129,6 +265,7 @@ class Criteria:
                      "Bed": None,
                      "Available Now": None,
                      "Neighborhood": None,
+                     "City": None,
                      "Has L-Stop within _ Mile": None}
 
     def set_criteria(self, field_to_value):
@@ -159,6 +296,7 @@ class Criteria:
                      "Bed": None,
                      "Available Now": None,
                      "Neighborhood": None,
+                     "City": None,
                      "Has L-Stop within _ Mile": None}
         print("All search fields are now cleared")
 
@@ -237,11 +375,23 @@ class Criteria:
                                 "Neighborhood input should be a list")
             elif len(value) == 0:
                 raise ValueError("Cannot set empty list as criteria")
-            elif not all(elem in NBH for elem in value):
+            elif not all(elem in NBH or (SHARDS and
+                                         elem in SHARDS.neighborhoods)
+                         for elem in value):
                 errmsg = "Wrong input value for Neighborhood\n" + \
                         "Input a list containing the following: " + str(NBH)
                 raise ValueError(errmsg)
 
+        if field == "City":
+            if not isinstance(value, list):
+                raise TypeError("Wrong intput type - " + \
+                                "City input should be a list")
+            elif len(value) == 0:
+                raise ValueError("Cannot set empty list as criteria")
+            elif not all(isinstance(elem, str) for elem in value):
+                raise TypeError("Wrong input type - " + \
+                                "City input should be a list of str")
+
         if field == "Has L-Stop within _ Mile":
             if value not in DIST_TO_COL:
                 errmsg = "Wrong input value for distance to L-stop\n" + \